@@ -0,0 +1,416 @@
+import argparse
+import json
+import os
+import pickle
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import py2web as pw
+
+# Benchmarks for the rectangle tree walk used by the html/css/js render
+# passes. Run with `python bench.py`. The suite of synthetic workloads is run
+# with `python bench.py --suite`, see bench_suite.
+
+def build_deep_tree(depth):
+    app = pw.Application()
+    for i in range(depth):
+        rect = app.push_rectangle()
+        rect.set_size([10, 10])
+    for i in range(depth):
+        app.pop_rectangle()
+    return app
+
+def build_wide_tree(num_rects, fanout=10):
+    app = pw.Application()
+    # Breadth-first fill so that every rectangle has fanout children.
+    parents = [app.root_id]
+    count   = 0
+    while count < num_rects:
+        next_parents = []
+        for parent_id in parents:
+            for i in range(fanout):
+                rect = app._create_rectangle(parent_id)
+                rect.set_size([10, 10])
+                next_parents.append(rect.rect_id)
+                count += 1
+                if count == num_rects:
+                    return app
+        parents = next_parents
+    return app
+
+# The walk as it was done before the iterative walker, kept here as a
+# reference point.
+def recursive_walk(app, rect_id):
+    yield rect_id, True
+    for child_id in app.rectangles.children(rect_id):
+        yield from recursive_walk(app, child_id)
+    yield rect_id, False
+
+def recursive_walk_flat(app, rect_id, visit):
+    visit(rect_id, True)
+    for child_id in app.rectangles.children(rect_id):
+        recursive_walk_flat(app, child_id, visit)
+    visit(rect_id, False)
+
+def timeit(func):
+    start = time.perf_counter()
+    try:
+        func()
+    except RecursionError:
+        return None
+    return time.perf_counter() - start
+
+def consume(iterable):
+    for _ in iterable:
+        pass
+
+def report(name, seconds):
+    if seconds is None:
+        print(f'  {name:<24} RecursionError')
+    else:
+        print(f'  {name:<24} {1000.0 * seconds:10.2f} ms')
+
+def bench_walk(name, app):
+    num_rects = len(app.rectangles)
+    print(f'{name} ({num_rects} rectangles)')
+    report('iterative walk', timeit(lambda: consume(app._walk_rectangles(app.root_id))))
+    report('recursive generator', timeit(lambda: consume(recursive_walk(app, app.root_id))))
+    report('recursive calls', timeit(lambda: recursive_walk_flat(app, app.root_id, lambda r, e: None)))
+    report('render', timeit(app.render))
+    report('parallel render', timeit(lambda: app.render(max_workers=None, split_depth=2)))
+
+    # Saving the tree to a binary file, and loading it back.
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'tree.bin')
+        report('save', timeit(lambda: app.save(path)))
+        report('load', timeit(lambda: pw.load(path)))
+        report('pickle', timeit(lambda: pickle.loads(pickle.dumps(app))))
+
+    # Rendering again after changing the text of one rectangle.
+    def edit_and_render():
+        app.rectangles.rectangle(num_rects // 2).set_text('edited')
+        app.render_incremental()
+    app.render_incremental()
+    report('incremental render', timeit(edit_and_render))
+
+# A page of the site benchmark, with a header common to all pages.
+def build_site_page(app):
+    with app.rectangle('header') as header:
+        header.set_size([pw.ViewportWidth, 60])
+        header.set_layout(pw.Layout.ROW)
+        for i in range(10):
+            with app.rectangle(f'menu{i}') as item:
+                item.set_text(f'Item {i}')
+            app.spacer(30)
+    for i in range(200):
+        with app.rectangle(class_name='row') as row:
+            row.set_size([500, 20])
+            row.set_text(f'Row {i}')
+
+def bench_site(num_pages):
+    pages = [(f'page{i}/index.html', build_site_page) for i in range(num_pages)]
+    print(f'site ({num_pages} pages)')
+    for max_workers in [1, None]:
+        with tempfile.TemporaryDirectory() as directory:
+            summary = pw.build_site(pages, directory, max_workers=max_workers)['summary']
+        name = 'serial build' if max_workers == 1 else 'parallel build'
+        print(f'  {name:<24} {summary["pages_per_sec"]:10.2f} pages/s')
+
+# A page of projects like the one of test_layout.py, whose images, texts and
+# links are the slots of a template, see Application.compile_template.
+def build_template_page(num_projects):
+    app = pw.Application()
+    with app.rectangle('main_content') as main_content:
+        main_content.set_layout(pw.Layout.COLUMN)
+        for i in range(num_projects):
+            with app.rectangle(f'project{i}', class_name='project') as project:
+                project.set_layout(pw.Layout.ROW)
+                with app.rectangle(f'project{i}_image') as image:
+                    image.set_image(pw.slot(f'image{i}'))
+                    image.set_width(200)
+                with app.rectangle(f'project{i}_text') as text:
+                    text.set_width(518)
+                    text.set_text(pw.slot(f'text{i}', escape=False))
+                with app.rectangle(f'project{i}_link') as link:
+                    link.set_link(pw.slot(f'link{i}'))
+                    link.set_text(pw.slot(f'title{i}'))
+            app.spacer(50)
+    return app
+
+def bench_template(num_records, num_projects=7):
+    print(f'template ({num_records} records)')
+    records = []
+    for r in range(num_records):
+        record = {}
+        for i in range(num_projects):
+            record[f'image{i}'] = f'files/{r}_{i}.png'
+            record[f'text{i}']  = f'<p>Project {i} of record {r}</p>'
+            record[f'link{i}']  = f'projects/{r}/{i}'
+            record[f'title{i}'] = f'Project {i} & co'
+        records.append(record)
+
+    def build_and_render():
+        for record in records[:num_records // 100]:
+            build_template_page(num_projects).render()
+    seconds = timeit(build_and_render)
+    print(f'  {"build and render":<24} {num_records // 100 / seconds:10.2f} records/s')
+
+    template = build_template_page(num_projects).compile_template()
+    seconds = timeit(lambda: consume(template.render_html(record) for record in records))
+    print(f'  {"template":<24} {num_records / seconds:10.2f} records/s')
+
+# Generators of the workloads of the benchmark suite. Each creates a
+# document of roughly size rectangles.
+
+def generate_wide(size):
+    return build_wide_tree(size)
+
+def generate_deep(size):
+    return build_deep_tree(size)
+
+# Forms of labelled inputs.
+def generate_forms(size):
+    app = pw.Application()
+    for i in range(size // 10):
+        with app.form(f'form{i}') as form:
+            form.set_layout(pw.Layout.COLUMN)
+            textbox, label = app.textbox_input(f'name{i}')
+            label.set_text('Name')
+            textbox.set_input_value('john')
+            checkbox, label = app.checkbox_input(f'subscribe{i}')
+            label.set_text('Subscribe')
+            checkbox.set_input_checked()
+            radio, label = app.radio_input(f'choice{i}')
+            label.set_text('Choice')
+            submit, label = app.submit_input(f'submit{i}')
+            label.set_text('Send')
+    return app
+
+# Rectangles positioned relative to the measured size of their previous
+# siblings, in groups of 10.
+def generate_expressions(size):
+    app = pw.Application()
+    for i in range(size // 11):
+        with app.rectangle() as group:
+            group.set_size([pw.ViewportWidth * 0.5, pw.ViewportHeight - 10])
+            top = 0
+            for j in range(10):
+                with app.rectangle() as rect:
+                    rect.set_text(f'Text {j}')
+                    rect.set_position([0.5 * group.get_size()[0] - 0.5 * rect.get_size()[0], top])
+                    top = top + rect.get_size()[1] + 5
+    return app
+
+# Rectangles whose sizes all use the same few subexpressions.
+def generate_shared_expressions(size):
+    app = pw.Application()
+    with app.rectangle('header') as header:
+        header.set_text('Header')
+    half  = 0.5 * pw.ViewportWidth - header.get_size()[0]
+    third = pw.min(half, pw.ViewportHeight / 3)
+    for i in range(size - 2):
+        with app.rectangle() as rect:
+            rect.set_size([half + i % 7, third * (1 + i % 3)])
+    return app
+
+# Rectangles with many style properties, in a few variants.
+def generate_styles(size):
+    app = pw.Application()
+    for i in range(size - 1):
+        with app.rectangle(class_name='item') as rect:
+            rect.set_size([100 + i % 5, 20])
+            rect.set_fill_color(i % 3, 40, 34)
+            rect.set_text_color(248, 248, 242)
+            rect.set_font('Roboto')
+            rect.set_font_size(12 + i % 4)
+            rect.set_text_alignment('center')
+            rect.style['text-decoration'] = 'none'
+            rect.style['border-radius'] = f'{i % 2}px'
+            rect.set_text(f'Item {i}')
+    return app
+
+# Rows of a listing, created while rendering, 1000 at a time.
+def listing_rows(app, size):
+    for i in range(size):
+        with app.rectangle() as row:
+            row.set_size([500, 20])
+            row.set_text(f'Row {i}')
+        if i % 1000 == 999:
+            yield
+
+# A listing whose rows are created lazily, see Application.lazy_rectangle.
+def generate_lazy_listing(size):
+    app = pw.Application()
+    listing = app.lazy_rectangle(listing_rows, size - 2)
+    listing.set_layout(pw.Layout.COLUMN)
+    return app
+
+def virtual_list_row(app, i):
+    with app.rectangle() as row:
+        row.set_size([500, 20])
+        row.set_text(f'Row {i}')
+
+# A listing of which only a window of rows is rendered as html, see
+# Application.virtual_list.
+def generate_virtual_list(size):
+    app = pw.Application()
+    listing = app.virtual_list(virtual_list_row, range(size - 4), row_height=20)
+    listing.set_size([500, pw.ViewportHeight])
+    return app
+
+def tile(app, i):
+    with app.rectangle(class_name='tile') as tile:
+        tile.set_size([200, 100])
+        tile.set_text(f'Tile {i}')
+
+# Tiles in rows of 10, nested in a column with spacers between them.
+def generate_tiles(size):
+    app = pw.Application()
+    num_tiles = size * 10 // 21
+    with app.rectangle() as column:
+        column.set_layout(pw.Layout.COLUMN)
+        for start in range(0, num_tiles, 10):
+            with app.rectangle() as row:
+                row.set_layout(pw.Layout.ROW)
+                for i in range(start, min(start + 10, num_tiles)):
+                    if i > start:
+                        app.spacer(10)
+                    tile(app, i)
+            app.spacer(10)
+    return app
+
+# The same tiles as generate_tiles, as the cells of a single grid.
+def generate_grid(size):
+    app = pw.Application()
+    with app.rectangle() as grid:
+        grid.set_grid([200] * 10, gap=10)
+        for i in range(size * 10 // 21):
+            tile(app, i)
+    return app
+
+generators = {
+    'wide':               generate_wide,
+    'deep':               generate_deep,
+    'forms':              generate_forms,
+    'expressions':        generate_expressions,
+    'shared_expressions': generate_shared_expressions,
+    'styles':             generate_styles,
+    'lazy_listing':       generate_lazy_listing,
+    'virtual_list':       generate_virtual_list,
+    'tiles':              generate_tiles,
+    'grid':               generate_grid,
+}
+
+# Renders the document with the profiler, returning the time of each phase
+# of the render, such as resolving the geometry, sharing css and the html,
+# css and js passes, the time of the whole render, and the bytes of each
+# stream of render_iter.
+def time_render_passes(app, **kwargs):
+    sizes = {'html': 0, 'css': 0, 'js': 0}
+    with app.profile() as profiler:
+        for stream, chunk in app.render_iter(**kwargs):
+            sizes[stream] += len(chunk)
+    phases = profiler.report()['phases']
+    times = {name: phase['time'] for name, phase in phases.items() if name != 'render'}
+    return times, phases['render']['time'], sizes
+
+# Runs a workload, returning the build time, the time of each render pass and
+# the peak memory of building and rendering. Times are the minimum of repeat
+# runs. Memory is measured in a separate run, as tracing slows it down.
+def bench_workload(generator, size, repeat, **kwargs):
+    result = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        app = generator(size)
+        build_time = time.perf_counter() - start
+        passes, render_time, sizes = time_render_passes(app, **kwargs)
+        if not result or build_time < result['build_time']:
+            result['build_time'] = build_time
+        if not result.get('render') or render_time < result['render_time']:
+            result['render'] = passes
+            result['render_time'] = render_time
+    result['rectangles'] = len(app.rectangles)
+    result['bytes'] = sizes
+    result['render_stats'] = app.render_stats
+
+    tracemalloc.start()
+    app = generator(size)
+    app.render(**kwargs)
+    result['peak_memory'] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result
+
+def bench_suite(size, repeat, names=None, **kwargs):
+    results = {}
+    for name in names or generators:
+        result = bench_workload(generators[name], size, repeat, **kwargs)
+        results[name] = result
+        passes = ' '.join(f'{p} {1000.0 * t:.1f}' for p, t in result['render'].items())
+        print(
+            f'  {name:<20} {result["rectangles"]:8} rects'
+            f'  build {1000.0 * result["build_time"]:9.1f} ms'
+            f'  render {1000.0 * result["render_time"]:9.1f} ms ({passes})'
+            f'  peak {result["peak_memory"] / 2**20:7.1f} MiB'
+        )
+    return results
+
+# Prints the workloads of the results whose build or render time, or peak
+# memory, grew by more than threshold relative to the baseline.
+def compare(results, baseline, threshold):
+    regressions = 0
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        for metric in ['build_time', 'render_time', 'peak_memory']:
+            ratio = result[metric] / old[metric] if old[metric] else 1.0
+            if ratio > 1.0 + threshold:
+                print(f'  regression: {name} {metric} {ratio:.2f}x')
+                regressions += 1
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='py2web benchmarks')
+    parser.add_argument('scale', nargs='?', type=int, default=100000,
+        help='size of the trees of the walk benchmarks')
+    parser.add_argument('--suite', action='store_true',
+        help='run the benchmark suite instead of the walk benchmarks')
+    parser.add_argument('--size', type=int, default=10000,
+        help='number of rectangles of each workload of the suite')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workload', action='append', choices=list(generators))
+    parser.add_argument('--minify', action='store_true')
+    parser.add_argument('--reduce-dom', action='store_true',
+        help='render with the spacers and wrappers replaced by css properties')
+    parser.add_argument('--json', help='write the results of the suite to this file')
+    parser.add_argument('--compare', help='results of a previous run of the suite to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1,
+        help='relative slowdown reported as a regression by --compare')
+    args = parser.parse_args()
+
+    if not args.suite:
+        scale = args.scale
+        bench_walk('deep tree (depth 500)', build_deep_tree(500))
+        bench_walk(f'deep tree (depth {scale})', build_deep_tree(scale))
+        bench_walk(f'wide tree (fanout 10)', build_wide_tree(10 * scale))
+        bench_site(max(scale // 1000, 2))
+        bench_template(scale)
+        sys.exit(0)
+
+    print(f'suite ({args.size} rectangles per workload)')
+    results = bench_suite(args.size, args.repeat, args.workload, minify=args.minify, reduce_dom=args.reduce_dom)
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump({
+                'python':    platform.python_version(),
+                'size':      args.size,
+                'minify':    args.minify,
+                'reduce_dom': args.reduce_dom,
+                'workloads': results,
+            }, fp, indent=2)
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)['workloads']
+        sys.exit(1 if compare(results, baseline, args.threshold) else 0)
@@ -1,7 +1,27 @@
 from enum import IntEnum
 from typing import Union, Tuple
 from numbers import Number
-from contextlib import contextmanager
+from contextlib import contextmanager, nullcontext
+import io
+import itertools
+import os
+import re
+import sys
+import gzip
+import shutil
+from array import array
+import bisect
+import builtins
+import weakref
+import copy
+import hashlib
+import json
+import mmap
+import struct
+import time
+from collections import OrderedDict
+from html import escape as html_escape
+from concurrent.futures import ProcessPoolExecutor
 
 class Pivot(IntEnum):
     CENTER       = 0
@@ -14,6 +34,7 @@ class Layout(IntEnum):
     NONE    = 0
     ROW     = 1
     COLUMN  = 2
+    GRID    = 3
 
 class RectType(IntEnum):
     RECT     = 0
@@ -72,13 +93,43 @@ class Expression(object):
 
     Type = Union[Number, 'Expression']
 
-    def __init__(self, op_or_varname: str='', children:tuple=()):
-        self.op_or_varname = op_or_varname
-        self.children = children
+    __slots__ = ('op_or_varname', 'children', '_free_vars', '__weakref__')
+
+    # Expressions are hash-consed: constructing an expression that is
+    # structurally equal to a live one returns the existing object. Expressions
+    # thus form a DAG where shared subexpressions are the same node, and can be
+    # memoized by identity.
+    _interned = weakref.WeakValueDictionary()
+
+    def __new__(cls, op_or_varname: str='', children: tuple=()):
+        children = tuple(children)
+        # Numbers are keyed along with their type so that e.g. 1 and 1.0,
+        # which render differently, are not merged.
+        key = (op_or_varname, tuple((type(c), c) for c in children))
+        expression = cls._interned.get(key)
+        if expression is None:
+            expression = super().__new__(cls)
+            expression.op_or_varname = op_or_varname
+            expression.children = children
+            expression._free_vars = None
+            cls._interned[key] = expression
+        return expression
+
+    # Pickled as a table of its nodes, see _ExpressionTable, as pickling the
+    # children as they are recurses once per level of nesting.
+    def __reduce__(self):
+        table = _ExpressionTable()
+        return table.decode, (table.encode(self),)
+
+    # The names of the variables the expression depends on, as a set-like
+    # view, in the order in which they first appear.
+    @property
+    def free_vars(self):
+        return _free_vars(self).keys()
 
     def __repr__(self):
         if self.children:
-            return f'Expression \'{self.op_or_varname}\' ({self.children[0]}, {self.children[1]})'
+            return f'Expression \'{self.op_or_varname}\' ({", ".join(str(c) for c in self.children)})'
         else:
             return f'Variable \'{self.op_or_varname}\''
 
@@ -105,11 +156,11 @@ class Expression(object):
     def __pow__(self, other: Type):
         return Expression('pow', (self, other))
 
-def min(a: Expression, b: Expression):
-    return Expression('min', (a, b))
+def min(*args: Expression.Type):
+    return Expression('min', args)
 
-def max(a: Expression, b: Expression):
-    return Expression('max', (a, b))
+def max(*args: Expression.Type):
+    return Expression('max', args)
 
 op_str_dict = {
     'add' : '+',
@@ -121,23 +172,1056 @@ op_str_dict = {
     'pow' : '**',
 }
 
+# Evaluates the expression bottom-up, calling evaluate_node(expression,
+# children) once per distinct node, where children holds the evaluated child
+# expressions and any numbers as-is. Evaluated nodes are memoized in cache, so
+# that nodes shared within or between expressions are only evaluated once.
+def _evaluate_expression(expression: Expression, evaluate_node, cache: dict):
+    global _expression_nodes_evaluated
+    num_cached = len(cache)
+    stack = [expression]
+    while stack:
+        node = stack[-1]
+        if node in cache:
+            stack.pop()
+            continue
+
+        pending = [
+            c for c in node.children
+            if isinstance(c, Expression) and c not in cache
+        ]
+        if pending:
+            stack.extend(reversed(pending))
+        else:
+            stack.pop()
+            cache[node] = evaluate_node(node, [
+                cache[c] if isinstance(c, Expression) else c
+                for c in node.children
+            ])
+
+    _expression_nodes_evaluated += len(cache) - num_cached
+    return cache[expression]
+
+# Number of expression nodes evaluated by _evaluate_expression, for Profiler.
+_expression_nodes_evaluated = 0
+
+# Returns the variables of the expression as a dict with None values, which
+# keeps them in the order they first appear. The dict of each node is
+# computed once, bottom-up from those of its children, and kept on the node.
+# Nodes share the dict of a child that has all their variables.
+def _free_vars(expression: Expression):
+    stack = [expression]
+    while stack:
+        node = stack[-1]
+        if node._free_vars is not None:
+            stack.pop()
+            continue
+        if not node.children:
+            node._free_vars = {node.op_or_varname: None}
+            stack.pop()
+            continue
+
+        children = [c for c in node.children if isinstance(c, Expression)]
+        pending = [c for c in children if c._free_vars is None]
+        if pending:
+            stack.extend(reversed(pending))
+            continue
+        stack.pop()
+        if not children:
+            node._free_vars = {}
+            continue
+        free_vars = children[0]._free_vars
+        for child in children[1:]:
+            if child._free_vars is free_vars or child._free_vars.keys() <= free_vars.keys():
+                continue
+            if free_vars is children[0]._free_vars:
+                free_vars = dict(free_vars)
+            free_vars.update(child._free_vars)
+        node._free_vars = free_vars
+
+    return expression._free_vars
+
+# Returns the set of non-variable expression nodes that are referenced more
+# than once from the given expressions, including references between them.
+def _shared_subexpressions(expressions):
+    ref_counts = {}
+    stack = [e for e in expressions if isinstance(e, Expression)]
+    for e in stack:
+        ref_counts[e] = ref_counts.get(e, 0) + 1
+    visited = set()
+    while stack:
+        node = stack.pop()
+        if node in visited:
+            continue
+        visited.add(node)
+        for c in node.children:
+            if isinstance(c, Expression):
+                ref_counts[c] = ref_counts.get(c, 0) + 1
+                stack.append(c)
+
+    return {e for e, count in ref_counts.items() if count > 1 and e.children}
+
+# Linear forms of the linear combinations built by _simplify_node.
+_linear_forms = weakref.WeakKeyDictionary()
+
+# Returns the linear form of a simplified expression as a dict mapping each
+# term to its coefficient, and a constant.
+def _linear_form(expression: Expression.Type):
+    if isinstance(expression, Number):
+        return {}, expression
+    form = _linear_forms.get(expression)
+    if form is not None:
+        return form
+    return {expression: 1}, 0
+
+# Builds an expression from a linear form, leaving out zero-weighted terms.
+def _linear_form_expression(terms: dict, constant: Number):
+    terms = [(t, c) for t, c in terms.items() if c != 0]
+    # Lead with a positively weighted term where possible so that the
+    # expression does not start with a negation.
+    for i, (t, c) in enumerate(terms):
+        if c > 0:
+            terms.insert(0, terms.pop(i))
+            break
+
+    expression = None
+    for t, c in terms:
+        if expression is None:
+            expression = t if c == 1 else Expression('mul', (t, c))
+        else:
+            term = t if abs(c) == 1 else Expression('mul', (t, abs(c)))
+            expression = Expression('add' if c > 0 else 'sub', (expression, term))
+
+    if expression is None:
+        return constant
+    if constant > 0:
+        expression = Expression('add', (expression, constant))
+    elif constant < 0:
+        expression = Expression('sub', (expression, -constant))
+    return expression
+
+def _simplify_node(expression: Expression, children):
+    op = expression.op_or_varname
+    if not children:
+        return expression
+
+    if op in ['add', 'sub', 'mul']:
+        (terms_a, const_a), (terms_b, const_b) = (_linear_form(c) for c in children)
+        if op == 'mul':
+            if terms_a and terms_b:
+                return Expression(op, children)
+            # One of the sides is constant, so the product stays linear.
+            if terms_a:
+                terms, constant, scale = terms_a, const_a, const_b
+            else:
+                terms, constant, scale = terms_b, const_b, const_a
+            terms = {t: scale * c for t, c in terms.items()}
+            constant = scale * constant
+        else:
+            sign = 1 if op == 'add' else -1
+            terms = dict(terms_a)
+            for t, c in terms_b.items():
+                terms[t] = terms.get(t, 0) + sign * c
+            constant = const_a + sign * const_b
+
+        simplified = _linear_form_expression(terms, constant)
+        if isinstance(simplified, Expression) and simplified.children:
+            _linear_forms[simplified] = (terms, constant)
+        return simplified
+
+    if op in ['min', 'max']:
+        # Collapse nested min/max of the same kind, fold the constant
+        # arguments into one, and drop duplicate arguments.
+        fold = builtins.min if op == 'min' else builtins.max
+        args = []
+        constants = []
+        for c in children:
+            nested = c.children if isinstance(c, Expression) and c.op_or_varname == op else (c,)
+            for n in nested:
+                if isinstance(n, Number):
+                    constants.append(n)
+                elif n not in args:
+                    args.append(n)
+        if constants:
+            args.append(fold(constants))
+        return args[0] if len(args) == 1 else Expression(op, args)
+
+    a, b = children
+    if isinstance(a, Number) and isinstance(b, Number):
+        if op == 'fdiv' and b != 0:
+            return a / b
+        if op == 'pow':
+            value = a ** b
+            if not isinstance(value, complex):
+                return value
+        # Python and js differ on the sign of the remainder of negative
+        # operands, and 'div' has no agreed-upon semantics yet, so these are
+        # left alone.
+        if op == 'mod' and a >= 0 and b > 0:
+            return a % b
+    elif (op == 'fdiv' or op == 'pow') and isinstance(b, Number) and b == 1:
+        return a
+
+    return Expression(op, children)
+
+# Returns an equivalent expression with constants folded, identities such as
+# '+ 0' and '* 1' removed, nested min/max collapsed, and terms of the same
+# subexpression combined. The cache maps already simplified expressions to
+# their result, and can be shared between calls.
+def simplify_expression(expression: Expression.Type, cache: dict = None):
+    if not isinstance(expression, Expression):
+        return expression
+    cache = {} if cache is None else cache
+    return _evaluate_expression(expression, _simplify_node, cache)
+
+# Returns the number of distinct nodes in the expression DAG reachable from
+# the given expressions.
+def _count_expression_nodes(expressions):
+    stack = [e for e in expressions if isinstance(e, Expression)]
+    visited = set()
+    while stack:
+        node = stack.pop()
+        if node in visited:
+            continue
+        visited.add(node)
+        stack.extend(c for c in node.children if isinstance(c, Expression))
+    return len(visited)
+
+# Returns a digest of the structure of the expression which, unlike hash(), is
+# the same across processes.
+def _expression_digest(expression: Expression, cache: dict):
+    def digest_node(node, children):
+        return hashlib.sha1(repr((node.op_or_varname, children)).encode()).hexdigest()
+    return _evaluate_expression(expression, digest_node, cache)
+
+# A reference to the node at index of an _ExpressionTable.
+class _ExpressionRef(object):
+    __slots__ = ('index',)
+
+    def __init__(self, index: int):
+        self.index = index
+
+    def __reduce__(self):
+        return _ExpressionRef, (self.index,)
+
+# The nodes of expressions, flattened for pickling. Each distinct node is
+# added once, after its children, as (op_or_varname, children), where child
+# expressions are _ExpressionRefs, so that expressions are pickled and
+# unpickled without recursion, and the nodes they share are stored once.
+class _ExpressionTable(object):
+
+    def __init__(self):
+        self.nodes       = []
+        self.expressions = []
+        self._ids        = {}
+        self._copies     = {}
+
+    # Returns the value with the expressions in it, including those within
+    # tuples, lists and dicts, replaced by _ExpressionRefs into the table.
+    # Containers are copied once, so ones shared by several values stay
+    # shared.
+    def encode(self, value):
+        if isinstance(value, Expression):
+            return _ExpressionRef(_evaluate_expression(value, self._add_node, self._ids))
+        if type(value) not in (tuple, list, dict):
+            return value
+        if id(value) not in self._copies:
+            if type(value) is dict:
+                result = {self.encode(k): self.encode(v) for k, v in value.items()}
+            else:
+                result = type(value)(self.encode(v) for v in value)
+            self._copies[id(value)] = (value, result)
+        return self._copies[id(value)][1]
+
+    def _add_node(self, expression: Expression, children):
+        self.nodes.append((expression.op_or_varname, tuple(
+            _ExpressionRef(self._ids[c]) if isinstance(c, Expression) else c
+            for c in expression.children
+        )))
+        self.expressions.append(expression)
+        return len(self.nodes) - 1
+
+    # Returns the value encoded by encode, with the expressions rebuilt.
+    def decode(self, value):
+        if isinstance(value, _ExpressionRef):
+            return self.expressions[value.index]
+        if type(value) not in (tuple, list, dict):
+            return value
+        if id(value) not in self._copies:
+            if type(value) is dict:
+                result = {self.decode(k): self.decode(v) for k, v in value.items()}
+            else:
+                result = type(value)(self.decode(v) for v in value)
+            self._copies[id(value)] = (value, result)
+        return self._copies[id(value)][1]
+
+    def __getstate__(self):
+        return self.nodes
+
+    def __setstate__(self, nodes: list):
+        self.nodes       = nodes
+        self.expressions = []
+        self._ids        = {}
+        self._copies     = {}
+        for op_or_varname, children in nodes:
+            self.expressions.append(Expression(op_or_varname, [
+                self.expressions[c.index] if isinstance(c, _ExpressionRef) else c
+                for c in children
+            ]))
+
+# Values of _RectangleStore.dirty.
+_DIRTY_DESCENDANTS = 1
+_DIRTY_SELF        = 2
+
+# Struct-of-arrays storage of the rectangle tree. Each rectangle is identified
+# by its index, its rect_id, into the arrays. The tree structure is kept in
+# parent, first_child, last_child and next_sibling arrays, where -1 marks the
+# absence of a rectangle. Rectangle fields that are unset are None, and the
+# name of unnamed rectangles is generated from their rect_id when needed.
+class _RectangleStore(object):
+
+    # The fields which are lists of values, one per rectangle.
+    _columns = [
+        'names', 'class_names', 'x', 'y', 'width', 'height', 'grow',
+        'text', 'link', 'image', 'style', 'value', 'grid',
+    ]
+
+    def __init__(self):
+        self.parent       = array('q')
+        self.first_child  = array('q')
+        self.last_child   = array('q')
+        self.next_sibling = array('q')
+
+        self.names       = []
+        self.class_names = []
+
+        self.x      = []
+        self.y      = []
+        self.width  = []
+        self.height = []
+        self.grow   = []
+
+        self.pivots  = bytearray()
+        self.layouts = bytearray()
+        self.types   = bytearray()
+        self.text    = []
+        self.link    = []
+        self.image   = []
+        self.style   = []
+
+        self.value   = []
+        self.checked = bytearray()
+
+        # The (columns, rows, gap) track sizes of grids, see
+        # Rectangle.set_grid.
+        self.grid = []
+
+        self.components = bytearray()
+
+        # Whether each rectangle, or any of its descendants, changed since
+        # the last incremental render.
+        self.dirty = bytearray()
+
+    # The expressions of all the columns are pickled as one table, so that
+    # the nodes the sizes of different rectangles share are stored once.
+    def __getstate__(self):
+        return _RectangleStore._encode_fields(self.__dict__)
+
+    def __setstate__(self, state: dict):
+        table = state.pop('_expressions')
+        for column in self._columns:
+            state[column] = table.decode(state[column])
+        self.__dict__.update(state)
+
+    @staticmethod
+    def _encode_fields(fields: dict):
+        table = _ExpressionTable()
+        state = dict(fields)
+        for column in _RectangleStore._columns:
+            state[column] = table.encode(state[column])
+        state['_expressions'] = table
+        return state
+
+    def __len__(self):
+        return len(self.parent)
+
+    # Adds a rectangle as the last child of parent_id, which can be -1 for the
+    # root, and returns its rect_id.
+    def add(self, parent_id: int, name: str = None, class_name: str = None):
+        rect_id = len(self.parent)
+
+        self.parent.append(parent_id)
+        self.first_child.append(-1)
+        self.last_child.append(-1)
+        self.next_sibling.append(-1)
+        if parent_id >= 0:
+            if self.last_child[parent_id] >= 0:
+                self.next_sibling[self.last_child[parent_id]] = rect_id
+            else:
+                self.first_child[parent_id] = rect_id
+            self.last_child[parent_id] = rect_id
+
+        self.names.append(sys.intern(name) if name else None)
+        self.class_names.append(sys.intern(class_name) if class_name else None)
+
+        self.x.append(None)
+        self.y.append(None)
+        self.width.append(None)
+        self.height.append(None)
+        self.grow.append(None)
+
+        self.pivots.append(Pivot.TOP_LEFT)
+        self.layouts.append(Layout.NONE)
+        self.types.append(RectType.RECT)
+        self.text.append(None)
+        self.link.append(None)
+        self.image.append(None)
+        self.style.append(None)
+
+        self.value.append(None)
+        self.checked.append(False)
+
+        self.grid.append(None)
+
+        self.components.append(False)
+
+        self.dirty.append(_DIRTY_SELF)
+        self._mark_ancestors_dirty(parent_id)
+
+        return rect_id
+
+    # Marks the rectangle as changed, and its ancestors as having changed
+    # descendants. Ancestors of dirty rectangles are always dirty, so marking
+    # stops at the first one which already is.
+    def mark_dirty(self, rect_id: int):
+        self.dirty[rect_id] = _DIRTY_SELF
+        self._mark_ancestors_dirty(self.parent[rect_id])
+
+    def _mark_ancestors_dirty(self, rect_id: int):
+        dirty  = self.dirty
+        parent = self.parent
+        while rect_id >= 0 and not dirty[rect_id]:
+            dirty[rect_id] = _DIRTY_DESCENDANTS
+            rect_id = parent[rect_id]
+
+    def rectangle(self, rect_id: int):
+        return Rectangle(self, rect_id)
+
+    # Returns whether any of the position and size of the rectangle is an
+    # expression.
+    def has_expressions(self, rect_id: int):
+        return (
+            isinstance(self.x[rect_id], Expression) or
+            isinstance(self.y[rect_id], Expression) or
+            isinstance(self.width[rect_id], Expression) or
+            isinstance(self.height[rect_id], Expression)
+        )
+
+    def name(self, rect_id: int):
+        name = self.names[rect_id]
+        return name if name is not None else 'rect_%d' % rect_id
+
+    # Removes the rectangles from num_rects on, which must not have children
+    # before num_rects, unlinking them from their parents.
+    def truncate(self, num_rects: int):
+        for rect_id in range(num_rects, len(self.parent)):
+            parent_id = self.parent[rect_id]
+            if parent_id < 0 or parent_id >= num_rects or self.last_child[parent_id] < num_rects:
+                continue
+            # The removed children are the last ones of the parent, and this
+            # is the first of them, as siblings are added in order.
+            if self.first_child[parent_id] == rect_id:
+                self.first_child[parent_id] = -1
+                self.last_child[parent_id] = -1
+            else:
+                child_id = self.first_child[parent_id]
+                while self.next_sibling[child_id] != rect_id:
+                    child_id = self.next_sibling[child_id]
+                self.next_sibling[child_id] = -1
+                self.last_child[parent_id] = child_id
+
+        for values in vars(self).values():
+            del values[num_rects:]
+
+    def children(self, rect_id: int):
+        child_id = self.first_child[rect_id]
+        while child_id >= 0:
+            yield child_id
+            child_id = self.next_sibling[child_id]
+
+# The first bytes of a binary tree file, see Application.save.
+_BINARY_MAGIC = b'PY2WEB\x00\x02'
+
+# Kinds of the values in a _ValuePool.
+_VALUE_STR        = 0
+_VALUE_INT        = 1
+_VALUE_BIG_INT    = 2
+_VALUE_FLOAT      = 3
+_VALUE_BOOL       = 4
+_VALUE_EXPRESSION = 5
+_VALUE_STYLE      = 6
+_VALUE_TUPLE      = 7
+
+# Builds the value pool of a binary tree file, see Application.save. Each
+# distinct value is added once and referred to by its index. Expressions are
+# added after their children, so that the pool holds the expression DAG with
+# shared nodes stored once.
+class _ValuePoolWriter(object):
+
+    def __init__(self):
+        self.kinds   = bytearray()
+        self.offsets = array('Q', [0])
+        self.blob    = bytearray()
+        self._ids    = {}
+        self._expression_ids = {}
+
+    def _append(self, kind: int, data: bytes):
+        self.kinds.append(kind)
+        self.blob += data
+        self.offsets.append(len(self.blob))
+        return len(self.kinds) - 1
+
+    # Adds the value, returning its index, or -1 for None.
+    def add(self, value):
+        if value is None:
+            return -1
+        if isinstance(value, Expression):
+            return _evaluate_expression(value, self._add_expression, self._expression_ids)
+        if isinstance(value, dict):
+            items = array('i')
+            for key, item in value.items():
+                items.append(self.add(key))
+                items.append(self.add(item))
+            key = (_Style, items.tobytes())
+        elif isinstance(value, tuple):
+            items = array('i', [self.add(item) for item in value])
+            key = (tuple, items.tobytes())
+        else:
+            key = (type(value), value.hex() if isinstance(value, float) else value)
+
+        value_id = self._ids.get(key)
+        if value_id is not None:
+            return value_id
+        if isinstance(value, dict):
+            value_id = self._append(_VALUE_STYLE, items.tobytes())
+        elif isinstance(value, tuple):
+            value_id = self._append(_VALUE_TUPLE, items.tobytes())
+        elif isinstance(value, str):
+            value_id = self._append(_VALUE_STR, value.encode('utf-8'))
+        elif isinstance(value, bool):
+            value_id = self._append(_VALUE_BOOL, bytes([value]))
+        elif isinstance(value, int):
+            if -(1 << 63) <= value < (1 << 63):
+                value_id = self._append(_VALUE_INT, struct.pack('<q', value))
+            else:
+                value_id = self._append(_VALUE_BIG_INT, str(value).encode())
+        elif isinstance(value, float):
+            value_id = self._append(_VALUE_FLOAT, struct.pack('<d', value))
+        else:
+            raise ValueError(f'Cannot serialize value: {value!r}')
+        self._ids[key] = value_id
+        return value_id
+
+    def _add_expression(self, expression: Expression, children):
+        node = array('i', [self.add(expression.op_or_varname)])
+        for child in expression.children:
+            node.append(self._expression_ids[child] if isinstance(child, Expression) else self.add(child))
+        return self._append(_VALUE_EXPRESSION, node.tobytes())
+
+# The value pool of a memory-mapped binary tree file, where the data of value
+# i is blob[offsets[i]:offsets[i + 1]]. Values are decoded when first read,
+# and kept.
+class _ValuePool(object):
+
+    def __init__(self, kinds: memoryview, offsets: memoryview, blob: memoryview):
+        self.kinds   = kinds
+        self.offsets = offsets
+        self.blob    = blob
+        self.values  = {}
+
+    def get(self, value_id: int):
+        value = self.values.get(value_id, _ValuePool)
+        if value is not _ValuePool:
+            return value
+
+        # Expressions, styles and tuples are decoded after their children,
+        # without recursion.
+        stack = [value_id]
+        while stack:
+            node_id = stack[-1]
+            if node_id in self.values:
+                stack.pop()
+                continue
+            data = self.blob[self.offsets[node_id]:self.offsets[node_id + 1]]
+            kind = self.kinds[node_id]
+            if kind == _VALUE_EXPRESSION or kind == _VALUE_STYLE or kind == _VALUE_TUPLE:
+                ids = data.cast('i')
+                pending = [i for i in ids if i not in self.values and i >= 0]
+                if pending:
+                    stack.extend(pending)
+                    continue
+                stack.pop()
+                values = [self.values[i] if i >= 0 else None for i in ids]
+                if kind == _VALUE_EXPRESSION:
+                    self.values[node_id] = Expression(values[0], values[1:])
+                elif kind == _VALUE_TUPLE:
+                    self.values[node_id] = tuple(values)
+                else:
+                    self.values[node_id] = list(zip(values[0::2], values[1::2]))
+                continue
+
+            stack.pop()
+            if kind == _VALUE_STR:
+                value = str(data, 'utf-8')
+            elif kind == _VALUE_INT:
+                value = struct.unpack_from('<q', data)[0]
+            elif kind == _VALUE_BIG_INT:
+                value = int(str(data, 'ascii'))
+            elif kind == _VALUE_FLOAT:
+                value = struct.unpack_from('<d', data)[0]
+            else:
+                value = bool(data[0])
+            self.values[node_id] = value
+
+        return self.values[value_id]
+
+# A column of a _MappedRectangleStore, holding the index of each rectangle's
+# value in the pool. Values are decoded when read, and optionally wrapped by
+# wrap(rect_id, value), in which case the wrapped value is kept. Values that
+# are set are kept instead of being written to the file.
+class _PooledColumn(object):
+
+    def __init__(self, ids: memoryview, pool: _ValuePool, wrap=None):
+        self.ids    = ids
+        self.pool   = pool
+        self.wrap   = wrap
+        self.values = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        for i in range(len(self.ids)):
+            yield self[i]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self.ids)))]
+        if i < 0:
+            i += len(self.ids)
+        value = self.values.get(i, _PooledColumn)
+        if value is not _PooledColumn:
+            return value
+        value_id = self.ids[i]
+        if value_id < 0:
+            return None
+        value = self.pool.get(value_id)
+        if self.wrap is not None:
+            value = self.values[i] = self.wrap(i, value)
+        return value
+
+    def __setitem__(self, i: int, value):
+        if i < 0:
+            i += len(self.ids)
+        if not 0 <= i < len(self.ids):
+            raise IndexError('column index out of range')
+        self.values[i] = value
+
+# A _RectangleStore loaded from a binary tree file, see load. The arrays are
+# views of the memory-mapped file, and are only read from it as they're
+# accessed. The file is mapped copy-on-write, so changes are never written
+# back. Adding or removing rectangles first copies the store into memory,
+# making it an ordinary _RectangleStore.
+class _MappedRectangleStore(_RectangleStore):
+
+    _fields = [
+        'parent', 'first_child', 'last_child', 'next_sibling',
+        'pivots', 'layouts', 'types', 'checked', 'components',
+    ]
+
+    def __init__(self, data: mmap.mmap, sections: dict):
+        self._mmap = data
+        view = memoryview(data)
+        def section(name, format):
+            offset, size = sections[name]
+            return view[offset:offset + size].cast(format)
+
+        for field in self._fields[:4]:
+            setattr(self, field, section(field, 'q'))
+        for field in self._fields[4:]:
+            setattr(self, field, section(field, 'B'))
+
+        pool = _ValuePool(section('pool_kinds', 'B'), section('pool_offsets', 'Q'), section('pool_blob', 'B'))
+        for column in self._columns:
+            setattr(self, column, _PooledColumn(section(column, 'i'), pool))
+        self.style.wrap = lambda rect_id, items: _Style._restore(self, rect_id, items)
+
+        # Nothing loaded has been rendered yet.
+        self.dirty = bytearray([_DIRTY_SELF]) * len(self.parent)
+
+    # Returns the fields of the store copied into memory.
+    def _copy_fields(self):
+        fields = {'dirty': self.dirty}
+        for field in self._fields[:4]:
+            fields[field] = array('q', getattr(self, field))
+        for field in self._fields[4:]:
+            fields[field] = bytearray(getattr(self, field))
+        for column in self._columns:
+            fields[column] = list(getattr(self, column))
+        return fields
+
+    # Copies the store into memory, making it an ordinary _RectangleStore.
+    def _materialize(self):
+        fields = self._copy_fields()
+        self.__dict__.clear()
+        self.__dict__.update(fields)
+        self.__class__ = _RectangleStore
+
+    def add(self, parent_id: int, name: str = None, class_name: str = None):
+        self._materialize()
+        return self.add(parent_id, name, class_name)
+
+    def truncate(self, num_rects: int):
+        self._materialize()
+        self.truncate(num_rects)
+
+    # Pickled as an ordinary _RectangleStore, as views of the file can't be.
+    def __reduce__(self):
+        return object.__new__, (_RectangleStore,), _RectangleStore._encode_fields(self._copy_fields())
+
+# Methods of Application rendering a single rectangle, which are timed when
+# profiling.
+_profiled_methods = [
+    '_render_rect_html',
+    '_render_rect_css_chunks',
+    '_render_rect_css_declarations',
+]
+
+# Records where the time goes when rendering, see Application.profile. Each
+# render is split into phases, and for each the wall time, the number of
+# rectangles and expression nodes processed, and the bytes emitted are
+# recorded. The time of the phases that emit output includes the time the
+# caller spends consuming it. The time spent rendering each rectangle is also
+# recorded, to find the most expensive subtrees. If given, callback is called
+# with each phase as it ends.
+class Profiler(object):
+
+    def __init__(self, app: 'Application', top_n: int = 10, callback=None):
+        self.app              = app
+        self.top_n            = top_n
+        self.callback         = callback
+        self.phases           = []
+        self.rect_times       = {}
+        self.rectangles_built = 0
+        self.start            = time.perf_counter()
+        self.end              = None
+        self._phase           = None
+        self._timing          = False
+
+    @contextmanager
+    def phase(self, name: str):
+        phase = {
+            'name':             name,
+            'start':            time.perf_counter(),
+            'end':              None,
+            'rectangles':       0,
+            'expression_nodes': _expression_nodes_evaluated,
+            'bytes':            0,
+        }
+        outer_phase, self._phase = self._phase, phase
+        try:
+            yield phase
+        finally:
+            self._phase = outer_phase
+            phase['end'] = time.perf_counter()
+            phase['expression_nodes'] = _expression_nodes_evaluated - phase['expression_nodes']
+            self.phases.append(phase)
+            if self.callback is not None:
+                self.callback(phase)
+
+    # Wraps a method rendering a rectangle so that its time is added to the
+    # rectangle. Calls within timed calls are not timed again.
+    def _timed(self, render_rect):
+        def timed(rect_id):
+            if self._timing:
+                return render_rect(rect_id)
+            self._timing = True
+            start = time.perf_counter()
+            try:
+                return render_rect(rect_id)
+            finally:
+                self.rect_times[rect_id] = self.rect_times.get(rect_id, 0.0) + time.perf_counter() - start
+                self._timing = False
+                if self._phase is not None:
+                    self._phase['rectangles'] += 1
+        return timed
+
+    # Returns the top_n subtrees, other than the whole document, that took the
+    # longest to render, with the time spent and the number of rectangles in
+    # each.
+    def subtrees(self):
+        app = self.app
+        rects = app.rectangles
+        times = {}
+        sizes = {}
+        for rect_id, entering in app._walk_rectangles(app.root_id):
+            if entering:
+                times[rect_id] = self.rect_times.get(rect_id, 0.0)
+                sizes[rect_id] = 1
+            elif rect_id != app.root_id:
+                parent_id = rects.parent[rect_id]
+                times[parent_id] += times[rect_id]
+                sizes[parent_id] += sizes[rect_id]
+        del times[app.root_id]
+
+        top = sorted(times, key=times.get, reverse=True)[:self.top_n]
+        return [
+            {
+                'rect_id':    rect_id,
+                'name':       rects.name(rect_id),
+                'time':       times[rect_id],
+                'rectangles': sizes[rect_id],
+            }
+            for rect_id in top
+        ]
+
+    # Returns a summary of the profile, with the totals of each phase over
+    # all renders, in the order in which they first ran.
+    def report(self):
+        end = self.end if self.end is not None else time.perf_counter()
+        phases = {}
+        for phase in sorted(self.phases, key=lambda phase: phase['start']):
+            totals = phases.setdefault(phase['name'], {
+                'time':             0.0,
+                'count':            0,
+                'rectangles':       0,
+                'expression_nodes': 0,
+                'bytes':            0,
+            })
+            totals['time']  += phase['end'] - phase['start']
+            totals['count'] += 1
+            for key in ['rectangles', 'expression_nodes', 'bytes']:
+                totals[key] += phase[key]
+        render_time = phases['render']['time'] if 'render' in phases else 0.0
+
+        return {
+            'wall_time': end - self.start,
+            'build': {
+                'time':       end - self.start - render_time,
+                'rectangles': self.rectangles_built,
+            },
+            'phases':   phases,
+            'subtrees': self.subtrees(),
+        }
+
+    # Returns the phases as Chrome trace events, which can be viewed in
+    # chrome://tracing or Perfetto.
+    def chrome_trace(self):
+        pid = os.getpid()
+        events = []
+        for phase in self.phases:
+            events.append({
+                'name': phase['name'],
+                'cat':  'py2web',
+                'ph':   'X',
+                'ts':   1e6 * (phase['start'] - self.start),
+                'dur':  1e6 * (phase['end'] - phase['start']),
+                'pid':  pid,
+                'tid':  0,
+                'args': {
+                    'rectangles':       phase['rectangles'],
+                    'expression_nodes': phase['expression_nodes'],
+                    'bytes':            phase['bytes'],
+                },
+            })
+        events.sort(key=lambda event: event['ts'])
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, path: str):
+        with open(path, 'w', encoding='utf-8') as fp:
+            json.dump(self.chrome_trace(), fp)
+
+# Returns the chunks, adding their utf-8 size to the bytes of the profiled
+# phase, if any, as they're consumed.
+def _count_bytes(phase: dict, chunks):
+    if phase is None:
+        return chunks
+    def count():
+        for chunk in chunks:
+            phase['bytes'] += len(chunk.encode())
+            yield chunk
+    return count()
+
+# Cache of the rendered html and css of components, see
+# Application.component. Entries are keyed by a structural hash of the
+# component subtree, and the max_entries most recently used ones are kept in
+# memory. If directory is given, entries are also stored there, one file per
+# key, so that they can be reused across builds.
+class RenderCache(object):
+
+    def __init__(self, max_entries: int = 1024, directory: str = None):
+        self.max_entries = max_entries
+        self.directory   = directory
+        self.entries     = OrderedDict()
+
+    def get(self, key: str):
+        fragments = self.entries.get(key)
+        if fragments is not None:
+            self.entries.move_to_end(key)
+        elif self.directory is not None:
+            try:
+                with open(self._path(key), encoding='utf-8') as fp:
+                    fragments = tuple(json.load(fp))
+            except FileNotFoundError:
+                return None
+            self._insert(key, fragments)
+        return fragments
+
+    def put(self, key: str, fragments):
+        self._insert(key, fragments)
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            # Written to a temporary file first so that concurrent builds
+            # never read a partially written entry.
+            path = self._path(key)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as fp:
+                json.dump(list(fragments), fp)
+            os.replace(tmp_path, path)
+
+    def _insert(self, key: str, fragments):
+        self.entries[key] = fragments
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _path(self, key: str):
+        return os.path.join(self.directory, key + '.json')
+
+# Returns a placeholder for the value of a slot of a Template, which can be
+# set as the text, link, image or input value of rectangles. The value that
+# replaces it is html escaped, unless escape is False. In the rendered html,
+# slots are marked by their name between null characters.
+def slot(name: str, escape: bool = True):
+    if '\x00' in name:
+        raise ValueError('Slot names can\'t contain null characters')
+    return f'\x00{"e" if escape else "r"}{name}\x00'
+
+_slot_pattern = re.compile('\x00([er])([^\x00]*)\x00')
+
+# A document compiled by Application.compile_template, which is rendered for
+# each record by splicing the values of its slots, see slot, into the html.
+# The css and js don't depend on the text, links, images and input values of
+# the rectangles, so they are the same for all records.
+class Template(object):
+
+    def __init__(self, html: str, css: str, js: str):
+        if '\x00' in css or '\x00' in js:
+            raise ValueError('Slots can only be used in the text, link, image and input value of rectangles')
+        # The static parts of the html, alternating with an empty part for
+        # each slot, whose (index in parts, name, escape) are in slots.
+        parts      = _slot_pattern.split(html)
+        self.parts = [parts[0]]
+        self.slots = []
+        for i in range(1, len(parts), 3):
+            self.slots.append((len(self.parts), parts[i + 1], parts[i] == 'e'))
+            self.parts += ['', parts[i + 2]]
+        self.css   = css
+        self.js    = js
+
+    # Returns the html of the document with the values of the slots, taken
+    # from the dict values, converted to strings.
+    def render_html(self, values: dict):
+        parts = self.parts.copy()
+        for i, name, escape in self.slots:
+            value = str(values[name])
+            parts[i] = html_escape(value) if escape else value
+        return ''.join(parts)
+
+    def render(self, values: dict):
+        return self.render_html(values), self.css, self.js
+
 class Application(object):
 
     def __init__(self):
-        # Each entry has format [Rectangle, name, class_name, parent_id, children_ids...]
-        # where parent_id can be None, and children_ids can be empty.
-        # The root rectangle contains only children ids.
-        self.rectangles               = {}
-        self.root_id                  = id(self)
-        self.rectangles[self.root_id] = [Rectangle(), 'body_' + str(self.root_id), None, None]
+        # All rectangles are kept in a _RectangleStore, and are referred to by
+        # their rect_id. The root rectangle, the document body, has no parent.
+        self.rectangles               = _RectangleStore()
+        self.root_id                  = self.rectangles.add(-1, 'body')
         self.metadata                 = None
-        self.rect_settings            = {}
         self.parent_stack             = [self.root_id]
         self.current_form_id          = None
         self.label_refs               = {}
+        self._expression_css_cache    = {}
+        self._geometry                = {}
+        # The group of rectangles sharing a css rule of each rectangle, named
+        # by its owner, see _share_css.
+        self._css_declarations        = {}
+        self._css_groups              = {}
+        self._css_group_declarations  = {}
+        self._css_group_members       = {}
+        # Short names of the generated html ids and js identifiers when
+        # minifying, see _rect_name and _js_name.
+        self._minify                  = False
+        self._name_prefix             = '_'
+        self._js_names                = {}
+        # Names of the unnamed rectangles when naming them by their path, see
+        # _assign_path_names.
+        self._path_names              = {}
+        self._path_child_counts       = {}
+        self._path_keys               = {}
+        self._path_names_key          = None
+        self._path_names_end          = 0
+        # The naming of the current render, and the names of the unnamed
+        # rectangles in components, see _find_components.
+        self._naming                  = 'order'
+        self._component_names         = {}
+        # Whether the children of rows and columns fit in them, see
+        # _children_fit.
+        self._children_fit_cache      = {}
+        # Components found by the last render, see _find_components.
+        self._component_keys          = {}
+        self._cached_components       = {}
+        # What the last call to render_incremental rendered.
+        self._incremental             = None
+        # The Profiler of the current profile() block.
+        self._profiler                = None
+        # The (spec, args) of each lazy rectangle, see lazy_rectangle, and
+        # whether the rectangles they create share css rules.
+        self._lazy_specs              = {}
+        self._share_lazy_css          = False
+        # The rectangles left out of the render, and the css declarations
+        # added to others in their place, see _reduce_dom.
+        self._removed_rects           = set()
+        self._reduced_declarations    = {}
+        # The rows of each virtual list, rendered into the js, see
+        # virtual_list.
+        self._virtual_lists           = {}
+        # Statistics gathered by the last render, e.g. the number of
+        # expression nodes removed by simplification.
+        self.render_stats             = {}
+
+    # The expressions kept by the application, e.g. in _geometry, are pickled
+    # as one table, like those of the rectangles.
+    def __getstate__(self):
+        table = _ExpressionTable()
+        state = dict(table.encode(self.__dict__))
+        state['_expressions'] = table
+        return state
+
+    def __setstate__(self, state: dict):
+        table = state.pop('_expressions')
+        self.__dict__.update(table.decode(state))
+
+    # Copies share the values of the application, as with the default
+    # copy.copy, without encoding them.
+    def __copy__(self):
+        app = object.__new__(Application)
+        app.__dict__.update(self.__dict__)
+        return app
 
     def root(self):
-        return self.rectangles[self.root_id][0]
+        return self.rectangles.rectangle(self.root_id)
 
     def set_metadata(self, metadata):
         self.metadata = metadata
@@ -148,22 +1232,113 @@ class Application(object):
                 spacer.set_grow(1.0)
             else:
                 id_parent = self.parent_stack[-2]
-                parent = self.rectangles[id_parent][0]
-                if parent.layout == Layout.ROW:
+                if self.rectangles.layouts[id_parent] == Layout.ROW:
                     spacer.set_width(size)
                 else:
                     spacer.set_height(size)
 
+    # Creates a rectangle whose children are only created while it's being
+    # rendered, by the generator function spec, called as spec(app, *args)
+    # with the rectangle as the current parent. Each time spec yields, the
+    # children it created since are rendered and then removed, so that only
+    # those are kept in memory. Spec must only yield between the children it
+    # creates, and is run again for each render pass. The geometry of the
+    # rectangles it creates can't depend on the measured size of rectangles,
+    # as that would require js.
+    def lazy_rectangle(self, spec, *args, name=None, class_name=None):
+        rect = self._create_rectangle(self.parent_stack[-1], name, class_name)
+        self._lazy_specs[rect.rect_id] = (spec, args)
+        return rect
+
+    # Creates a scrolling list of items, of which only the rows of the first
+    # window items are rendered as html. Each row is created by template,
+    # called as template(app, item), and must be a single rectangle, with any
+    # children. The text, link, image and input value of the rows of all the
+    # items are rendered into the js instead, where the rows of the window are
+    # reused for the items scrolled into view. The rows must therefore all
+    # have the same structure, and the same height, row_height, or if not
+    # given, the height of the first row as measured by js. The size of the
+    # returned rectangle, the viewport of the list, is set by the caller.
+    def virtual_list(self, template, items, window: int = 50, row_height: Number = None, name=None, class_name=None):
+        rects = self.rectangles
+        with self.rectangle(name, class_name) as container:
+            container.style['overflow-y'] = 'auto'
+            with self.rectangle() as content:
+                if row_height is not None:
+                    content.set_height(len(items) * row_height)
+                with self.rectangle() as window_rect:
+                    window_rect.style['will-change'] = 'transform'
+                    window_id = window_rect.rect_id
+
+                    # The fields of each row, and the row_id of the rows
+                    # kept. Rows past the window are removed once read.
+                    structure = None
+                    values = []
+                    row_ids = []
+                    for index, item in enumerate(items):
+                        row_id = len(rects)
+                        template(self, item)
+                        if self.parent_stack[-1] != window_id:
+                            raise ValueError('Virtual list templates must close the rectangles they create')
+                        row_structure = tuple(
+                            (
+                                rects.types[rect_id],
+                                rects.parent[rect_id] - row_id if rect_id != row_id else -1,
+                                rects.link[rect_id] is None,
+                                rects.image[rect_id] is None,
+                            )
+                            for rect_id in range(row_id, len(rects))
+                        )
+                        if not row_structure or any(parent < 0 for _, parent, _, _ in row_structure[1:]):
+                            raise ValueError('Virtual list templates must create a single rectangle')
+                        if structure is None:
+                            structure = row_structure
+                        elif row_structure != structure:
+                            raise ValueError('The rows of a virtual list must all have the same structure')
+                        values.append(tuple(
+                            value
+                            for rect_id in range(row_id, len(rects))
+                            for value in (rects.text[rect_id], rects.link[rect_id], rects.image[rect_id], rects.value[rect_id])
+                        ))
+
+                        if index < window:
+                            row_ids.append(row_id)
+                            if row_height is not None and rects.height[row_id] is None:
+                                rects.rectangle(row_id).set_height(row_height)
+                        else:
+                            self._remove_rectangles(row_id)
+
+        # Only the fields which differ between rows are rendered into the js.
+        # Text is set as the inner html of the element, replacing its
+        # children, so it may only differ in rectangles without any.
+        fields = []
+        if values:
+            parents = {parent for _, parent, _, _ in structure}
+            for i in range(len(values[0])):
+                if all(row[i] == values[0][i] for row in values):
+                    continue
+                if i % 4 == 0 and i // 4 in parents:
+                    raise ValueError('The text of the rows of a virtual list can only differ in rectangles without children')
+                fields.append(i)
+        self._virtual_lists[container.rect_id] = (
+            content.rect_id,
+            window_id,
+            row_height,
+            [[row_id + i // 4 for i in fields] for row_id in row_ids],
+            [('innerHTML', 'href', 'src', 'value')[i % 4] for i in fields],
+            # Escaped so that the js can also be inlined in a script element.
+            json.dumps([[row[i] for i in fields] for row in values], separators=(',', ':')).replace('</', '<\\/'),
+        )
+        return container
+
     # @todo: Give a warning if name is not unique and append the rect_id to
     # make it unique.
     def _create_rectangle(self, rect_id_parent, name=None, class_name=None):
-        rect = Rectangle()
-        rect_id = id(rect)
-        name = name if name else 'rect_%d' % rect_id
-        self.rectangles[rect_id] = [rect, name, class_name, rect_id_parent]
-        self.rect_settings[rect_id] = {}
-        self.rectangles[rect_id_parent].append(rect_id)
-        return rect
+        # The name of the root is reserved, as ids must be unique.
+        if name is not None and name == self.rectangles.names[self.root_id]:
+            raise ValueError(f'The name {name} is reserved for the document body')
+        rect_id = self.rectangles.add(rect_id_parent, name, class_name)
+        return self.rectangles.rectangle(rect_id)
 
     def push_rectangle(self, name=None, class_name=None):
         current_id_parent = self.parent_stack[-1]
@@ -172,7 +1347,7 @@ class Application(object):
             name=name,
             class_name=class_name
         )
-        self.parent_stack.append(id(rect))
+        self.parent_stack.append(rect.rect_id)
         return rect
 
     def pop_rectangle(self):
@@ -185,12 +1360,50 @@ class Application(object):
         finally:
             self.pop_rectangle()
 
+    # Profiles the renders within the block, see Profiler. The time in the
+    # block not spent rendering is reported as building the tree.
+    @contextmanager
+    def profile(self, top_n: int = 10, callback=None):
+        profiler = Profiler(self, top_n, callback)
+        num_rects = len(self.rectangles)
+        self._profiler = profiler
+        # The per rectangle render methods are timed by shadowing them.
+        for name in _profiled_methods:
+            setattr(self, name, profiler._timed(getattr(self, name)))
+        try:
+            yield profiler
+        finally:
+            for name in _profiled_methods:
+                delattr(self, name)
+            self._profiler = None
+            profiler.end = time.perf_counter()
+            profiler.rectangles_built = len(self.rectangles) - num_rects
+
+    # Returns a context manager timing a phase of rendering when profiling,
+    # see Profiler.phase.
+    def _phase(self, name: str):
+        if self._profiler is None:
+            return nullcontext()
+        return self._profiler.phase(name)
+
+    # Creates a rectangle whose subtree is a component. When rendering with a
+    # RenderCache, the html and css of components is looked up in the cache,
+    # and only rendered if the subtree changed since it was last rendered.
+    @contextmanager
+    def component(self, name=None, class_name=None):
+        try:
+            rect = self.push_rectangle(name, class_name)
+            self.rectangles.components[rect.rect_id] = True
+            yield rect
+        finally:
+            self.pop_rectangle()
+
     @contextmanager
     def form(self, name=None, class_name=None):
         try:
             rect = self.push_rectangle(name, class_name)
             rect.type = RectType.FORM
-            self.current_form_id = id(rect)
+            self.current_form_id = rect.rect_id
             yield rect
         finally:
             self.pop_rectangle()
@@ -212,7 +1425,7 @@ class Application(object):
 
         label_rect.type = RectType.LABEL
 
-        self.label_refs[id(label_rect)] = id(input_rect)
+        self.label_refs[label_rect.rect_id] = input_rect.rect_id
 
         return input_rect, label_rect
 
@@ -459,44 +1672,129 @@ class Application(object):
 
         return week_rect, label_rect
 
-    def _render_rect_html(self, rect_id):
-        rect_node = self.rectangles[rect_id]
-        rect = rect_node[0]
+    # Walks the rectangle tree rooted at rect_id in document order. Yields
+    # (rect_id, True) when entering a rectangle, and (rect_id, False) when
+    # leaving it, after all its children have been walked. The tree is walked
+    # by following the parent and sibling links instead of recursing, so that
+    # the depth of the tree is not limited by the interpreter's recursion
+    # limit. The children of rectangles in skip are not walked; skip may be
+    # added to while walking.
+    def _walk_rectangles(self, rect_id, skip=()):
+        first_child  = self.rectangles.first_child
+        next_sibling = self.rectangles.next_sibling
+        parent       = self.rectangles.parent
+        root_id      = rect_id
+        while True:
+            yield rect_id, True
+            child_id = first_child[rect_id] if rect_id not in skip else -1
+            if child_id >= 0:
+                rect_id = child_id
+                continue
+
+            # Leave rectangles up the tree until one with a next sibling is
+            # found.
+            while True:
+                yield rect_id, False
+                if rect_id == root_id:
+                    return
+                sibling_id = next_sibling[rect_id]
+                if sibling_id >= 0:
+                    rect_id = sibling_id
+                    break
+                rect_id = parent[rect_id]
+
+    # Returns the html id of the rectangle. When minifying, generated names
+    # are replaced by short base-36 ones, while user names are kept.
+    def _rect_name(self, rect_id):
+        path_name = self._path_names.get(rect_id)
+        if path_name is not None:
+            return path_name
+        component_name = self._component_names.get(rect_id)
+        if component_name is not None:
+            return component_name
+        if self._minify and (rect_id == self.root_id or self.rectangles.names[rect_id] is None):
+            return self._name_prefix + _base36(rect_id)
+        return self.rectangles.name(rect_id)
+
+    # Returns a prefix for generated names which no user name or class name
+    # starts with, so that the two never collide.
+    def _get_name_prefix(self):
+        rects = self.rectangles
+        user_names = set(rects.names[1:]) | set(rects.class_names)
+        user_names.discard(None)
+        prefix = '_'
+        while any(name.startswith(prefix) for name in user_names):
+            prefix += '_'
+        return prefix
+
+    # Returns the js identifier of the element of the rectangle, or of its
+    # variable with the given suffix, e.g. its measured width. When minifying,
+    # identifiers are given short base-36 names in order of first use.
+    def _js_name(self, rect_id, suffix=None):
+        if self._minify:
+            key = (rect_id, suffix)
+            name = self._js_names.get(key)
+            if name is None:
+                name = '_' + _base36(len(self._js_names))
+                self._js_names[key] = name
+            return name
+        if self._path_names:
+            # Path names are separated by '-', which can't be used in js
+            # identifiers.
+            rect_name = self._rect_name(rect_id).replace('-', '$')
+        else:
+            rect_name = self.rectangles.name(rect_id)
+        return rect_name if suffix is None else f'{rect_name}_{suffix}'
 
-        tags = f'id="{rect_node[1]}" '
-        if rect_node[2]:
-            tags += f'class="{rect_node[2]}" '
+    # Returns the js identifier of the i-th shared subexpression.
+    def _js_const_name(self, i):
+        if self._minify:
+            return self._js_name(None, i)
+        return f'_e{i}'
 
-        if rect.type == RectType.LABEL:
-            ref_id = self.label_refs[id(rect)]
-            ref_node = self.rectangles[ref_id]
-            html = f'<label for="{ref_node[1]}" {tags}>'
+    # Returns the opening html of the rectangle, including its text, and the
+    # matching closing element.
+    def _render_rect_html(self, rect_id):
+        rects     = self.rectangles
+        rect_name = self._rect_name(rect_id)
+        rect_type = rects.types[rect_id]
+        link      = rects.link[rect_id]
+        image     = rects.image[rect_id]
+
+        tags = f'id="{rect_name}" '
+        if rects.class_names[rect_id]:
+            tags += f'class="{rects.class_names[rect_id]}" '
+
+        if rect_type == RectType.LABEL:
+            ref_id = self.label_refs[rect_id]
+            html = f'<label for="{self._rect_name(ref_id)}" {tags}>'
             closing_element = '</label>\n'
-        elif rect.type == RectType.FORM:
+        elif rect_type == RectType.FORM:
             html = f'<form {tags}>'
             closing_element = '</form>\n'
-        elif rect.type >= RectType.TEXTBOX and rect.type <= RectType.WEEK:
-            tags += f'name="{rect_node[1]}" '
-            input_type = rect_type_strings[rect.type]
-            if (rect.type == RectType.RADIO) or (rect.type == RectType.CHECKBOX):
-                if rect.checked:
+        elif rect_type >= RectType.TEXTBOX and rect_type <= RectType.WEEK:
+            tags += f'name="{rect_name}" '
+            input_type = rect_type_strings[rect_type]
+            if (rect_type == RectType.RADIO) or (rect_type == RectType.CHECKBOX):
+                if rects.checked[rect_id]:
                     tags += f'checked'
 
-            if rect.value is None:
+            value = rects.value[rect_id]
+            if value is None:
                 html = f'<input type="{input_type}" {tags}>'
             else:
-                html = f'<input type="{input_type}" value="{rect.value}" {tags}>'
+                html = f'<input type="{input_type}" value="{value}" {tags}>'
 
             closing_element = '</input>\n'
 
-        elif rect.link and rect.image:
-            html = f'<a href="{rect.link}"><img src="{rect.image}" {tags}>'
+        elif link and image:
+            html = f'<a href="{link}"><img src="{image}" {tags}>'
             closing_element = '</img></a>\n'
-        elif rect.image:
-            html = f'<img src="{rect.image}" {tags}>'
+        elif image:
+            html = f'<img src="{image}" {tags}>'
             closing_element = '</img>\n'
-        elif rect.link:
-            html = f'<a href="{rect.link}" {tags}>'
+        elif link:
+            html = f'<a href="{link}" {tags}>'
             closing_element = '</a>\n'
         else:
             if rect_id != self.root_id:
@@ -506,101 +1804,488 @@ class Application(object):
                 html = f'<body {tags}>'
                 closing_element = '</body>\n'
 
-        if rect.text is not None:
-            html += rect.text
-        for i in range(4, len(rect_node)):
-            html += self._render_rect_html(rect_node[i])
+        if self._minify:
+            # Input and image elements are void, they have no closing tag.
+            html = html.replace('" >', '">')
+            closing_element = closing_element.replace('</input>', '').replace('</img>', '')
+            closing_element = closing_element.rstrip('\n')
 
-        html += closing_element
-        return html
+        text = rects.text[rect_id]
+        if text is not None:
+            html += text
 
-    def _render_rect_css(self, rect_id):
-        css = '\n'
-        rect_node = self.rectangles[rect_id]
-        rect = rect_node[0]
-        css += f'#{rect_node[1]} {{\n'
+        return html, closing_element
+
+    # Returns the css declarations of the rectangle, one per line.
+    def _render_rect_css_declarations(self, rect_id):
+        css = ''
+        rects  = self.rectangles
+        layout = rects.layouts[rect_id]
+        pivot  = rects.pivots[rect_id]
+        grow   = rects.grow[rect_id]
+        style  = rects.style[rect_id]
+        position, size = self._get_geometry(rect_id)
         #css += 'display: block;\n'
         #css += 'overflow: hidden;\n'
 
-        if rect.position[0] is not None or rect.position[1] is not None:
+        if position[0] is not None or position[1] is not None:
             css += 'position: absolute;\n'
 
-        if rect.layout == Layout.NONE:
-            if isinstance(rect.position[0], Number):
-                if rect.pivot == Pivot.TOP_LEFT or rect.pivot == Pivot.BOTTOM_LEFT:
-                    css += f'left: {rect.position[0]}px;\n'
+        if layout == Layout.NONE:
+            if isinstance(position[0], Number):
+                if pivot == Pivot.TOP_LEFT or pivot == Pivot.BOTTOM_LEFT:
+                    css += f'left: {position[0]}px;\n'
                 else:
-                    css += f'right: {rect.position[0]}px;\n'
-            elif isinstance(rect.position[0], Expression):
-                vars = list(self._get_size_vars_in_expression(rect.position[0]))
+                    css += f'right: {position[0]}px;\n'
+            elif isinstance(position[0], Expression):
+                vars = list(self._get_size_vars_in_expression(position[0]))
                 if not vars:
-                    css_expression = self._render_expression_css(rect.position[0])
+                    css_value = self._render_css_value(position[0])
 
-                    if rect.pivot == Pivot.TOP_LEFT or rect.pivot == Pivot.BOTTOM_LEFT:
+                    if pivot == Pivot.TOP_LEFT or pivot == Pivot.BOTTOM_LEFT:
                         side = 'left'
                     else:
                         side = 'right'
 
-                    if rect.position[0].children:
-                        css += f'{side}: calc({css_expression[1:-1]});\n'
-                    else:
-                        css += f'{side}: {css_expression};\n'
+                    css += f'{side}: {css_value};\n'
 
-            if isinstance(rect.position[1], Number):
-                if rect.pivot == Pivot.TOP_LEFT or rect.pivot == Pivot.TOP_RIGHT:
-                    css += f'top: {rect.position[1]}px;\n'
+            if isinstance(position[1], Number):
+                if pivot == Pivot.TOP_LEFT or pivot == Pivot.TOP_RIGHT:
+                    css += f'top: {position[1]}px;\n'
                 else:
-                    css += f'bottom: {rect.position[1]}px;\n'
-            elif isinstance(rect.position[1], Expression):
-                vars = list(self._get_size_vars_in_expression(rect.position[1]))
+                    css += f'bottom: {position[1]}px;\n'
+            elif isinstance(position[1], Expression):
+                vars = list(self._get_size_vars_in_expression(position[1]))
                 if not vars:
-                    css_expression = self._render_expression_css(rect.position[1])
+                    css_value = self._render_css_value(position[1])
 
-                    if rect.pivot == Pivot.TOP_LEFT or rect.pivot == Pivot.TOP_RIGHT:
+                    if pivot == Pivot.TOP_LEFT or pivot == Pivot.TOP_RIGHT:
                         side = 'top'
                     else:
                         side = 'bottom'
 
-                    if rect.position[1].children:
-                        css += f'{side}: calc({css_expression[1:-1]});\n'
-                    else:
-                        css += f'{side}: {css_expression};\n'
+                    css += f'{side}: {css_value};\n'
+        elif layout == Layout.GRID:
+            css += 'display: grid;\n'
+            grid = rects.grid[rect_id]
+            if grid is not None:
+                columns, rows, gap = grid
+                if columns:
+                    css += f'grid-template-columns: {self._render_grid_tracks(columns)};\n'
+                if rows:
+                    css += f'grid-template-rows: {self._render_grid_tracks(rows)};\n'
+                if gap is not None:
+                    css += f'gap: {self._render_grid_track(gap)};\n'
         else:
             css += 'display: flex;\n'
-            css += 'flex-direction: %s;\n' % ('row' if rect.layout == Layout.ROW else 'column')
+            css += 'flex-direction: %s;\n' % ('row' if layout == Layout.ROW else 'column')
 
-        if rect.grow is not None:
-            css += f'flex-grow: {rect.grow};'
+        if grow is not None:
+            css += f'flex-grow: {grow};\n'
 
-        if isinstance(rect.size[0], Number):
-            css += f'width: {rect.size[0]}px;\n'
-        elif isinstance(rect.size[0], Expression):
-            vars = list(self._get_size_vars_in_expression(rect.size[0]))
+        if isinstance(size[0], Number):
+            css += f'width: {size[0]}px;\n'
+        elif isinstance(size[0], Expression):
+            vars = list(self._get_size_vars_in_expression(size[0]))
             if not vars:
-                css_expression = self._render_expression_css(rect.size[0])
-                if rect.size[0].children:
-                    css += f'width: calc({css_expression[1:-1]});\n'
-                else:
-                    css += f'width: {css_expression};\n'
+                css_value = self._render_css_value(size[0])
+                css += f'width: {css_value};\n'
 
-        if isinstance(rect.size[1], Number):
-            css += f'height: {rect.size[1]}px;\n'
-        elif isinstance(rect.size[1], Expression):
-            vars = list(self._get_size_vars_in_expression(rect.size[1]))
+        if isinstance(size[1], Number):
+            css += f'height: {size[1]}px;\n'
+        elif isinstance(size[1], Expression):
+            vars = list(self._get_size_vars_in_expression(size[1]))
             if not vars:
-                css_expression = self._render_expression_css(rect.size[1])
-                if rect.size[1].children:
-                    css += f'height: calc({css_expression[1:-1]});\n'
-                else:
-                    css += f'height: {css_expression};\n'
+                css_value = self._render_css_value(size[1])
+                css += f'height: {css_value};\n'
+
+        reduced_declarations = self._reduced_declarations.get(rect_id)
+        if reduced_declarations:
+            for k, v in reduced_declarations.items():
+                css += '%s: %s;\n' % (k, v)
 
-        for k, v in rect.style.items():
-            css += '%s: %s;\n' % (k, v)
+        if style:
+            for k, v in style.items():
+                css += '%s: %s;\n' % (k, v)
 
-        css += '}\n'
         return css
 
-    def _render_expression_css(self, expression: Expression, expression_css: str = ''):
+    # Renders a track size of a grid, see Rectangle.set_grid.
+    def _render_grid_track(self, size):
+        if isinstance(size, Number):
+            return f'{size}px'
+        if isinstance(size, Expression):
+            return self._render_css_value(size)
+        return size
+
+    # Renders the track sizes of a grid, with runs of the same size, as in
+    # tiled pages, rendered once with repeat().
+    def _render_grid_tracks(self, sizes):
+        tracks = []
+        for size, run in itertools.groupby(self._render_grid_track(size) for size in sizes):
+            count = len(list(run))
+            tracks.append(f'repeat({count}, {size})' if count > 1 else size)
+        return ' '.join(tracks)
+
+    # Formats a css rule from the declarations returned by
+    # _render_rect_css_declarations.
+    def _render_css_rule(self, selector: str, declarations: str):
+        if self._minify:
+            declarations = ';'.join(
+                d.replace(': ', ':', 1) for d in declarations.split(';\n') if d
+            )
+            return f'{selector}{{{declarations}}}'
+        return f'\n{selector} {{\n{declarations}}}\n'
+
+    # Returns the (selector, declarations) of the css rule rendered along with
+    # the rectangle, or None if there is none.
+    def _get_rect_css_rule(self, rect_id):
+        group = self._css_groups.get(rect_id)
+        if group is None:
+            if rect_id in self._css_groups:
+                return None
+            return f'#{self._rect_name(rect_id)}', self._render_rect_css_declarations(rect_id)
+        elif group == rect_id:
+            return self._render_css_group_selector(group), self._css_group_declarations[group]
+        return None
+
+    # Returns the selector of the rule shared by a group of rectangles, the
+    # list of their ids, which keeps the specificity of an id selector.
+    def _render_css_group_selector(self, group: int):
+        separator = ',' if self._minify else ',\n'
+        return separator.join(f'#{self._rect_name(rect_id)}' for rect_id in self._css_group_members[group])
+
+    # Adds a group of rectangles sharing the css declarations, whose rule is
+    # emitted along with the first of them, its owner, which names the group.
+    def _add_css_group(self, declarations: str, owner_id: int):
+        self._css_group_declarations[owner_id] = declarations
+        self._css_group_members[owner_id] = [owner_id]
+        return owner_id
+
+    def _render_rect_css(self, rect_id):
+        rule = self._get_rect_css_rule(rect_id)
+        if rule is not None:
+            yield self._render_css_rule(*rule)
+
+    # Finds the rectangles which share the same css declarations. Each set of
+    # declarations shared by more than one rectangle is rendered once, as a
+    # rule whose selector lists the ids of the rectangles, instead of once per
+    # rectangle id. Listing the ids, rather than adding a generated class to
+    # the rectangles, keeps the rules as specific as before, so that they win
+    # over the same stylesheet rules. Rectangles without any declarations get
+    # no rule at all. Components rendered with a cache are shared separately,
+    # within the subtree at root_id, so that their rules are the same on
+    # every page. Returns the rectangles with each set of declarations, in
+    # document order.
+    def _share_css(self, root_id: int):
+        declaration_rects = {}
+        components = self._component_keys.keys() - {root_id}
+        for rect_id, entering in self._walk_rectangles(root_id, components):
+            if not entering or rect_id in components or rect_id in self._removed_rects:
+                continue
+            declarations = self._css_declarations.get(rect_id)
+            if declarations is None:
+                declarations = self._render_rect_css_declarations(rect_id)
+                self._css_declarations[rect_id] = declarations
+            rect_ids = declaration_rects.get(declarations)
+            if rect_ids is None:
+                declaration_rects[declarations] = [rect_id]
+            else:
+                rect_ids.append(rect_id)
+
+        num_groups = 0
+        bytes_saved = 0
+        for declarations, rect_ids in declaration_rects.items():
+            num_groups += self._group_css(declarations, rect_ids)
+            bytes_saved += self._get_css_bytes_saved(declarations, rect_ids)
+
+        stats = self.render_stats
+        stats['css_rules_shared'] = stats.get('css_rules_shared', 0) + num_groups
+        stats['css_bytes_saved'] = stats.get('css_bytes_saved', 0) + bytes_saved
+        return declaration_rects
+
+    # Groups the rectangles with the given declarations, in document order.
+    # The rule of the group is emitted along with the first of them, its
+    # owner. Returns the number of groups added, 0 if the declarations are
+    # unique or empty.
+    def _group_css(self, declarations: str, rect_ids: list):
+        if not declarations:
+            for rect_id in rect_ids:
+                self._css_groups[rect_id] = None
+            return 0
+        if len(rect_ids) == 1:
+            return 0
+        group = self._add_css_group(declarations, rect_ids[0])
+        self._css_group_members[group].extend(rect_ids[1:])
+        for rect_id in rect_ids:
+            self._css_groups[rect_id] = group
+        return 1
+
+    # Returns the number of css bytes saved by sharing the declarations among
+    # the rectangles, instead of giving each of them its own rule.
+    def _get_css_bytes_saved(self, declarations: str, rect_ids: list):
+        if len(rect_ids) == 1 and declarations:
+            return 0
+        rule_size = len(self._render_css_rule('', declarations))
+        if not declarations:
+            return sum(rule_size + len(self._rect_name(rect_id)) + 1 for rect_id in rect_ids)
+        separator_size = len(',' if self._minify else ',\n')
+        return (len(rect_ids) - 1) * (rule_size - separator_size)
+
+    # Returns the cache key of the component at rect_id, a hash of everything
+    # its rendered html and css depend on. When naming rectangles by order,
+    # the unnamed rectangles in the component are named relative to it, see
+    # _find_components, so they are hashed by their offset from it, and the
+    # key is the same on every page.
+    def _get_component_key(self, rect_id, options: bytes, digests: dict):
+        rects = self.rectangles
+        root_id = rect_id
+        def name(rect_id, inside=True):
+            if self._naming != 'order' or rects.names[rect_id] is not None:
+                return self._rect_name(rect_id)
+            if rect_id == root_id:
+                return self._component_names.get(rect_id)
+            if inside or root_id in self._get_ancestors(rect_id):
+                return rect_id - root_id
+            return self._rect_name(rect_id)
+
+        key = hashlib.sha256(options)
+        for rect_id, entering in self._walk_rectangles(rect_id):
+            if not entering:
+                key.update(b')')
+                continue
+
+            position, size = self._get_geometry(rect_id)
+            geometry = [
+                _expression_digest(v, digests) if isinstance(v, Expression) else v
+                for v in (*position, *size)
+            ]
+            grid = rects.grid[rect_id]
+            if grid is not None:
+                grid = [
+                    _expression_digest(v, digests) if isinstance(v, Expression) else v
+                    for v in (*grid[0], None, *grid[1], None, grid[2])
+                ]
+            style = rects.style[rect_id]
+            ref_id = self.label_refs.get(rect_id)
+            lazy_spec = self._lazy_specs.get(rect_id)
+            if lazy_spec is not None:
+                spec, args = lazy_spec
+                lazy_spec = f'{spec.__module__}.{spec.__qualname__}{args!r}'
+            # What _reduce_dom left of the rectangle depends on whether the
+            # page refers to it, not only on the component.
+            reduced = self._reduced_declarations.get(rect_id)
+            fields = (
+                name(rect_id),
+                rects.class_names[rect_id],
+                rects.types[rect_id],
+                rects.pivots[rect_id],
+                rects.layouts[rect_id],
+                rects.grow[rect_id],
+                geometry,
+                rects.text[rect_id],
+                rects.link[rect_id],
+                rects.image[rect_id],
+                rects.value[rect_id],
+                rects.checked[rect_id],
+                grid,
+                list(style.items()) if style else None,
+                name(ref_id, False) if ref_id is not None else None,
+                lazy_spec,
+                rect_id in self._removed_rects,
+                sorted(reduced.items()) if reduced else None,
+            )
+            key.update(b'(' + repr(fields).encode())
+        return key.hexdigest()
+
+    # Computes the cache key of each component, and looks up the html and css
+    # of the outermost ones. Components inside cached ones are not looked up.
+    # When naming rectangles by order, the unnamed rectangles in components
+    # are named after their innermost component and their offset in it, e.g.
+    # header_3, rather than after their rect_id, so that a component renders
+    # the same on every page. Unnamed outermost components are named after
+    # their key, and identical ones on the same page are told apart by the
+    # order in which they appear.
+    def _find_components(self, cache: RenderCache, share_css: bool, reduce_dom: bool = False):
+        rects = self.rectangles
+        options = (self._minify, self._name_prefix, self._naming, share_css) + (('reduce_dom',) if reduce_dom else ())
+        options = repr(options).encode()
+        digests = {}
+        relative_names = self._naming == 'order'
+        occurrences = {}
+        enclosing = []
+        cached_id = None
+        for rect_id, entering in self._walk_rectangles(self.root_id):
+            is_component = rects.components[rect_id]
+            if not entering:
+                if is_component:
+                    enclosing.pop()
+                if rect_id == cached_id:
+                    cached_id = None
+                continue
+
+            if relative_names and enclosing and rects.names[rect_id] is None:
+                component_id = enclosing[-1]
+                offset = rect_id - component_id
+                offset = _base36(offset) if self._minify else offset
+                self._component_names[rect_id] = f'{self._rect_name(component_id)}_{offset}'
+            if not is_component:
+                continue
+            enclosing.append(rect_id)
+            if cached_id is not None:
+                continue
+
+            key = self._get_component_key(rect_id, options, digests)
+            if relative_names and rects.names[rect_id] is None and rect_id not in self._component_names:
+                count = occurrences.get(key, 0)
+                occurrences[key] = count + 1
+                if count:
+                    key = hashlib.sha256(f'{key}#{count}'.encode()).hexdigest()
+                if self._minify:
+                    self._component_names[rect_id] = f'{self._name_prefix}c{key[:8]}'
+                else:
+                    self._component_names[rect_id] = f'component_{key[:8]}'
+            self._component_keys[rect_id] = key
+            fragments = cache.get(key)
+            if fragments is not None:
+                self._cached_components[rect_id] = fragments
+                cached_id = rect_id
+
+        num_cached = len(self._cached_components)
+        self.render_stats['components_cached'] = num_cached
+        self.render_stats['components_rendered'] = len(self._component_keys) - num_cached
+
+    # Renders the subtree of root_id, by default the whole document, in
+    # document order, where render_rect returns the chunk to emit when entering
+    # a rectangle, and the one when leaving it. The subtrees in spliced, by
+    # default the cached components, are spliced in from their fragment at the
+    # given index instead. The output of the components that aren't cached is
+    # collected into their fragments.
+    def _render_rectangles(self, render_rect, fragment_index: int, fragments: dict, root_id=None, spliced=None):
+        if root_id is None:
+            root_id = self.root_id
+        if spliced is None:
+            spliced = self._cached_components
+        closing_chunks = []
+        captures = []
+        for rect_id, entering in self._walk_rectangles(root_id, spliced):
+            if entering:
+                cached = spliced.get(rect_id)
+                if cached is not None:
+                    chunk, closing_chunk = cached[fragment_index], ''
+                elif rect_id in self._removed_rects:
+                    chunk, closing_chunk = '', ''
+                else:
+                    chunk, closing_chunk = render_rect(rect_id)
+                    if rect_id in self._component_keys:
+                        captures.append([])
+                closing_chunks.append(closing_chunk)
+            else:
+                chunk = closing_chunks.pop()
+
+            for capture in captures:
+                capture.append(chunk)
+            if not entering and rect_id in self._component_keys and rect_id not in spliced:
+                fragments.setdefault(rect_id, [None, None])[fragment_index] = ''.join(captures.pop())
+            if chunk:
+                yield chunk
+
+            if entering and cached is None and rect_id in self._lazy_specs:
+                for chunk in self._render_lazy(rect_id, render_rect, fragment_index, fragments):
+                    for capture in captures:
+                        capture.append(chunk)
+                    yield chunk
+
+    # Runs the spec of the lazy rectangle, rendering the children it creates
+    # each time it yields, and removing them afterwards. Unnamed rectangles
+    # are named after the lazy rectangle and their position in it, as their
+    # rect_ids are reused. When sharing css, those created between the same
+    # two yields with the same declarations share a rule, see _share_css.
+    def _render_lazy(self, rect_id: int, render_rect, fragment_index: int, fragments: dict):
+        rects = self.rectangles
+        spec, args = self._lazy_specs[rect_id]
+        num_rects = len(rects)
+        name = self._rect_name(rect_id)
+        num_children = 0
+        self.parent_stack.append(rect_id)
+        try:
+            for _ in itertools.chain(spec(self, *args), [None]):
+                if self.parent_stack[-1] != rect_id:
+                    raise ValueError('Lazy rectangle specs must only yield between the rectangles they create')
+
+                for child_id in range(num_rects, len(rects)):
+                    if rects.names[child_id] is None:
+                        index = _base36(num_children) if self._minify else num_children
+                        rects.names[child_id] = f'{name}_{index}'
+                        num_children += 1
+                    for value in (rects.x[child_id], rects.y[child_id], rects.width[child_id], rects.height[child_id]):
+                        if isinstance(value, Expression) and self._get_size_vars_in_expression(value):
+                            raise ValueError('The geometry of lazily created rectangles can\'t depend on measured sizes')
+                # Rules are only rendered in the css pass.
+                groups = []
+                if self._share_lazy_css and fragment_index == 1:
+                    groups = self._share_lazy_css_rules(num_rects)
+
+                for child_id in list(rects.children(rect_id)):
+                    yield from self._render_rectangles(render_rect, fragment_index, fragments, child_id)
+
+                for group in groups:
+                    del self._css_group_declarations[group]
+                    del self._css_group_members[group]
+                self._remove_rectangles(num_rects)
+        finally:
+            self.parent_stack.pop()
+            self._remove_rectangles(num_rects)
+
+    # Groups the rectangles from num_rects on, created by a lazy rectangle
+    # since it last yielded, by their css declarations, and returns the
+    # groups, see _share_css. The groups are only kept while the rectangles
+    # are, so that they are emitted once for each batch of rectangles.
+    def _share_lazy_css_rules(self, num_rects: int):
+        groups = {}
+        for rect_id in range(num_rects, len(self.rectangles)):
+            declarations = self._render_rect_css_declarations(rect_id)
+            if not declarations:
+                self._css_groups[rect_id] = None
+                continue
+            group = groups.get(declarations)
+            if group is None:
+                group = groups[declarations] = self._add_css_group(declarations, rect_id)
+            else:
+                self._css_group_members[group].append(rect_id)
+            self._css_groups[rect_id] = group
+        return list(groups.values())
+
+    # Removes the rectangles from num_rects on, along with their render
+    # state, see _render_lazy.
+    def _remove_rectangles(self, num_rects: int):
+        rects = self.rectangles
+        for rect_id in range(num_rects, len(rects)):
+            self.label_refs.pop(rect_id, None)
+            self._lazy_specs.pop(rect_id, None)
+            self._css_groups.pop(rect_id, None)
+        rects.truncate(num_rects)
+
+    # Renders the css rules of the rectangle, as a (chunk, closing chunk) pair
+    # for _render_rectangles.
+    def _render_rect_css_chunks(self, rect_id):
+        return ''.join(self._render_rect_css(rect_id)), ''
+
+    # Renders the expression as a css property value.
+    def _render_css_value(self, expression: Expression):
+        css_expression = self._render_expression_css(expression)
+        if expression.children and expression.op_or_varname not in ['min', 'max']:
+            return f'calc({css_expression[1:-1]})'
+        return css_expression
+
+    def _render_expression_css(self, expression: Expression):
+        return _evaluate_expression(
+            expression,
+            self._render_expression_node_css,
+            self._expression_css_cache
+        )
+
+    def _render_expression_node_css(self, expression: Expression, children):
         if expression.children:
             if expression.op_or_varname in ['min', 'max']:
                 op = expression.op_or_varname
@@ -609,26 +2294,20 @@ class Application(object):
                 op = op_str_dict[expression.op_or_varname]
                 op_is_func = False
 
-            left = expression.children[0]
-            if isinstance(left, Number):
-                if op == '+' or op == '-':
-                    left = f'{left}px'
-                else:
-                    left = f'{left}'
-            else:
-                left = self._render_expression_css(left, expression_css)
+            # Numbers that are added to, or compared with, lengths are
+            # lengths themselves.
+            is_length = op_is_func or op == '+' or op == '-'
+            children = [
+                (f'{c}px' if is_length else f'{c}') if isinstance(c, Number) else c
+                for c in children
+            ]
 
-            right = expression.children[1]
-            if isinstance(right, Number):
-                if op == '+' or op == '-':
-                    right = f'{right}px'
-                else:
-                    right = f'{right}'
-            else:
-                right  = self._render_expression_css(right, expression_css)
+            if op_is_func:
+                return f'{op}({", ".join(children)})'
 
             # @todo: Integer division needs separate handling!
-            return f'({left} {op} {right})' if not op_is_func else f'{op}({left}, {right})'
+            left, right = children
+            return f'({left} {op} {right})'
         else:
             varname = expression.op_or_varname
             if varname in ['vw', 'vh', 'vmin', 'vmax','%']:
@@ -638,20 +2317,37 @@ class Application(object):
                 assert(False)
                 return f'{varname}'
 
-    # @todo: Only yield vars not already yielded!
-    #@lru_cache
+    # Returns the distinct size placeholders in the expression, as
+    # (varname, rect_id) pairs, in the order in which they first appear.
     def _get_size_vars_in_expression(self, expression: Expression):
-        if expression.children:
-            for e in expression.children:
-                if isinstance(e, Expression):
-                    yield from self._get_size_vars_in_expression(e)
-        elif isinstance(expression, Expression):
-            val = tuple(expression.op_or_varname.split(' '))
-            is_size_var = len(val) == 2 and (val[0] == 'width' or val[0] == 'height')
-            if is_size_var:
-                yield val[0], int(val[1])
-
-    def _render_expression_js(self, expression: Expression, expression_js: str = ''):
+        size_vars = []
+        for name in _free_vars(expression):
+            size_var = _size_var_names.get(name, _size_var_names)
+            if size_var is _size_var_names:
+                size_var = _size_var_names[name] = _parse_size_var_name(name)
+            if size_var is not None:
+                size_vars.append(size_var)
+        return size_vars
+
+    # Renders the given expressions as js, sharing the work between them.
+    # Subexpressions that are referenced more than once are appended to consts
+    # as (name, expression, js) tuples, to be emitted as a 'const' declaration,
+    # and referenced by name afterwards. Returns the rendered expressions.
+    def _render_expressions_js(self, expressions, consts: list):
+        shared = _shared_subexpressions(expressions)
+
+        def render_node(expression, children):
+            js = self._render_expression_node_js(expression, children)
+            if expression in shared:
+                const_name = self._js_const_name(len(consts))
+                consts.append((const_name, expression, js))
+                return const_name
+            return js
+
+        cache = {}
+        return [_evaluate_expression(e, render_node, cache) for e in expressions]
+
+    def _render_expression_node_js(self, expression: Expression, children):
         if expression.children:
             if expression.op_or_varname in ['min', 'max']:
                 op = 'Math.' + expression.op_or_varname
@@ -660,111 +2356,1012 @@ class Application(object):
                 op = op_str_dict[expression.op_or_varname]
                 op_is_func = False
 
-            left = expression.children[0]
-            if isinstance(left, Number):
-                left = f'{left}'
-            else:
-                left = self._render_expression_js(left, expression_js)
+            children = [f'{c}' for c in children]
 
-            right = expression.children[1]
-            if isinstance(right, Number):
-                right = f'{right}'
-            else:
-                right  = self._render_expression_js(right, expression_js)
+            if op_is_func:
+                return f'{op}({", ".join(children)})'
 
             # @todo: Integer division needs separate handling!
-            return f'({left} {op} {right})' if not op_is_func else f'{op}({left}, {right})'
+            left, right = children
+            return f'({left} {op} {right})'
         else:
             varname = expression.op_or_varname
-            varname, rect_id = varname.split(' ')
-            rect_name = self.rectangles[int(rect_id)][1]
-            return f'{rect_name}_{varname}'
+            if varname in js_viewport_vars:
+                return js_viewport_vars[varname]
+            elif varname == '%':
+                # @todo: Percentages depend on the axis of the property they
+                # are used in.
+                assert(False)
 
-    def _render_rect_js(self, rect_id):
+            varname, rect_id = varname.split()
+            return self._js_name(int(rect_id), varname)
+
+    # Returns the position and size assignments that need to be done in js,
+    # as (rect_id, property, expression) tuples, in document order. These are
+    # the ones whose expression depends on the size of other rectangles.
+    def _get_js_assignments(self):
+        assignments = []
+        # Only expression-valued geometry can depend on sizes, see
+        # _resolve_geometry.
+        for rect_id, (position, size) in self._geometry.items():
+            pivot = self.rectangles.pivots[rect_id]
+            if pivot == Pivot.TOP_LEFT or pivot == Pivot.BOTTOM_LEFT:
+                horizontal = 'left'
+            else:
+                horizontal = 'right'
+            if pivot == Pivot.TOP_LEFT or pivot == Pivot.TOP_RIGHT:
+                vertical = 'top'
+            else:
+                vertical = 'bottom'
+
+            properties = zip(
+                [horizontal, vertical, 'width', 'height'],
+                [position[0], position[1], size[0], size[1]]
+            )
+            for prop, value in properties:
+                if isinstance(value, Expression):
+                    if any(self._get_size_vars_in_expression(value)):
+                        assignments.append((rect_id, prop, value))
+
+        return assignments
+
+    # Returns the rectangle and its ancestors.
+    def _get_ancestors(self, rect_id):
+        ancestors = []
+        while rect_id >= 0:
+            ancestors.append(rect_id)
+            rect_id = self.rectangles.parent[rect_id]
+        return ancestors
+
+    # Returns whether setting the width or height (prop) of the writer
+    # rectangle may change the size of the reader rectangle. This is the case
+    # if the writer is one of the reader's descendants, if they are laid out
+    # together in a row or column, or, for widths, which change how text wraps,
+    # if the writer is the reader itself or one of its ancestors.
+    def _size_affects(self, writer_id, prop, reader_id, reader_ancestors: set):
+        for ancestor_id in self._get_ancestors(writer_id):
+            if ancestor_id in reader_ancestors:
+                if ancestor_id == writer_id:
+                    return prop == 'width'
+                if ancestor_id == reader_id:
+                    return True
+                return self.rectangles.layouts[ancestor_id] != Layout.NONE
+        return False
+
+    # Plans the js code that sets the positions and sizes which can only be
+    # computed once the document is laid out. All assignments are done in a
+    # single block, where each element is queried once. Sizes are measured in
+    # phases: all measurements of a phase are done before any of its style
+    # writes, so that the browser lays out the document once per phase. A
+    # measurement is only deferred to a later phase if an earlier write may
+    # change it. Sizes that are themselves assigned in js are not measured
+    # but reuse the computed value.
+    #
+    # Returns a list of (measurements, consts, assignments) phases, where
+    # measurements maps rect ids to the size variables measured, consts are
+    # the shared subexpressions as returned by _render_expressions_js, and
+    # assignments are (rect_id, property, expression, js) tuples, in the order
+    # they need to be computed.
+    def _get_layout_phases(self):
+        assignments = self._get_js_assignments()
+        if not assignments:
+            return []
+
+        assigned_sizes = {
+            (prop, rect_id): i for i, (rect_id, prop, _) in enumerate(assignments)
+            if prop == 'width' or prop == 'height'
+        }
+
+        # The values an assignment is computed from.
+        def data_dependencies(node):
+            if node[0] == 'assign':
+                expression = assignments[node[1]][2]
+                for varname, rect_id in self._get_size_vars_in_expression(expression):
+                    i = assigned_sizes.get((varname, rect_id))
+                    if i is None:
+                        yield 'measure', rect_id, varname
+                    else:
+                        yield 'assign', i
+
+        # The data dependencies, plus the assignments that need to be written
+        # before a measurement can be taken.
+        def dependencies(node):
+            if node[0] == 'assign':
+                yield from data_dependencies(node)
+            else:
+                reader_id = node[1]
+                reader_ancestors = set(self._get_ancestors(reader_id))
+                for (prop, rect_id), i in assigned_sizes.items():
+                    if self._size_affects(rect_id, prop, reader_id, reader_ancestors):
+                        yield 'assign', i
+
+        roots = [('assign', i) for i in range(len(assignments))]
+        phases = {}
+        for node in _topological_order(roots, dependencies):
+            phase = 0
+            for dep in dependencies(node):
+                if dep in phases:
+                    if node[0] == 'measure':
+                        phase = builtins.max(phase, phases[dep] + 1)
+                    else:
+                        phase = builtins.max(phase, phases[dep])
+            phases[node] = phase
+
+        # Measurements depending on their own writes are cyclic layouts,
+        # which are broken up above by ignoring one of the dependencies. Make
+        # sure that assignments are still never computed before the values
+        # they depend on.
+        order = _topological_order(roots, data_dependencies)
+        for node in order:
+            for dep in data_dependencies(node):
+                phases[node] = builtins.max(phases[node], phases[dep])
+
+        layout_phases = []
+        consts = []
+        for phase in range(builtins.max(phases.values()) + 1):
+            measurements = {}
+            for node in order:
+                if node[0] == 'measure' and phases[node] == phase:
+                    measurements.setdefault(node[1], []).append(node[2])
+
+            phase_assignments = [
+                assignments[node[1]] for node in order
+                if node[0] == 'assign' and phases[node] == phase
+            ]
+            num_consts = len(consts)
+            values = self._render_expressions_js(
+                [expression for _, _, expression in phase_assignments],
+                consts
+            )
+            layout_phases.append((
+                measurements,
+                consts[num_consts:],
+                [a + (value,) for a, value in zip(phase_assignments, values)]
+            ))
+
+        return layout_phases
+
+    # Generates the code querying each of the elements used in the layout.
+    def _render_layout_queries_js(self, layout_phases):
         js = ''
-        rect_node = self.rectangles[rect_id]
-        rect = rect_node[0]
-
-        if rect.position is not None:
-            # @todo: Perhaps allow for a single block for both expressions.
-            if isinstance(rect.position[0], Expression):
-                size_vars = list(self._get_size_vars_in_expression(rect.position[0]))
-                if size_vars:
-                    js += '{\n'
-                    js += f"const rect = document.querySelector('#{rect_node[1]}');\n"
-                    for varname, rect_id in size_vars:
-                        rect_name = self.rectangles[rect_id][1]
-                        js += f"const {rect_name} = document.querySelector('#{rect_name}');\n"
-                        js += f"const {rect_name}_{varname} = {rect_name}.getBoundingClientRect().{varname};\n"
-                    js_expression = self._render_expression_js(rect.position[0])
-                    js += f"const value = {js_expression};\n"
-                    if rect.pivot == Pivot.TOP_LEFT or rect.pivot == Pivot.BOTTOM_LEFT:
-                        js += f"rect.style.left = value+'px';\n"
+        queried = set()
+        for measurements, _, assignments in layout_phases:
+            rect_ids = list(measurements) + [rect_id for rect_id, _, _, _ in assignments]
+            for rect_id in rect_ids:
+                if rect_id not in queried:
+                    queried.add(rect_id)
+                    js += f"const {self._js_name(rect_id)} = document.querySelector('#{self._rect_name(rect_id)}');\n"
+        return js
+
+    # Generates the js code that sets the positions and sizes which can only
+    # be computed once the document is laid out, see _get_layout_phases.
+    def _render_layout_js(self):
+        layout_phases = self._get_layout_phases()
+        if not layout_phases:
+            return
+
+        yield self._render_layout_queries_js(layout_phases)
+        for measurements, consts, assignments in layout_phases:
+            js = ''
+            for rect_id, varnames in measurements.items():
+                element = self._js_name(rect_id)
+                if len(varnames) == 1:
+                    js += f"const {self._js_name(rect_id, varnames[0])} = {element}.getBoundingClientRect().{varnames[0]};\n"
+                else:
+                    bounds = self._js_name(rect_id, 'bounds')
+                    js += f"const {bounds} = {element}.getBoundingClientRect();\n"
+                    for varname in varnames:
+                        js += f"const {self._js_name(rect_id, varname)} = {bounds}.{varname};\n"
+
+            for const_name, _, value in consts:
+                js += f'const {const_name} = {value};\n'
+            for rect_id, prop, _, value in assignments:
+                js += f"const {self._js_name(rect_id, prop)} = {value};\n"
+            for rect_id, prop, _, _ in assignments:
+                js += f"{self._js_name(rect_id)}.style.{prop} = {self._js_name(rect_id, prop)}+'px';\n"
+
+            yield js
+
+    # Generates the same layout code as _render_layout_js, but as a list of
+    # update functions, one per measured element and computed value. After
+    # the initial layout, elements whose size is measured are watched with a
+    # ResizeObserver, and the viewport with a resize event listener. When any
+    # of them changes, only the updates downstream of it are rerun, batched
+    # in the next animation frame.
+    def _render_layout_runtime_js(self):
+        layout_phases = self._get_layout_phases()
+        if not layout_phases:
+            return
+
+        yield self._render_layout_queries_js(layout_phases)
+
+        # Each update is a (js, variables read, variables written) tuple,
+        # where variables are (varname, rect_id) size variables. Reading the
+        # size of the viewport is marked by a ('viewport', None) variable.
+        updates = []
+        measured_elements = {}
+        names = []
+        for measurements, consts, assignments in layout_phases:
+            for rect_id, varnames in measurements.items():
+                js = f'const bounds = {self._js_name(rect_id)}.getBoundingClientRect(); '
+                js += ' '.join(f'{self._js_name(rect_id, v)} = bounds.{v};' for v in varnames)
+                measured_elements.setdefault(rect_id, []).append(len(updates))
+                updates.append((js, [], [(v, rect_id) for v in varnames]))
+                names += [self._js_name(rect_id, v) for v in varnames]
+
+            for const_name, expression, value in consts:
+                variables = list(self._get_size_vars_in_expression(expression))
+                if _has_viewport_vars(expression):
+                    variables.append(('viewport', None))
+                updates.append((f'{const_name} = {value};', variables, []))
+                names.append(const_name)
+
+            for rect_id, prop, expression, value in assignments:
+                variables = list(self._get_size_vars_in_expression(expression))
+                if _has_viewport_vars(expression):
+                    variables.append(('viewport', None))
+                js  = f'{self._js_name(rect_id, prop)} = {value}; '
+                js += f"{self._js_name(rect_id)}.style.{prop} = {self._js_name(rect_id, prop)}+'px';"
+                written = [(prop, rect_id)] if prop == 'width' or prop == 'height' else []
+                updates.append((js, variables, written))
+                names.append(self._js_name(rect_id, prop))
+
+        # Maps each variable to the updates reading it.
+        readers = {}
+        for i, (_, variables, _) in enumerate(updates):
+            for variable in set(variables):
+                readers.setdefault(variable, []).append(i)
+
+        # Returns the sorted indices of the given updates and all the updates
+        # downstream of them. Updates are ordered so that each one comes after
+        # the updates it depends on.
+        def downstream(indices):
+            result = set()
+            stack = list(indices)
+            while stack:
+                i = stack.pop()
+                if i in result:
+                    continue
+                result.add(i)
+                for variable in updates[i][2]:
+                    stack += readers.get(variable, [])
+            return sorted(result)
+
+        js  = f'let {", ".join(names)};\n'
+        js += 'const updates = [\n'
+        for update_js, _, _ in updates:
+            js += f'() => {{ {update_js} }},\n'
+        js += '];\n'
+        js += 'for (const update of updates) {\n'
+        js += 'update();\n'
+        js += '}\n'
+
+        js += 'const dependents = new Map([\n'
+        for rect_id, indices in measured_elements.items():
+            js += f'[{self._js_name(rect_id)}, [{", ".join(str(i) for i in downstream(indices))}]],\n'
+        js += ']);\n'
+        viewport_dependents = downstream(readers.get(('viewport', None), []))
+        js += f'const viewport_dependents = [{", ".join(str(i) for i in viewport_dependents)}];\n'
+        yield js
+
+        yield '''const pending = new Set();
+const flush = () => {
+const indices = Array.from(pending).sort((a, b) => a - b);
+pending.clear();
+for (const i of indices) {
+updates[i]();
+}
+};
+const schedule = (indices) => {
+if (pending.size == 0) {
+requestAnimationFrame(flush);
+}
+for (const i of indices) {
+pending.add(i);
+}
+};
+const observer = new ResizeObserver((entries) => {
+for (const entry of entries) {
+schedule(dependents.get(entry.target));
+}
+});
+for (const element of dependents.keys()) {
+observer.observe(element);
+}
+window.addEventListener('resize', () => schedule(viewport_dependents));
+'''
+
+    # Returns the position and size of the rectangle as they are to be
+    # rendered, which may differ from the ones set on the rectangle after
+    # _resolve_geometry.
+    def _get_geometry(self, rect_id):
+        geometry = self._geometry.get(rect_id)
+        if geometry is None:
+            rects = self.rectangles
+            return (
+                (rects.x[rect_id], rects.y[rect_id]),
+                (rects.width[rect_id], rects.height[rect_id])
+            )
+        return geometry
+
+    # Returns the size of the rectangle along the given dimension as an
+    # expression which can be evaluated without laying out the document, or
+    # None if there is no such expression. Percentages are replaced by the
+    # size of the parent rectangle, which may itself need solving.
+    def _get_static_size(self, varname: str, rect_id: int):
+        rects = self.rectangles
+        if rect_id < 0 or rect_id >= len(rects):
+            return None
+
+        size = rects.width[rect_id] if varname == 'width' else rects.height[rect_id]
+        if size is None:
+            return None
+
+        # Styles that make the laid out size differ from the one set.
+        for k in rects.style[rect_id] or ():
+            if k.startswith(('width', 'height', 'min-', 'max-', 'padding', 'border', 'box-sizing')):
+                return None
+
+        def is_positioned(i):
+            return rects.x[i] is not None or rects.y[i] is not None
+
+        # The size set on inline elements is ignored, unless they are
+        # positioned, or laid out by their parent's flexbox or grid.
+        parent_id = rects.parent[rect_id]
+        if not is_positioned(rect_id) and not self._is_sized_in_flow(rect_id):
+            if parent_id < 0 or rects.layouts[parent_id] == Layout.NONE:
+                return None
+
+        # Growing rectangles take up any free space in their parent's layout,
+        # and the others shrink if their siblings overflow it, unless they
+        # can't shrink.
+        if parent_id >= 0 and not is_positioned(rect_id):
+            if rects.layouts[parent_id] == (Layout.ROW if varname == 'width' else Layout.COLUMN):
+                if rects.grow[rect_id] is not None:
+                    return None
+                style = rects.style[rect_id] or {}
+                can_shrink = str(style.get('flex-shrink', 1)) != '0' and style.get('flex') != 'none'
+                if can_shrink and not self._children_fit(varname, parent_id):
+                    return None
+
+        if isinstance(size, Expression) and _has_vars(size, ['%']):
+            # Percentages are relative to the parent only if it is the
+            # containing block, which for the items of grids is their cell.
+            parent_is_containing_block = parent_id >= 0 and (
+                (not is_positioned(rect_id) and rects.layouts[parent_id] != Layout.GRID) or
+                is_positioned(parent_id)
+            )
+            if not parent_is_containing_block:
+                return None
+            size = _substitute_vars(size, {'%': _size_var(varname, parent_id)})
+
+        return size
+
+    # Returns whether the width and height set on the element of the rectangle
+    # apply to it in normal flow, which they don't for inline elements, like
+    # the <a> of links and <label>s, unless their display is changed.
+    def _is_sized_in_flow(self, rect_id: int):
+        rects = self.rectangles
+        display = (rects.style[rect_id] or {}).get('display')
+        if display is not None:
+            return str(display) not in ('inline', 'contents', 'none')
+        if rects.types[rect_id] == RectType.LABEL:
+            return False
+        # Images are replaced elements, which are sized even when inline.
+        return not rects.link[rect_id] or bool(rects.image[rect_id])
+
+    # Returns whether the children of the row or column parent_id fit in it
+    # along the given dimension at the sizes they're set to, so that none of
+    # them is shrunk. This is only known if the size of the parent, and that
+    # of each child laid out in it, is a number. Children without a size
+    # count as empty if they have no content, like spacers, and have no size
+    # otherwise.
+    def _children_fit(self, varname: str, parent_id: int):
+        key = (varname, parent_id)
+        fits = self._children_fit_cache.get(key)
+        if fits is not None:
+            return fits
+
+        rects = self.rectangles
+        sizes = rects.width if varname == 'width' else rects.height
+        available = sizes[parent_id]
+        fits = isinstance(available, Number) and not any(
+            k.startswith(('padding', 'border', 'box-sizing')) or k.endswith('gap')
+            for k in rects.style[parent_id] or ()
+        )
+        total = 0
+        for child_id in rects.children(parent_id) if fits else ():
+            if rects.x[child_id] is not None or rects.y[child_id] is not None:
+                continue
+            if any(
+                k.startswith(('width', 'height', 'min-', 'max-', 'margin', 'padding', 'border', 'box-sizing', 'flex'))
+                for k in rects.style[child_id] or ()
+            ):
+                fits = False
+                break
+            size = sizes[child_id]
+            if isinstance(size, Number):
+                total += size
+            elif size is not None or not (
+                rects.first_child[child_id] < 0 and rects.types[child_id] == RectType.RECT and
+                rects.text[child_id] is None and rects.image[child_id] is None
+            ):
+                fits = False
+                break
+        fits = fits and total <= available
+
+        self._children_fit_cache[key] = fits
+        return fits
+
+    # Solves the sizes of the rectangles that are known at build time, either
+    # because they are set to a number, or to an expression of other known
+    # sizes and viewport sizes. Returns a dict mapping the solved size
+    # variables, as (varname, rect_id) pairs, that the given expressions
+    # depend on, directly or indirectly, to their value.
+    def _solve_sizes(self, expressions):
+        static_sizes = {}
+
+        def dependencies(size_var):
+            if size_var not in static_sizes:
+                static_sizes[size_var] = self._get_static_size(*size_var)
+            size = static_sizes[size_var]
+            if isinstance(size, Expression):
+                yield from self._get_size_vars_in_expression(size)
+
+        size_vars = []
+        for e in expressions:
+            if isinstance(e, Expression):
+                size_vars += self._get_size_vars_in_expression(e)
+
+        sizes = {}
+        cache = {}
+        simplify_cache = {}
+        for size_var in _topological_order(size_vars, dependencies):
+            size = _substitute_size_vars(static_sizes[size_var], sizes, cache)
+            size = simplify_expression(size, simplify_cache)
+            if size is None:
+                continue
+            if isinstance(size, Expression):
+                if any(self._get_size_vars_in_expression(size)) or _has_vars(size, ['%']):
+                    continue
+            sizes[size_var] = size
+
+        return sizes
+
+    # Computes the position and size to render for each rectangle with
+    # expression-valued geometry, in document order, without modifying the
+    # rectangles. If solve is set, sizes that are known at build time are
+    # substituted for their placeholders, see _solve_sizes. If given, rect_ids
+    # are the rectangles to consider, in document order, instead of all.
+    def _resolve_geometry(self, simplify: bool, solve: bool, rect_ids=None):
+        self._geometry = {}
+
+        rects = self.rectangles
+        if rect_ids is None:
+            rect_ids = (
+                rect_id for rect_id, entering in self._walk_rectangles(self.root_id)
+                if entering
+            )
+        geometry = {}
+        for rect_id in rect_ids:
+            if rects.has_expressions(rect_id):
+                geometry[rect_id] = [
+                    rects.x[rect_id], rects.y[rect_id],
+                    rects.width[rect_id], rects.height[rect_id]
+                ]
+
+        if not simplify and not solve:
+            for rect_id, values in geometry.items():
+                self._geometry[rect_id] = (values[:2], values[2:])
+            return
+
+        expressions = [v for values in geometry.values() for v in values]
+        resolved_expressions = expressions
+
+        if solve:
+            sizes = self._solve_sizes(expressions)
+            cache = {}
+            for rect_id, values in geometry.items():
+                geometry[rect_id] = [_substitute_size_vars(v, sizes, cache) for v in values]
+
+            self.render_stats['size_variables_solved'] = len(sizes)
+
+        if simplify:
+            cache = {}
+            for rect_id, values in geometry.items():
+                geometry[rect_id] = [simplify_expression(v, cache) for v in values]
+
+        resolved_expressions = [v for values in geometry.values() for v in values]
+        self.render_stats['expression_nodes_removed'] = (
+            _count_expression_nodes(expressions) -
+            _count_expression_nodes(resolved_expressions)
+        )
+
+        for rect_id, values in geometry.items():
+            self._geometry[rect_id] = (values[:2], values[2:])
+
+    # Yields (stream, chunk) pairs, where stream is one of 'html', 'css' or
+    # 'js'. Each stream is emitted in full, in document order, before the next
+    # one starts. If simplify is set, expressions are simplified before being
+    # rendered, see simplify_expression. If solve is set, sizes which are
+    # known at build time are substituted in the expressions that use them,
+    # so that they don't need to be measured in js. If update_on_resize is
+    # set, the generated js keeps the layout up to date when the viewport or
+    # any of the measured elements are resized, instead of only laying out once
+    # the document is loaded. If share_css is set, rectangles with the same
+    # css declarations share a rule listing their ids instead of each getting
+    # their own rule, see _share_css. If minify is set, whitespace is stripped
+    # from the output, and generated names are shortened. If a cache is given,
+    # the html and css of components are looked up in it, see component. Unnamed
+    # rectangles are named after the order they were created in if naming is
+    # 'order', or after their path in the tree if it's 'path', see
+    # _assign_path_names. The html refers to the css and js as style.css and
+    # code.js, or if fingerprint is set, as files named by the hash of their
+    # content, e.g. style.<hash>.css, so that they can be cached forever. Css
+    # and js of at most inline_threshold bytes are inlined into the html
+    # instead, and js is left out entirely if there is none. The files the
+    # html refers to are found in render_stats['assets'] afterwards, see
+    # _render_assets_head. If reduce_dom is set, spacers and wrappers are
+    # replaced by css properties where possible, see _reduce_dom.
+    def render_iter(
+        self,
+        simplify: bool = True,
+        solve: bool = True,
+        update_on_resize: bool = False,
+        share_css: bool = True,
+        minify: bool = False,
+        cache: RenderCache = None,
+        max_workers: int = 1,
+        split_depth: int = 1,
+        naming: str = 'order',
+        fingerprint: bool = False,
+        inline_threshold: int = 0,
+        reduce_dom: bool = False
+    ):
+        with self._phase('render'):
+            with self._phase('geometry'):
+                self._start_render(simplify, solve, minify, naming)
+            if reduce_dom:
+                with self._phase('reduce_dom'):
+                    self._reduce_dom()
+            if cache is not None:
+                with self._phase('components'):
+                    self._find_components(cache, share_css, reduce_dom)
+            if share_css:
+                with self._phase('share_css'):
+                    self._share_all_css()
+
+            # Fragments of the components which aren't cached, by rect_id.
+            fragments = {}
+            spliced = None
+            js = self._render_js(update_on_resize)
+            if max_workers != 1:
+                with self._phase('partitions'):
+                    spliced, js = self._render_partitions(max_workers, split_depth, update_on_resize, fragments)
+
+            def render_css():
+                yield self._render_css_head()
+                yield from self._render_rectangles(self._render_rect_css_chunks, 1, fragments, spliced=spliced)
+
+            # The css and js are only rendered before the html if they may be
+            # inlined or fingerprinted, as its head then depends on them.
+            # Otherwise they're streamed after it, and the head only depends
+            # on whether there is any js.
+            css = None
+            js_content = None if self._has_js() else ''
+            if fingerprint or inline_threshold:
+                with self._phase('js') as phase:
+                    js_content = ''.join(_count_bytes(phase, js))
+                with self._phase('css') as phase:
+                    css = ''.join(_count_bytes(phase, render_css()))
+            html_head, assets = self._render_assets_head(css, js_content, fingerprint, inline_threshold)
+            self.render_stats['assets'] = assets
+
+            with self._phase('html') as phase:
+                chunks = itertools.chain(
+                    html_head,
+                    self._render_rectangles(self._render_rect_html, 0, fragments, spliced=spliced),
+                    [self._render_html_tail()]
+                )
+                for chunk in _count_bytes(phase, chunks):
+                    yield 'html', chunk
+
+            if css is None:
+                with self._phase('css') as phase:
+                    for chunk in _count_bytes(phase, render_css()):
+                        yield 'css', chunk
+            elif assets['style.css'] is not None:
+                yield 'css', css
+
+            for rect_id, component_fragments in fragments.items():
+                cache.put(self._component_keys[rect_id], tuple(component_fragments))
+
+            if assets['code.js'] is not None and js_content is not None:
+                yield 'js', js_content
+            elif assets['code.js'] is not None:
+                with self._phase('js') as phase:
+                    for chunk in _count_bytes(phase, js):
+                        yield 'js', chunk
+
+    # Splits the document into the subtrees at split_depth, and renders their
+    # html and css in worker processes, while the js is rendered here. The
+    # components above split_depth are rendered whole by the workers too, so
+    # that their fragments are collected as usual. Returns the html and css of
+    # each subtree by rect_id, for splicing in with _render_rectangles, and
+    # the js chunks.
+    def _render_partitions(self, max_workers: int, split_depth: int, update_on_resize: bool, fragments: dict):
+        rects = self.rectangles
+        # Lazy rectangles are rendered here, as the css rules they share are
+        # grouped as they're rendered.
+        lazy_ancestors = set()
+        for rect_id in self._lazy_specs:
+            while rect_id >= 0 and rect_id not in lazy_ancestors:
+                lazy_ancestors.add(rect_id)
+                rect_id = rects.parent[rect_id]
+
+        partitions = {}
+        depth = 0
+        for rect_id, entering in self._walk_rectangles(self.root_id, partitions):
+            if not entering:
+                depth -= 1
+                continue
+            if depth >= split_depth or (depth > 0 and rects.components[rect_id]):
+                if rect_id not in lazy_ancestors:
+                    partitions[rect_id] = None
+            depth += 1
+        rect_ids = list(partitions)
+
+        # The workers get a copy of the application as it is after sharing
+        # css and finding the components, so they render the same output.
+        app = copy.copy(self)
+        app._incremental = None
+        app._profiler = None
+        for name in _profiled_methods:
+            app.__dict__.pop(name, None)
+        num_workers = max_workers or os.cpu_count() or 1
+        chunksize = builtins.max(1, len(rect_ids) // (4 * num_workers))
+        with ProcessPoolExecutor(max_workers, initializer=_init_render_worker, initargs=(app,)) as executor:
+            results = executor.map(_render_partition, rect_ids, chunksize=chunksize)
+            js = list(self._render_js(update_on_resize))
+            for rect_id, (html, css, partition_fragments) in zip(rect_ids, results):
+                partitions[rect_id] = (html, css)
+                fragments.update(partition_fragments)
+
+        return partitions, js
+
+    # Resets the state of the previous render, and resolves the geometry to
+    # render, see _resolve_geometry.
+    def _start_render(self, simplify: bool, solve: bool, minify: bool, naming: str = 'order', rect_ids=None):
+        self.render_stats = {}
+        self._expression_css_cache = {}
+        self._css_declarations = {}
+        self._css_groups = {}
+        self._css_group_declarations = {}
+        self._css_group_members = {}
+        self._minify = minify
+        self._naming = naming
+        self._component_names = {}
+        self._children_fit_cache = {}
+        self._name_prefix = self._get_name_prefix() if minify else '_'
+        self._js_names = {}
+        self._component_keys = {}
+        self._cached_components = {}
+        self._share_lazy_css = False
+        self._removed_rects = set()
+        self._reduced_declarations = {}
+        if naming == 'path':
+            self._assign_path_names()
+        elif naming == 'order':
+            self._path_names = {}
+            self._path_names_key = None
+        else:
+            raise ValueError(f'Unknown naming: {naming}')
+        self._resolve_geometry(simplify, solve, rect_ids)
+
+    # Names each unnamed rectangle after its nearest named ancestor and its
+    # path of child indices below it, e.g. 'header-2-0', so that its name only
+    # changes if rectangles are added before it within that ancestor. Paths
+    # longer than _max_path_name_depth are replaced by a hash of the path,
+    # chained from the parent's, e.g. 'header--1x9ok2h3c5aq', so that names
+    # don't grow with the depth of the tree. Rectangles are only ever added as
+    # the last child of their parent, so the names given by the previous
+    # render stay the same, and only the rectangles added since are named.
+    def _assign_path_names(self):
+        rects = self.rectangles
+        key = (self._minify, self._name_prefix, self.root_id)
+        if self._path_names_key != key or self._path_names_end > len(rects):
+            self._path_names        = {}
+            self._path_child_counts = {}
+            self._path_keys         = {}
+            self._path_names_key    = key
+            self._path_names_end    = 0
+
+        counts = self._path_child_counts
+        # The (named ancestor, path) of each unnamed rectangle, where the
+        # path is a tuple of indices, or the digest of a longer one.
+        path_keys = self._path_keys
+        for rect_id in range(self._path_names_end, len(rects)):
+            if rect_id == self.root_id:
+                continue
+            parent_id = rects.parent[rect_id]
+            index = counts.get(parent_id, 0)
+            counts[parent_id] = index + 1
+            if rects.names[rect_id] is not None:
+                continue
+
+            index = _base36(index) if self._minify else str(index)
+            anchor_id, path = path_keys.get(parent_id, (parent_id, ()))
+            if isinstance(path, tuple) and len(path) < _max_path_name_depth:
+                path = (*path, index)
+                suffix = '-'.join(path)
+            else:
+                if isinstance(path, tuple):
+                    path = '-'.join(path).encode()
+                path = hashlib.sha256(path + b'-' + index.encode()).digest()[:16]
+                suffix = '-' + _base36(int.from_bytes(path[:8], 'big'))
+            path_keys[rect_id] = (anchor_id, path)
+            self._path_names[rect_id] = f'{self._rect_name(anchor_id)}-{suffix}'
+        self._path_names_end = len(rects)
+
+    # Removes spacers and wrappers from rows and columns, replacing them with
+    # css properties of the rectangles around them. In each row or column:
+    # - Spacers of fixed size become a margin of the next child, or of the
+    #   previous one if they are trailing. If all children are separated by
+    #   the same space, it becomes the gap of the row or column instead.
+    # - Growing spacers become the justify-content of the row or column, if
+    #   they are arranged like one of its values, e.g. 'center' for a spacer
+    #   on either side of the children.
+    # Unnamed rectangles that have nothing of their own, other than a layout,
+    # and are left with a single child are then removed. The child takes
+    # their place, aligned as it was within them. Spacers and wrappers whose
+    # size is measured are kept. The layout stays the same, unless the
+    # children overflow their row or column, as margins don't shrink like
+    # spacers do. The rectangles removed are counted in
+    # render_stats['dom_nodes_removed'].
+    def _reduce_dom(self):
+        rects = self.rectangles
+        removed = self._removed_rects
+        declarations = self._reduced_declarations
+
+        # Rectangles that can't be removed or get declarations, as their
+        # elements are referred to by js, or are rendered independently of
+        # the rectangles around them.
+        kept = set(self._lazy_specs)
+        for position, size in self._geometry.values():
+            for value in (*position, *size):
+                if isinstance(value, Expression):
+                    kept.update(rect_id for _, rect_id in self._get_size_vars_in_expression(value))
+        for container_id, (content_id, window_id, _, field_rects, _, _) in self._virtual_lists.items():
+            kept.update((container_id, content_id, window_id))
+            kept.update(rect_id for row in field_rects for rect_id in row)
+
+        def is_positioned(rect_id):
+            position, _ = self._get_geometry(rect_id)
+            return position[0] is not None or position[1] is not None
+
+        # Returns the size of a fixed spacer, True for a growing spacer, or
+        # None if the rectangle isn't a spacer of a row or column with the
+        # given direction.
+        def spacer_size(rect_id, horizontal):
+            if (
+                rect_id in kept or rects.names[rect_id] is not None or
+                rects.class_names[rect_id] or rects.style[rect_id] or
+                rects.types[rect_id] != RectType.RECT or rects.first_child[rect_id] >= 0 or
+                rects.text[rect_id] is not None or rects.link[rect_id] is not None or
+                rects.image[rect_id] is not None or rects.components[rect_id] or
+                is_positioned(rect_id)
+            ):
+                return None
+            _, size = self._get_geometry(rect_id)
+            main, cross = size if horizontal else reversed(size)
+            grow = rects.grow[rect_id]
+            if cross is not None:
+                return None
+            if grow is not None and main is None:
+                return True
+            if grow is None and isinstance(main, Number):
+                return main
+            return None
+
+        # Whether the css property can be declared on the rectangle without
+        # overriding its style, or a declaration added before, except for
+        # margins, which add up.
+        def can_declare(rect_id, prop):
+            style = rects.style[rect_id] or ()
+            return (
+                rect_id not in kept and not rects.components[rect_id] and
+                prop not in style and prop.split('-')[0] not in style and
+                (prop.startswith('margin') or prop not in declarations.get(rect_id, ()))
+            )
+
+        def add_margin(rect_id, side, value):
+            rect_declarations = declarations.setdefault(rect_id, {})
+            rect_declarations[side] = f'{value + float(rect_declarations.get(side, "0px")[:-2]):g}px'
+
+        # The children of each row or column, after the removal.
+        children = {}
+        for parent_id, entering in self._walk_rectangles(self.root_id):
+            layout = rects.layouts[parent_id]
+            if entering or layout not in (Layout.ROW, Layout.COLUMN) or parent_id in kept:
+                continue
+            horizontal = layout == Layout.ROW
+
+            child_ids = []
+            for child_id in rects.children(parent_id):
+                wrapped = children.get(child_id)
+                if wrapped is not None and len(wrapped) == 1 and self._can_unwrap(child_id, wrapped[0], kept):
+                    inner_id = wrapped[0]
+                    # The child is aligned across the wrapper's parent as it
+                    # was along the wrapper, if their directions differ.
+                    if rects.layouts[child_id] == layout:
+                        unwrap = True
                     else:
-                        js += f"rect.style.right = value+'px';\n"
-                    js += '}\n'
-
-            if isinstance(rect.position[1], Expression):
-                size_vars = list(self._get_size_vars_in_expression(rect.position[1]))
-                if size_vars:
-                    # @todo: First check if there are any vars in expression?
-                    js += '{\n'
-                    js += f"const rect = document.querySelector('#{rect_node[1]}');\n"
-                    for varname, rect_id in size_vars:
-                        rect_name = self.rectangles[rect_id][1]
-                        js += f"const {rect_name} = document.querySelector('#{rect_name}');\n"
-                        js += f"const {rect_name}_{varname} = {rect_name}.getBoundingClientRect().{varname};\n"
-                    js_expression = self._render_expression_js(rect.position[1])
-                    js += f"const value = {js_expression};\n"
-                    if rect.pivot == Pivot.TOP_LEFT or rect.pivot == Pivot.TOP_RIGHT:
-                        js += f"rect.style.top = value+'px';\n"
+                        unwrap = can_declare(inner_id, 'align-self')
+                        if unwrap:
+                            justify = declarations.get(child_id, {}).get('justify-content', 'flex-start')
+                            declarations.setdefault(inner_id, {})['align-self'] = justify
+                    if unwrap:
+                        removed.add(child_id)
+                        declarations.pop(child_id, None)
+                        child_id = inner_id
+                child_ids.append(child_id)
+
+            sizes = [spacer_size(child_id, horizontal) for child_id in child_ids]
+            items = [
+                i for i, size in enumerate(sizes)
+                if size is None and not is_positioned(child_ids[i])
+            ]
+
+            # Growing spacers, counted in each of the slots around the items.
+            growing = [i for i, size in enumerate(sizes) if size is True]
+            if growing and items and 'justify-content' not in (rects.style[parent_id] or ()):
+                slots = [0] * (len(items) + 1)
+                for i in growing:
+                    slots[bisect.bisect(items, i)] += 1
+                grows = {rects.grow[child_ids[i]] for i in growing}
+                leading, *between, trailing = slots
+                justify = None
+                flexible = any(
+                    rects.grow[child_ids[i]] is not None or
+                    any(k.startswith('flex') for k in rects.style[child_ids[i]] or ())
+                    for i in items
+                )
+                if len(grows) == 1 and builtins.max(slots) == 1 and not flexible:
+                    if not any(between):
+                        justify = 'center' if leading and trailing else 'flex-end' if leading else 'flex-start'
+                    elif all(between) and leading == trailing:
+                        justify = 'space-evenly' if leading else 'space-between'
+                if justify is not None:
+                    removed.update(child_ids[i] for i in growing)
+                    if justify != 'flex-start':
+                        declarations.setdefault(parent_id, {})['justify-content'] = justify
+
+            # Fixed spacers, summed in each of the slots around the items.
+            fixed = [i for i, size in enumerate(sizes) if size is not True and size is not None]
+            if fixed and items:
+                slots = [[] for _ in range(len(items) + 1)]
+                for i in fixed:
+                    slots[bisect.bisect(items, i)].append(i)
+                leading_side, trailing_side = ('left', 'right') if horizontal else ('top', 'bottom')
+                leading_id, trailing_id = child_ids[items[0]], child_ids[items[-1]]
+                between = [sum(sizes[i] for i in slot) for slot in slots[1:-1]]
+                # A gap is also added next to the spacers that are kept.
+                kept_spacers = (
+                    any(child_ids[i] not in removed for i in growing) or
+                    (slots[0] and not can_declare(leading_id, f'margin-{leading_side}')) or
+                    (slots[-1] and not can_declare(trailing_id, f'margin-{trailing_side}'))
+                )
+                if (
+                    len(between) > 0 and len(set(between)) == 1 and between[0] > 0 and
+                    not kept_spacers and
+                    not any(k.endswith('gap') for k in rects.style[parent_id] or ())
+                ):
+                    declarations.setdefault(parent_id, {})['gap'] = f'{between[0]:g}px'
+                    for slot in slots[1:-1]:
+                        removed.update(child_ids[i] for i in slot)
+                    slots[1:-1] = [[] for _ in between]
+
+                for k, slot in enumerate(slots):
+                    if not slot:
+                        continue
+                    if k < len(items):
+                        item_id, side = child_ids[items[k]], f'margin-{leading_side}'
                     else:
-                        js += f"rect.style.bottom = value+'px';\n"
-                    js += '}\n'
-
-        if isinstance(rect.size[0], Expression):
-            size_vars = list(self._get_size_vars_in_expression(rect.size[0]))
-            if size_vars:
-                js += '{\n'
-                js += f"const rect = document.querySelector('#{rect_node[1]}');\n"
-                for varname, rect_id in size_vars:
-                    rect_name = self.rectangles[rect_id][1]
-                    js += f"const {rect_name} = document.querySelector('#{rect_name}');\n"
-                    js += f"const {rect_name}_{varname} = {rect_name}.getBoundingClientRect().{varname};\n"
-                js_expression = self._render_expression_js(rect.size[0])
-                js += f"const value = {js_expression};\n"
-                js += f"rect.style.width = value+'px';\n"
-                js += '}\n'
-
-        if isinstance(rect.size[1], Expression):
-            size_vars = list(self._get_size_vars_in_expression(rect.size[1]))
-            if size_vars:
-                js += '{\n'
-                js += f"const rect = document.querySelector('#{rect_node[1]}');\n"
-                for varname, rect_id in size_vars:
-                    rect_name = self.rectangles[rect_id][1]
-                    js += f"const {rect_name} = document.querySelector('#{rect_name}');\n"
-                    js += f"const {rect_name}_{varname} = {rect_name}.getBoundingClientRect().{varname};\n"
-                js_expression = self._render_expression_js(rect.size[1])
-                js += f"const value = {js_expression};\n"
-                js += f"rect.style.height = value+'px';\n"
-                js += '}\n'
+                        item_id, side = trailing_id, f'margin-{trailing_side}'
+                    if can_declare(item_id, side):
+                        add_margin(item_id, side, sum(sizes[i] for i in slot))
+                        removed.update(child_ids[i] for i in slot)
+
+            children[parent_id] = [child_id for child_id in child_ids if child_id not in removed]
+
+        self.render_stats['dom_nodes_removed'] = len(removed)
+
+    # Returns whether the row or column rect_id, whose only child left by
+    # _reduce_dom is child_id, is a wrapper that can be removed, leaving the
+    # child in its place. The child mustn't depend on the size of the
+    # wrapper, or change it, so that it can take its place.
+    def _can_unwrap(self, rect_id: int, child_id: int, kept: set):
+        rects = self.rectangles
+        position, size = self._get_geometry(rect_id)
+        child_position, child_size = self._get_geometry(child_id)
+        parent_id = rects.parent[rect_id]
+        return (
+            rect_id != self.root_id and rect_id not in kept and
+            rects.layouts[parent_id] in (Layout.ROW, Layout.COLUMN) and
+            rects.names[rect_id] is None and not rects.class_names[rect_id] and
+            not rects.style[rect_id] and rects.types[rect_id] == RectType.RECT and
+            rects.text[rect_id] is None and rects.link[rect_id] is None and
+            rects.image[rect_id] is None and rects.grow[rect_id] is None and
+            not rects.components[rect_id] and
+            all(value is None for value in (*position, *size)) and
+            rects.grow[child_id] is None and
+            all(value is None for value in child_position) and
+            not any(isinstance(value, Expression) for value in child_size)
+        )
 
-        return js
+    # Shares the css of the page, and of each component which isn't cached,
+    # see _share_css.
+    def _share_all_css(self):
+        self._share_lazy_css = True
+        self._share_css(self.root_id)
+        for rect_id in self._component_keys:
+            if rect_id not in self._cached_components:
+                self._share_css(rect_id)
+
+    def _render_html_head(self, stylesheets=('style.css',), scripts=('code.js',), inline_css='', inline_js=''):
+        newline = '' if self._minify else '\n'
+        chunks = [
+            '<!DOCTYPE html><html>' + newline,
+            '<head>' + newline,
+            '<title>py2web-generated document</title>' + newline,
+        ]
+        for stylesheet in stylesheets:
+            chunks.append(f'<link rel="stylesheet" href="{stylesheet}">' + newline)
+        if inline_css:
+            chunks.append(f'<style>{inline_css}</style>' + newline)
+        for script in scripts:
+            chunks.append(f'<script src="{script}"></script>' + newline)
+        if inline_js:
+            chunks.append(f'<script>{inline_js}</script>' + newline)
+        if self.metadata:
+            chunks.append(self.metadata)
+        chunks.append('</head>' + newline)
+        return chunks
+
+    # Renders the html head for render_iter, referring to or inlining the css
+    # and js, where css is None if it's rendered after the html, so that it
+    # can't be inlined or fingerprinted. Returns the head, and a dict mapping
+    # style.css and code.js to the name of the file the head refers to in
+    # their place, or None if there is none, as they're inlined or empty.
+    def _render_assets_head(self, css, js: str, fingerprint: bool, inline_threshold: int):
+        assets = {}
+        inline = {}
+        for name, content in [('style.css', css), ('code.js', js)]:
+            if content is None:
+                assets[name] = name
+            elif not content or len(content.encode()) <= inline_threshold:
+                assets[name] = None
+                inline[name] = content
+            elif fingerprint:
+                stem, extension = os.path.splitext(name)
+                assets[name] = f'{stem}.{hashlib.sha256(content.encode()).hexdigest()[:16]}{extension}'
+            else:
+                assets[name] = name
+        head = self._render_html_head(
+            [assets['style.css']] if assets['style.css'] else [],
+            [assets['code.js']] if assets['code.js'] else [],
+            inline.get('style.css', ''),
+            inline.get('code.js', ''),
+        )
+        return head, assets
 
-    def render(self):
-        html = '<!DOCTYPE html><html>\n'
-        html += '<head>\n'
-        html += '<title>py2web-generated document</title>\n'
-        html += '<link rel="stylesheet" href="style.css">\n'
-        html += '<script src="code.js"></script>\n'
-        html += self.metadata
-        html += '</head>\n'
-        html += self._render_rect_html(self.root_id)
-        html += '</html>\n'
+    def _render_html_tail(self):
+        return '</html>' if self._minify else '</html>\n'
 
-        css = ''
-        css += '''
+    def _render_css_head(self):
+        if self._minify:
+            return 'html,body{height:100%;overflow-x:hidden;margin:0}'
+        return '''
 html, body {
     height: 100%;
     overflow-x: hidden;
@@ -772,19 +3369,928 @@ html, body {
 }
 '''
 
-        for rn in self.rectangles:
-            css += self._render_rect_css(rn)
+    # Renders the js of the document, which is run once it's loaded. Nothing
+    # is rendered if there is no layout to compute in js, and no virtual list.
+    def _render_js(self, update_on_resize: bool):
+        if update_on_resize:
+            layout_js = self._render_layout_runtime_js()
+        else:
+            layout_js = self._render_layout_js()
+        if self._minify:
+            layout_js = map(_minify_js, layout_js)
+        if not self._has_js():
+            return
+
+        yield _minify_js('window.onload = () => {\n') if self._minify else 'window.onload = () => {\n'
+        yield from layout_js
+        yield from self._render_virtual_lists_js()
+        yield _minify_js('};\n') if self._minify else '};\n'
+
+    # Returns whether the document has any js, without rendering it. There
+    # is js if some geometry depends on measured sizes, see
+    # _get_layout_phases, or if there are virtual lists.
+    def _has_js(self):
+        return bool(self._virtual_lists) or bool(self._get_js_assignments())
+
+    # Renders the runtime of the virtual lists, see virtual_list. The rows of
+    # the window are kept in document order, each as its element followed by
+    # the elements of its fields. When scrolling, the rows scrolled out of the
+    # window are moved to its other end, and filled with the data of the
+    # items scrolled in, and the window is translated to where they are.
+    def _render_virtual_lists_js(self):
+        if not self._virtual_lists:
+            return
+
+        js = '''const virtualList = (containerId, contentId, windowId, ids, fields, rowHeight, data) => {
+const container = document.getElementById(containerId);
+const windowElement = document.getElementById(windowId);
+const rows = ids.map((rowIds, i) => [windowElement.children[i], ...rowIds.map((id) => document.getElementById(id))]);
+const numRows = rows.length;
+if (numRows == 0) {
+return;
+}
+const height = rowHeight === null ? rows[0][0].getBoundingClientRect().height : rowHeight;
+if (rowHeight === null) {
+document.getElementById(contentId).style.height = data.length * height + 'px';
+}
+const fill = (row, index) => {
+const values = data[index];
+for (let i = 0; i < fields.length; ++i) {
+const element = row[i + 1];
+if (fields[i] == 'href' && element.tagName == 'IMG') {
+element.parentNode.href = values[i];
+} else {
+element[fields[i]] = values[i];
+}
+}
+};
+let first = 0;
+const update = () => {
+const start = Math.max(0, Math.min(Math.floor(container.scrollTop / height), data.length - numRows));
+const shift = start - first;
+if (shift == 0) {
+return;
+}
+if (Math.abs(shift) >= numRows) {
+rows.forEach((row, i) => fill(row, start + i));
+} else if (shift > 0) {
+for (let i = 0; i < shift; ++i) {
+const row = rows.shift();
+windowElement.appendChild(row[0]);
+fill(row, first + numRows + i);
+rows.push(row);
+}
+} else {
+for (let i = 1; i <= -shift; ++i) {
+const row = rows.pop();
+windowElement.insertBefore(row[0], windowElement.firstChild);
+fill(row, first - i);
+rows.unshift(row);
+}
+}
+first = start;
+windowElement.style.transform = 'translateY(' + start * height + 'px)';
+};
+let scheduled = false;
+container.addEventListener('scroll', () => {
+if (!scheduled) {
+scheduled = true;
+requestAnimationFrame(() => {
+scheduled = false;
+update();
+});
+}
+}, {passive: true});
+};
+'''
+        for container_id, virtual_list in self._virtual_lists.items():
+            content_id, window_id, row_height, field_rects, fields, data = virtual_list
+            ids = [[self._rect_name(rect_id) for rect_id in row] for row in field_rects]
+            js += f"virtualList('{self._rect_name(container_id)}', '{self._rect_name(content_id)}', "
+            js += f"'{self._rect_name(window_id)}', {json.dumps(ids)}, {json.dumps(fields)}, {json.dumps(row_height)}, "
+            yield _minify_js(js) if self._minify else js
+            # The data is not minified, as that would also strip the
+            # whitespace in its strings.
+            yield data
+            js = ');\n'
+        yield _minify_js(js) if self._minify else js
+
+    # Renders the document like render, but only renders the html and css of
+    # the rectangles which changed since the last call, see
+    # _RectangleStore.mark_dirty, and reuses the rest. The first call, and
+    # any call with different arguments than the last one, renders
+    # everything. Returns the html, css and js, and a dict mapping each
+    # stream to the (start, end) ranges of it that were rendered again.
+    # If no rectangles were added since the last call, only the changed
+    # rectangles are rendered, and only the groups of shared css whose
+    # declarations they had or now have are updated. The rest of the cost
+    # is that of joining the chunks into the returned strings, and of
+    # resolving the geometry of all rectangles with expressions. Adding
+    # rectangles walks the whole tree to find the css shared and to render
+    # the new ones.
+    def render_incremental(
+        self,
+        simplify: bool = True,
+        solve: bool = True,
+        update_on_resize: bool = False,
+        share_css: bool = True,
+        minify: bool = False,
+        naming: str = 'order'
+    ):
+        if self._lazy_specs:
+            raise ValueError('render_incremental does not support lazy rectangles')
+        rects = self.rectangles
+        previous = self._incremental
+
+        # The rectangles with expression-valued geometry are the same as in
+        # the last call unless rectangles were added, or changed ones gained
+        # or lost expressions.
+        expression_ids = None
+        if previous is not None and len(rects) == previous['js_inputs'][0]:
+            expression_ids = previous['geometry'].keys()
+            for rect_id in _find_all(rects.dirty, _DIRTY_SELF):
+                if rects.has_expressions(rect_id) != (rect_id in expression_ids):
+                    expression_ids = None
+                    break
+
+        self._start_render(simplify, solve, minify, naming, expression_ids)
+        options = (simplify, solve, update_on_resize, share_css, minify, naming, self._name_prefix)
+        if previous is not None and previous['options'] != options:
+            previous = None
+
+        # The js only depends on the geometry and layout of the rectangles, and
+        # on the structure of the tree.
+        js_inputs = (len(rects), bytes(rects.layouts), bytes(rects.pivots))
+        reuse_js = False
+        # Rectangles are only ever added, so the tree has the same structure
+        # as in the last call if there are as many of them, and each one's
+        # chunks are at the same indices, see _render_rectangles_incremental.
+        same_tree = previous is not None and len(rects) == previous['js_inputs'][0]
+        if previous is not None:
+            # Rectangles whose geometry changed because of a change to another
+            # rectangle, e.g. one whose size they depend on.
+            old_geometry = previous['geometry']
+            for rect_id, geometry in self._geometry.items():
+                if old_geometry.get(rect_id) != geometry:
+                    rects.mark_dirty(rect_id)
+            for rect_id in old_geometry.keys() - self._geometry.keys():
+                rects.mark_dirty(rect_id)
+            reuse_js = self._geometry == old_geometry and js_inputs == previous['js_inputs']
+
+            # Only the css declarations of changed rectangles are rendered
+            # again.
+            self._css_declarations = previous['css_declarations']
+            changed_declarations = {}
+            for rect_id in _find_all(rects.dirty, _DIRTY_SELF) if share_css else ():
+                declarations = self._render_rect_css_declarations(rect_id)
+                old_declarations = self._css_declarations.get(rect_id)
+                if old_declarations != declarations:
+                    self._css_declarations[rect_id] = declarations
+                    changed_declarations[rect_id] = (old_declarations, declarations)
+
+        declaration_rects = None
+        if share_css and same_tree:
+            # Only the groups of the changed declarations are updated.
+            self._css_groups = previous['css_groups']
+            self._css_group_declarations = previous['css_group_declarations']
+            self._css_group_members = previous['css_group_members']
+            self.render_stats.update(previous['css_stats'])
+            declaration_rects = previous['css_declaration_rects']
+            self._regroup_css(declaration_rects, changed_declarations, previous['ranges'])
+        elif share_css:
+            declaration_rects = self._share_css(self.root_id)
+            if previous is not None:
+                # Rectangles whose group changed, and the owners of the groups
+                # whose selector, the ids of their members, changed.
+                for rect_id, _ in self._css_groups.items() ^ previous['css_groups'].items():
+                    rects.mark_dirty(rect_id)
+                members = self._css_group_members
+                previous_members = previous['css_group_members']
+                for group in members.keys() | previous_members.keys():
+                    if members.get(group) != previous_members.get(group):
+                        rects.mark_dirty(group)
+
+        if previous is not None:
+            ranges = previous['ranges']
+            html_chunks, css_chunks = previous['html_chunks'], previous['css_chunks']
+        else:
+            ranges = {}
+            html_chunks, css_chunks = [], []
+
+        (html_chunks, css_chunks), changed, num_rendered = self._render_rectangles_incremental(
+            ranges, html_chunks, css_chunks, previous is not None, same_tree
+        )
+        rects.dirty[:] = bytes(len(rects))
+
+        js = previous['js'] if reuse_js else ''.join(self._render_js(update_on_resize))
+        html_head = ''.join(self._render_html_head(scripts=['code.js'] if js else []))
+        css_head = self._render_css_head()
+        html = html_head + ''.join(html_chunks) + self._render_html_tail()
+        css = css_head + ''.join(css_chunks)
+
+        changed_ranges = {
+            'html': _get_changed_ranges(html_chunks, changed[0], len(html_head)),
+            'css': _get_changed_ranges(css_chunks, changed[1], len(css_head)),
+            'js': [],
+        }
+        if previous is None:
+            changed_ranges = {'html': [(0, len(html))], 'css': [(0, len(css))], 'js': []}
+        else:
+            if html_head != previous['html_head']:
+                changed_ranges['html'].insert(0, (0, len(html_head)))
+            if css_head != previous['css_head']:
+                changed_ranges['css'].insert(0, (0, len(css_head)))
+        if previous is None or js != previous['js']:
+            changed_ranges['js'] = [(0, len(js))]
+
+        self._incremental = {
+            'options':                options,
+            'geometry':               self._geometry,
+            'js_inputs':              js_inputs,
+            'css_declarations':       self._css_declarations,
+            'css_groups':             self._css_groups,
+            'css_group_declarations': self._css_group_declarations,
+            'css_group_members':      self._css_group_members,
+            'css_declaration_rects':  declaration_rects,
+            'css_stats':              {
+                k: v for k, v in self.render_stats.items() if k.startswith('css_')
+            },
+            'ranges':                 ranges,
+            'html_chunks':            html_chunks,
+            'css_chunks':             css_chunks,
+            'html_head':              html_head,
+            'css_head':               css_head,
+            'js':                     js,
+        }
+        self.render_stats['rectangles_rendered'] = num_rendered
+        return html, css, js, changed_ranges
+
+    # Updates the groups of shared css declarations, see _share_css, for
+    # render_incremental. changed maps the rectangles whose declarations
+    # changed to their (old, new) declarations, and declaration_rects, which
+    # is updated in place, the declarations to the rectangles with them, in
+    # document order. Only the groups of the old and new declarations are
+    # updated, and the rectangles whose rule changed are marked dirty: the
+    # previous and new owners of the groups, or the rectangle with unique
+    # declarations.
+    def _regroup_css(self, declaration_rects: dict, changed: dict, ranges: dict):
+        rects = self.rectangles
+        stats = self.render_stats
+        # Rectangles not in the rendered tree have no declarations.
+        changed = {
+            rect_id: declarations for rect_id, declarations in changed.items()
+            if declarations[0] is not None
+        }
+
+        # The previous owner, or rectangle with unique declarations, of each
+        # of the declarations whose group changes, which are ungrouped.
+        # Rectangles without declarations get no rule whether they share
+        # them or not, so they are ungrouped one by one.
+        old_owners = {}
+        for declarations in itertools.chain.from_iterable(changed.values()):
+            if declarations in old_owners or not declarations:
+                continue
+            rect_ids = declaration_rects.get(declarations)
+            old_owners[declarations] = rect_ids[0] if rect_ids else None
+            if not rect_ids:
+                continue
+            group = self._css_groups.get(rect_ids[0])
+            if group is not None:
+                del self._css_group_declarations[group]
+                del self._css_group_members[group]
+                stats['css_rules_shared'] -= 1
+            stats['css_bytes_saved'] -= self._get_css_bytes_saved(declarations, rect_ids)
+            for rect_id in rect_ids:
+                self._css_groups.pop(rect_id, None)
+
+        # Moves the changed rectangles to their new declarations, keeping
+        # them in document order, that of their chunks.
+        for rect_id, (old_declarations, declarations) in changed.items():
+            if not old_declarations:
+                del self._css_groups[rect_id]
+                stats['css_bytes_saved'] -= self._get_css_bytes_saved('', [rect_id])
+            elif not declarations:
+                self._css_groups[rect_id] = None
+                stats['css_bytes_saved'] += self._get_css_bytes_saved('', [rect_id])
+            rect_ids = declaration_rects[old_declarations]
+            rect_ids.remove(rect_id)
+            if not rect_ids:
+                del declaration_rects[old_declarations]
+            rect_ids = declaration_rects.setdefault(declarations, [])
+            index = self._get_chunk_index(ranges, rect_id)
+            lo, hi = 0, len(rect_ids)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self._get_chunk_index(ranges, rect_ids[mid]) < index:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            rect_ids.insert(lo, rect_id)
+
+        for declarations, old_owner in old_owners.items():
+            if old_owner is not None:
+                rects.mark_dirty(old_owner)
+            rect_ids = declaration_rects.get(declarations)
+            if rect_ids is None:
+                continue
+            rects.mark_dirty(rect_ids[0])
+            stats['css_rules_shared'] += self._group_css(declarations, rect_ids)
+            stats['css_bytes_saved'] += self._get_css_bytes_saved(declarations, rect_ids)
+
+    # Returns the index of the opening chunk of the rectangle in the streams
+    # rendered by _render_rectangles_incremental, given its ranges.
+    def _get_chunk_index(self, ranges: dict, rect_id: int):
+        parent = self.rectangles.parent
+        index = 0
+        while rect_id != self.root_id:
+            index += ranges[rect_id][0]
+            rect_id = parent[rect_id]
+        return index
+
+    # Walks the rectangles for render_incremental, rendering the html and css
+    # of each rectangle as an opening and a closing chunk, at the same index
+    # in both streams. The chunks of clean subtrees are copied from the
+    # previous chunks, and so are those of rectangles whose descendants only
+    # changed. ranges maps each rectangle to the (start, length) of its
+    # subtree's chunks, where start is relative to its parent's, so that the
+    # ranges within copied subtrees stay valid. It is updated in place.
+    # If same_tree is set, no rectangles were added since the previous
+    # chunks were rendered, so the ranges stay the same, and only the chunks
+    # of the changed rectangles are replaced, in place, without walking the
+    # tree. Returns the new chunks, the indices of the chunks which differ
+    # from the previous ones, for each stream, and the number of rectangles
+    # rendered.
+    def _render_rectangles_incremental(self, ranges, old_html, old_css, reuse: bool, same_tree: bool = False):
+        dirty = self.rectangles.dirty
+        chunks = ([], [])
+        old_chunks = (old_html, old_css)
+        changed = ([], [])
+        num_rendered = 0
+
+        if same_tree:
+            for rect_id in _find_all(dirty, _DIRTY_SELF):
+                if rect_id not in ranges:
+                    continue
+                start = self._get_chunk_index(ranges, rect_id)
+                end = start + ranges[rect_id][1] - 1
+                html, closing_html = self._render_rect_html(rect_id)
+                css, closing_css = self._render_rect_css_chunks(rect_id)
+                num_rendered += 1
+                for index, chunk in ((start, (html, css)), (end, (closing_html, closing_css))):
+                    for stream in range(2):
+                        if chunk[stream] != old_chunks[stream][index]:
+                            changed[stream].append(index)
+                            old_chunks[stream][index] = chunk[stream]
+            return old_chunks, changed, num_rendered
+
+        def add_chunks(index, new, old):
+            for stream in range(2):
+                if old is None or new[stream] != old[stream]:
+                    changed[stream].append(index)
+                chunks[stream].append(new[stream])
+
+        # (start, old start, closing chunks, old closing chunks) of the
+        # rectangles being walked, where the closing chunks are None for
+        # copied subtrees.
+        stack = []
+        skip = _CleanRectangles(dirty) if reuse else ()
+        for rect_id, entering in self._walk_rectangles(self.root_id, skip):
+            if entering:
+                start = len(chunks[0])
+                old_range = ranges.get(rect_id) if reuse else None
+                if old_range is None:
+                    old_start = None
+                    old_chunk = old_closing_chunk = None
+                else:
+                    old_start = (stack[-1][1] if stack else 0) + old_range[0]
+                    old_end = old_start + old_range[1]
+                    if not dirty[rect_id]:
+                        chunks[0].extend(old_html[old_start:old_end])
+                        chunks[1].extend(old_css[old_start:old_end])
+                        stack.append((start, old_start, None, None))
+                        continue
+                    old_chunk = (old_html[old_start], old_css[old_start])
+                    old_closing_chunk = (old_html[old_end - 1], old_css[old_end - 1])
+
+                if old_range is None or dirty[rect_id] == _DIRTY_SELF:
+                    html, closing_html = self._render_rect_html(rect_id)
+                    css, closing_css = self._render_rect_css_chunks(rect_id)
+                    chunk, closing_chunk = (html, css), (closing_html, closing_css)
+                    num_rendered += 1
+                else:
+                    chunk, closing_chunk = old_chunk, old_closing_chunk
+                add_chunks(start, chunk, old_chunk)
+                stack.append((start, old_start, closing_chunk, old_closing_chunk))
+            else:
+                start, _, closing_chunk, old_closing_chunk = stack.pop()
+                if closing_chunk is not None:
+                    add_chunks(len(chunks[0]), closing_chunk, old_closing_chunk)
+                parent_start = stack[-1][0] if stack else 0
+                ranges[rect_id] = (start - parent_start, len(chunks[0]) - start)
+
+        return chunks, changed, num_rendered
+
+    # Streams the rendered html/css/js to the given file-like objects. Only
+    # write() is required of them. Keyword arguments are passed on to
+    # render_iter.
+    def render_to(self, html_fp, css_fp, js_fp, **kwargs):
+        writers = {
+            'html': html_fp.write,
+            'css':  css_fp.write,
+            'js':   js_fp.write,
+        }
+        for stream, chunk in self.render_iter(**kwargs):
+            writers[stream](chunk)
+
+    def render(self, **kwargs):
+        html, css, js = io.StringIO(), io.StringIO(), io.StringIO()
+        self.render_to(html, css, js, **kwargs)
+        return html.getvalue(), css.getvalue(), js.getvalue()
+
+    # Renders the document into a Template, whose slots are the ones set on
+    # the rectangles, see slot. Keyword arguments are passed on to
+    # render_iter.
+    def compile_template(self, **kwargs):
+        return Template(*self.render(**kwargs))
+
+    # Renders the document into index.html, style.css and code.js in the given
+    # directory. Keyword arguments are passed on to render_iter, where the css
+    # and js are written to the files named in render_stats['assets'], and
+    # not at all if they're inlined or empty. With fingerprint set, the names
+    # of the files are also written to manifest.json, keyed by their usual
+    # names. For each of the encodings in precompress, 'gz' and 'br', a
+    # compressed copy of each file is written next to it, e.g.
+    # style.css.gz, so that it can be served as is. The 'br' encoding
+    # requires the brotli package.
+    def render_files(self, directory: str = '.', precompress=(), **kwargs):
+        paths = []
+        files = {}
+        try:
+            for stream, chunk in self.render_iter(**kwargs):
+                fp = files.get(stream)
+                if fp is None:
+                    if stream == 'html':
+                        name = 'index.html'
+                    else:
+                        name = self.render_stats['assets']['style.css' if stream == 'css' else 'code.js']
+                    paths.append(os.path.join(directory, name))
+                    fp = files[stream] = open(paths[-1], 'w', encoding='utf-8')
+                fp.write(chunk)
+        finally:
+            for fp in files.values():
+                fp.close()
+
+        if kwargs.get('fingerprint'):
+            assets = self.render_stats['assets']
+            with open(os.path.join(directory, 'manifest.json'), 'w', encoding='utf-8') as fp:
+                json.dump({name: path for name, path in assets.items() if path is not None}, fp, indent=2)
+
+        for path in paths:
+            for encoding in precompress:
+                _write_compressed(path, encoding)
+
+    # Saves the rectangle tree to a binary file at path, which load maps into
+    # memory instead of reading it. Values, including the nodes of
+    # expressions, are stored once in a pool, and the rectangles refer to
+    # them by index.
+    def save(self, path: str):
+        if self._lazy_specs:
+            raise ValueError('Applications with lazy rectangles can\'t be saved')
+        rects = self.rectangles
+        pool = _ValuePoolWriter()
+        sections = []
+        for field in _MappedRectangleStore._fields[:4]:
+            sections.append((field, array('q', getattr(rects, field)).tobytes()))
+        for field in _MappedRectangleStore._fields[4:]:
+            sections.append((field, bytes(getattr(rects, field))))
+        for column in _MappedRectangleStore._columns:
+            ids = array('i', [-1 if value is None else pool.add(value) for value in getattr(rects, column)])
+            sections.append((column, ids.tobytes()))
+        sections.append(('pool_kinds', bytes(pool.kinds)))
+        sections.append(('pool_offsets', pool.offsets.tobytes()))
+        sections.append(('pool_blob', bytes(pool.blob)))
+
+        # The header is followed by the sections, each aligned to 8 bytes.
+        # Their offsets are relative to the end of the header.
+        header = {
+            'byteorder':       sys.byteorder,
+            'root_id':         self.root_id,
+            'metadata':        self.metadata,
+            'parent_stack':    self.parent_stack,
+            'current_form_id': self.current_form_id,
+            'label_refs':      list(self.label_refs.items()),
+            'virtual_lists':   list(self._virtual_lists.items()),
+            'sections':        {},
+        }
+        offset = 0
+        for name, data in sections:
+            header['sections'][name] = (offset, len(data))
+            offset += len(data) + (-len(data) % 8)
+        header = json.dumps(header).encode()
+
+        with open(path, 'wb') as fp:
+            fp.write(_BINARY_MAGIC)
+            fp.write(struct.pack('<Q', len(header)))
+            fp.write(header)
+            fp.write(bytes(-fp.tell() % 8))
+            for name, data in sections:
+                fp.write(data)
+                fp.write(bytes(-len(data) % 8))
+
+    # Renders the document as a page of a site built by build_site. The js, if
+    # there is any, is written to a file named by its hash under js/, so that
+    # pages with the same js share it. Returns the html, the css rules of the page as
+    # (selector, declarations) pairs, and the selectors of its elements.
+    def _render_site_page(
+        self,
+        directory: str,
+        page_path: str,
+        simplify: bool = True,
+        solve: bool = True,
+        update_on_resize: bool = False,
+        share_css: bool = True,
+        minify: bool = False,
+        naming: str = 'order',
+        reduce_dom: bool = False
+    ):
+        self._start_render(simplify, solve, minify, naming)
+        if reduce_dom:
+            self._reduce_dom()
+        if share_css:
+            self._share_all_css()
+
+        js = ''.join(self._render_js(update_on_resize))
+        js_paths = []
+        if js:
+            js_paths.append(f'js/{hashlib.sha256(js.encode()).hexdigest()[:16]}.js')
+            _write_site_file(os.path.join(directory, js_paths[0]), js)
+
+        # Paths in the html are relative to the page.
+        page_dir = os.path.dirname(page_path) or '.'
+        css_path = os.path.splitext(page_path)[0] + '.css'
+        stylesheets, scripts = [
+            [os.path.relpath(path, page_dir).replace(os.sep, '/') for path in paths]
+            for paths in [['site.css', css_path], js_paths]
+        ]
+        html = self._render_html_head(stylesheets, scripts)
+        html.extend(self._render_rectangles(self._render_rect_html, 0, {}))
+        html.append(self._render_html_tail())
+
+        rects = self.rectangles
+        rules = []
+        selectors = set()
+        # Collected in a css pass, which also renders the lazy rectangles.
+        def collect_css_rule(rect_id):
+            rule = self._get_rect_css_rule(rect_id)
+            if rule is not None:
+                rules.append(rule)
+            selectors.add(f'#{self._rect_name(rect_id)}')
+            class_names = rects.class_names[rect_id]
+            if class_names:
+                selectors.update(f'.{name}' for name in class_names.split())
+            return '', ''
+        for _ in self._render_rectangles(collect_css_rule, 1, {}):
+            pass
+
+        return ''.join(html), rules, selectors, js_paths[0] if js_paths else None
+
+js_viewport_vars = {
+    'vw'  : 'window.innerWidth',
+    'vh'  : 'window.innerHeight',
+    'vmin': 'Math.min(window.innerWidth, window.innerHeight)',
+    'vmax': 'Math.max(window.innerWidth, window.innerHeight)',
+}
 
-        # @todo: Generate a single block for all resizing so that we can reuse
-        # quried variables. This requires keeping a cache of all the variables
-        # that have been rendered already.
-        # @todo: Don't generate js file if no js code emitted.
-        js = 'window.onload = () => {\n'
-        for rn in self.rectangles:
-            js += self._render_rect_js(rn)
-        js += '};\n'
+_base36_digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+# The depth below their nearest named ancestor up to which unnamed rectangles
+# are named after their path, see Application._assign_path_names.
+_max_path_name_depth = 4
+
+def _base36(n: int):
+    digits = ''
+    while True:
+        n, digit = divmod(n, 36)
+        digits = _base36_digits[digit] + digits
+        if n == 0:
+            return digits
+
+# Removes the whitespace in generated js which doesn't separate tokens.
+def _minify_js(js: str):
+    return re.sub(r' *([=,;:{}()\[\]<>]) *', r'\1', js.replace('\n', ''))
+
+# Writes a compressed copy of the file at path, with the extension of the
+# encoding appended. Compression levels are maximal, as files are only
+# compressed once, at build time.
+def _write_compressed(path: str, encoding: str):
+    with open(path, 'rb') as src:
+        if encoding == 'gz':
+            # A zero mtime keeps the output the same across builds.
+            with gzip.GzipFile(path + '.gz', 'wb', compresslevel=9, mtime=0) as dst:
+                shutil.copyfileobj(src, dst)
+        elif encoding == 'br':
+            import brotli
+            compressor = brotli.Compressor(quality=11)
+            with open(path + '.br', 'wb') as dst:
+                for chunk in iter(lambda: src.read(1 << 16), b''):
+                    dst.write(compressor.process(chunk))
+                dst.write(compressor.finish())
+        else:
+            raise ValueError(f'Unknown encoding: {encoding}')
+
+# Loads an application saved with Application.save. The file is mapped into
+# memory rather than read, so that loading is instant, and only the parts of
+# it that are used are read from disk.
+def load(path: str):
+    with open(path, 'rb') as fp:
+        if fp.read(len(_BINARY_MAGIC)) != _BINARY_MAGIC:
+            raise ValueError(f'Not a py2web tree file: {path}')
+        header_size, = struct.unpack('<Q', fp.read(8))
+        header = json.loads(fp.read(header_size))
+        data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_COPY)
+    if header['byteorder'] != sys.byteorder:
+        raise ValueError(f'Tree file has {header["byteorder"]} byte order: {path}')
+
+    start = len(_BINARY_MAGIC) + 8 + header_size
+    start += -start % 8
+    sections = {
+        name: (start + offset, size)
+        for name, (offset, size) in header['sections'].items()
+    }
+
+    app = Application()
+    app.rectangles      = _MappedRectangleStore(data, sections)
+    app.root_id         = header['root_id']
+    app.metadata        = header['metadata']
+    app.parent_stack    = header['parent_stack']
+    app.current_form_id = header['current_form_id']
+    app.label_refs      = dict(header['label_refs'])
+    app._virtual_lists  = {
+        rect_id: tuple(virtual_list) for rect_id, virtual_list in header['virtual_lists']
+    }
+    return app
+
+# Writes the file at path, creating its directory. Written to a temporary
+# file first, as pages built in parallel may write the same file.
+def _write_site_file(path: str, data: str):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as fp:
+        fp.write(data)
+    os.replace(tmp_path, path)
+
+# Builds and renders a single page of build_site, and writes its html and js.
+def _build_page(directory: str, page_path: str, builder, render_kwargs: dict):
+    start = time.perf_counter()
+    app = Application()
+    builder(app)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    html, rules, selectors, js_path = app._render_site_page(directory, page_path, **render_kwargs)
+    rules = [(selector, app._render_css_rule(selector, declarations)) for selector, declarations in rules]
+    _write_site_file(os.path.join(directory, page_path), html)
+    render_time = time.perf_counter() - start
+
+    return {
+        'path':        page_path,
+        'build_time':  build_time,
+        'render_time': render_time,
+        'html_bytes':  len(html.encode()),
+        'css_head':    app._render_css_head(),
+        'js_path':     js_path,
+        'rules':       rules,
+        'selectors':   selectors,
+    }
+
+# The render options of the pages of a site, see build_site.
+_site_render_options = [
+    'simplify', 'solve', 'update_on_resize', 'share_css', 'minify', 'naming', 'reduce_dom',
+]
+
+# Builds a site of many pages, each its own Application, in parallel. pages is
+# a list of (path, builder) pairs, where the path of the page's html is
+# relative to directory, e.g. 'about/index.html', and builder is a function
+# creating the page's rectangles in the Application passed to it. With
+# max_workers=1 the pages are built in this process, otherwise the builders
+# must be picklable, i.e. module level functions.
+# The css rules that are the same on every page they appear on are written to
+# a single site.css, shared by all pages, and the rest to a css file next to
+# each page, e.g. about/index.css. The js of each page is written to a file
+# named by its hash under js/, so that pages with the same js share a file.
+# Keyword arguments are render options, passed on to each page's render. Only
+# the options of render_iter in _site_render_options are supported, as the
+# pages are rendered into files of the site, without a cache, and each in a
+# single process. Others raise a ValueError before any page is built.
+# Returns the per page timings and a summary of the build.
+def build_site(pages, directory: str = '.', max_workers: int = None, **render_kwargs):
+    unsupported = render_kwargs.keys() - set(_site_render_options)
+    if unsupported:
+        raise ValueError(f'build_site does not support the render options: {", ".join(sorted(unsupported))}')
+
+    start = time.perf_counter()
+    if max_workers == 1:
+        results = [_build_page(directory, path, builder, render_kwargs) for path, builder in pages]
+    else:
+        paths, builders = zip(*pages) if pages else ((), ())
+        # Pages are sent to the workers in chunks, as they are usually small.
+        num_workers = max_workers or os.cpu_count() or 1
+        chunksize = builtins.max(1, len(pages) // (4 * num_workers))
+        with ProcessPoolExecutor(max_workers) as executor:
+            results = list(executor.map(
+                _build_page,
+                itertools.repeat(directory),
+                paths,
+                builders,
+                itertools.repeat(render_kwargs),
+                chunksize=chunksize
+            ))
+
+    # A rule is shared if it's the same on at least two pages, and every page
+    # with an element it selects has it, so that it doesn't apply to
+    # elements of other pages. Shared rules select a list of ids.
+    rule_pages = {}
+    for result in results:
+        for selector, rule in result['rules']:
+            rule_pages.setdefault(selector, {}).setdefault(rule, []).append(result)
+    selector_pages = {}
+    for i, result in enumerate(results):
+        for selector in result['selectors']:
+            selector_pages.setdefault(selector, set()).add(i)
+    shared = {}
+    for selector, rules in rule_pages.items():
+        if len(rules) != 1:
+            continue
+        (rule, with_rule), = rules.items()
+        pages_selected = set().union(*(selector_pages.get(s.strip(), ()) for s in selector.split(',')))
+        if len(with_rule) >= 2 and len(with_rule) == len(pages_selected):
+            shared[selector] = rule
+
+    site_css = [results[0]['css_head']] if results else []
+    site_css.extend(shared.values())
+    site_css = ''.join(site_css)
+    _write_site_file(os.path.join(directory, 'site.css'), site_css)
+
+    total_bytes = len(site_css.encode())
+    bytes_saved = 0
+    page_stats = []
+    for result in results:
+        css = []
+        for selector, rule in result['rules']:
+            if selector in shared:
+                bytes_saved += len(rule.encode())
+            else:
+                css.append(rule)
+        css = ''.join(css)
+        css_path = os.path.splitext(result['path'])[0] + '.css'
+        _write_site_file(os.path.join(directory, css_path), css)
+        page_bytes = result['html_bytes'] + len(css.encode())
+        total_bytes += page_bytes
+        page_stats.append({
+            'path':        result['path'],
+            'build_time':  result['build_time'],
+            'render_time': result['render_time'],
+            'bytes':       page_bytes,
+        })
+    # Shared rules are counted once in site.css.
+    bytes_saved -= sum(len(rule.encode()) for rule in shared.values())
+
+    js_paths = {result['js_path'] for result in results} - {None}
+    for js_path in js_paths:
+        total_bytes += os.path.getsize(os.path.join(directory, js_path))
+
+    wall_time = time.perf_counter() - start
+    return {
+        'pages': page_stats,
+        'summary': {
+            'pages':            len(results),
+            'wall_time':        wall_time,
+            'pages_per_sec':    len(results) / wall_time if wall_time > 0 else 0.0,
+            'bytes':            total_bytes,
+            'css_rules_shared': len(shared),
+            'css_bytes_saved':  bytes_saved,
+            'js_files':         len(js_paths),
+        },
+    }
+
+# The application rendered by the worker processes of
+# Application._render_partitions.
+_worker_app = None
+
+def _init_render_worker(app: 'Application'):
+    global _worker_app
+    _worker_app = app
+
+# Renders the html and css of the subtree of rect_id, and returns them along
+# with the fragments of the components in it.
+def _render_partition(rect_id: int):
+    app = _worker_app
+    fragments = {}
+    html = ''.join(app._render_rectangles(app._render_rect_html, 0, fragments, rect_id))
+    css  = ''.join(app._render_rectangles(app._render_rect_css_chunks, 1, fragments, rect_id))
+    return html, css, fragments
+
+# Yields the indices of the given byte value in data.
+def _find_all(data: bytearray, value: int):
+    i = data.find(value)
+    while i >= 0:
+        yield i
+        i = data.find(value, i + 1)
+
+# Returns the (start, end) ranges of the output covered by the chunks at the
+# given indices, merging adjacent ones. Empty chunks give empty ranges, where
+# output was removed. The chunks start offset characters into the output.
+def _get_changed_ranges(chunks, indices, offset: int):
+    # Only the lengths of the chunks up to the last changed one are summed.
+    lengths = map(len, chunks)
+    end = offset
+    index = 0
+    ranges = []
+    for i in sorted(indices):
+        start = end + sum(itertools.islice(lengths, i - index))
+        end = start + next(lengths)
+        index = i + 1
+        if ranges and ranges[-1][1] == start:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((start, end))
+    return ranges
+
+# Returns the placeholder for the width or height (varname) of a rectangle.
+def _size_var(varname: str, rect_id: int):
+    return Expression(f'{varname:<6} {rect_id}')
+
+# Parsed size placeholders by variable name, see _get_size_vars_in_expression.
+_size_var_names = {}
+
+# Returns the (varname, rect_id) pair of a size placeholder, or None if the
+# expression is not one.
+def _parse_size_var(expression: Expression):
+    return _parse_size_var_name(expression.op_or_varname)
+
+def _parse_size_var_name(varname: str):
+    val = tuple(varname.split())
+    is_size_var = len(val) == 2 and (val[0] == 'width' or val[0] == 'height')
+    if is_size_var:
+        return val[0], int(val[1])
+    return None
+
+# Returns the expression with the size placeholders found in sizes, which maps
+# (varname, rect_id) pairs to values, replaced by their value.
+def _substitute_size_vars(expression: Expression.Type, sizes: dict, cache: dict):
+    if not isinstance(expression, Expression):
+        return expression
+
+    def substitute_node(node, children):
+        if not children:
+            size_var = _parse_size_var(node)
+            return sizes.get(size_var, node) if size_var else node
+        return Expression(node.op_or_varname, children)
+
+    return _evaluate_expression(expression, substitute_node, cache)
+
+# Returns whether the expression contains any of the given variables.
+def _has_vars(expression: Expression, varnames):
+    return not _free_vars(expression).keys().isdisjoint(varnames)
+
+# Returns whether the expression depends on the size of the viewport.
+def _has_viewport_vars(expression: Expression):
+    return _has_vars(expression, js_viewport_vars)
+
+# Returns the expression with the variables found in values, which maps
+# variable names to values, replaced by their value.
+def _substitute_vars(expression: Expression, values: dict):
+    def substitute_node(node, children):
+        if not children:
+            return values.get(node.op_or_varname, node)
+        return Expression(node.op_or_varname, children)
+
+    return _evaluate_expression(expression, substitute_node, {})
+
+# Returns the given nodes along with all the nodes they depend on, with each
+# node coming after its dependencies. Dependencies closing a cycle are
+# ignored.
+def _topological_order(nodes, dependencies):
+    order = []
+    visited = set()
+    for node in nodes:
+        if node in visited:
+            continue
+
+        visited.add(node)
+        stack = [(node, iter(dependencies(node)))]
+        while stack:
+            node, deps = stack[-1]
+            for dep in deps:
+                if dep not in visited:
+                    visited.add(dep)
+                    stack.append((dep, iter(dependencies(dep))))
+                    break
+            else:
+                stack.pop()
+                order.append(node)
 
-        return html, css, js
+    return order
 
 def _get_css_color(*color):
     if len(color) == 1:
@@ -819,27 +4325,175 @@ def _get_css_color(*color):
 # Maybe we want to make a class out of this.
 Coord2d = [Expression.Type, Expression.Type]
 
+# Returns a property of Rectangle that reads and writes the given field of
+# its store, optionally wrapping the stored value when read.
+def _store_property(field: str, wrap=None):
+    def get(self):
+        value = getattr(self._store, field)[self.rect_id]
+        return value if wrap is None else wrap(value)
+
+    def set(self, value):
+        getattr(self._store, field)[self.rect_id] = value
+        self._store.mark_dirty(self.rect_id)
+
+    return property(get, set)
+
+# The style dict of a rectangle, which marks the rectangle dirty whenever it
+# is modified.
+class _Style(dict):
+    __slots__ = ('_store', '_rect_id')
+
+    def __init__(self, store: '_RectangleStore', rect_id: int):
+        super().__init__()
+        self._store   = store
+        self._rect_id = rect_id
+
+    def __reduce__(self):
+        return _Style._restore, (self._store, self._rect_id, dict(self))
+
+    @staticmethod
+    def _restore(store, rect_id, items):
+        style = _Style(store, rect_id)
+        dict.update(style, items)
+        return style
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._store.mark_dirty(self._rect_id)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._store.mark_dirty(self._rect_id)
+
+    def clear(self):
+        super().clear()
+        self._store.mark_dirty(self._rect_id)
+
+    def pop(self, *args):
+        self._store.mark_dirty(self._rect_id)
+        return super().pop(*args)
+
+    def popitem(self):
+        self._store.mark_dirty(self._rect_id)
+        return super().popitem()
+
+    def setdefault(self, key, default=None):
+        self._store.mark_dirty(self._rect_id)
+        return super().setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._store.mark_dirty(self._rect_id)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+# The position or size of a rectangle, as a view of the two columns of the
+# store holding it, e.g. x and y. It can be read and assigned to like the
+# [x, y] list rectangles used to keep, and assigning to it writes to the
+# store and marks the rectangle dirty.
+class _Coord2dView(object):
+    __slots__ = ('_store', '_rect_id', '_fields')
+
+    def __init__(self, store: '_RectangleStore', rect_id: int, fields):
+        self._store   = store
+        self._rect_id = rect_id
+        self._fields  = fields
+
+    def __len__(self):
+        return 2
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return list(self)[i]
+        return getattr(self._store, self._fields[i])[self._rect_id]
+
+    def __setitem__(self, i: int, value):
+        getattr(self._store, self._fields[i])[self._rect_id] = value
+        self._store.mark_dirty(self._rect_id)
+
+    def __iter__(self):
+        for field in self._fields:
+            yield getattr(self._store, field)[self._rect_id]
+
+    def __eq__(self, other):
+        try:
+            return len(other) == 2 and list(self) == list(other)
+        except TypeError:
+            return NotImplemented
+
+    def __repr__(self):
+        return repr(list(self))
+
+# Container of the clean rectangles, those that haven't changed since the
+# last incremental render, given the dirty array of a _RectangleStore.
+class _CleanRectangles(object):
+
+    def __init__(self, dirty: bytearray):
+        self.dirty = dirty
+
+    def __contains__(self, rect_id: int):
+        return not self.dirty[rect_id]
+
+# A handle to a rectangle in a _RectangleStore. Handles are cheap to create,
+# and compare equal if they refer to the same rectangle.
 class Rectangle(object):
-    def __init__(self):
-        rect_id       = id(self)
-        self.position = [None, None]
-        self.size     = [None, None]
-        self.grow     = None
-
-        self.pivot  = Pivot.TOP_LEFT
-        self.layout = Layout.NONE
-        self.text   = None
-        self.link   = None
-        self.image  = None
-        self.style  = {}
-
-        self.value   = None
-        self.checked = False
-
-        # Either <div> (can be link)
-        # or <form>
-        # or <input> (with input type)
-        self.type = RectType.RECT
+    __slots__ = ('_store', 'rect_id')
+
+    def __init__(self, store: '_RectangleStore', rect_id: int):
+        self._store  = store
+        self.rect_id = rect_id
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, Rectangle) and
+            self._store is other._store and
+            self.rect_id == other.rect_id
+        )
+
+    def __hash__(self):
+        return hash((id(self._store), self.rect_id))
+
+    grow    = _store_property('grow')
+    pivot   = _store_property('pivots', Pivot)
+    layout  = _store_property('layouts', Layout)
+    text    = _store_property('text')
+    link    = _store_property('link')
+    image   = _store_property('image')
+    value   = _store_property('value')
+    checked = _store_property('checked', bool)
+
+    # Either <div> (can be link)
+    # or <form>
+    # or <input> (with input type)
+    type = _store_property('types', RectType)
+
+    @property
+    def position(self):
+        return _Coord2dView(self._store, self.rect_id, ('x', 'y'))
+
+    @position.setter
+    def position(self, position: Coord2d):
+        self._store.x[self.rect_id], self._store.y[self.rect_id] = position
+        self._store.mark_dirty(self.rect_id)
+
+    @property
+    def size(self):
+        return _Coord2dView(self._store, self.rect_id, ('width', 'height'))
+
+    @size.setter
+    def size(self, size: Coord2d):
+        self._store.width[self.rect_id], self._store.height[self.rect_id] = size
+        self._store.mark_dirty(self.rect_id)
+
+    # The style dict is only allocated once it's needed.
+    @property
+    def style(self):
+        style = self._store.style[self.rect_id]
+        if style is None:
+            style = self._store.style[self.rect_id] = _Style(self._store, self.rect_id)
+        return style
 
     def set_size(self, size: Coord2d):
         self.size = size
@@ -849,16 +4503,20 @@ class Rectangle(object):
         self.grow = strictness
 
     def set_width(self, width: Expression.Type):
-        self.size[0] = width
+        self._store.width[self.rect_id] = width
+        self._store.mark_dirty(self.rect_id)
 
     def set_height(self, height: Expression.Type):
-        self.size[1] = height
+        self._store.height[self.rect_id] = height
+        self._store.mark_dirty(self.rect_id)
 
     def get_size(self):
-        rect_id = id(self)
+        rect_id = self.rect_id
+        width   = self._store.width[rect_id]
+        height  = self._store.height[rect_id]
         return [
-            self.size[0] if isinstance(self.size[0], Number) else Expression(f'width  {rect_id}'),
-            self.size[1] if isinstance(self.size[1], Number) else Expression(f'height {rect_id}')
+            width if isinstance(width, Number) else _size_var('width', rect_id),
+            height if isinstance(height, Number) else _size_var('height', rect_id)
         ]
 
     def set_position(self, position: Coord2d, pivot: Pivot = Pivot.TOP_LEFT):
@@ -869,6 +4527,20 @@ class Rectangle(object):
     def set_layout(self, layout: Layout):
         self.layout = layout
 
+    # Lays out the children in a grid, filling its cells row by row, as a
+    # flat alternative to nesting rows in a column. Columns and rows are the
+    # sizes of the tracks, with any rows beyond them sized to fit their
+    # content. Sizes, and the gap between tracks, are either numbers of
+    # pixels, expressions, or css track sizes such as '1fr' or 'auto'.
+    # Expressions can't depend on measured sizes, as grids are laid out by
+    # the browser, from the css alone.
+    def set_grid(self, columns, rows=(), gap: Expression.Type = None):
+        for size in (*columns, *rows, gap):
+            if isinstance(size, Expression) and any(map(_parse_size_var_name, _free_vars(size))):
+                raise ValueError('The track sizes of grids can\'t depend on measured sizes')
+        self._store.grid[self.rect_id] = (tuple(columns), tuple(rows), gap)
+        self.layout = Layout.GRID
+
     def set_link(self, link: str):
         self.link = link
 
@@ -0,0 +1,34 @@
+import os
+
+import pytest
+
+import py2web as pw
+
+def header(app):
+    with app.rectangle('header') as header:
+        header.set_height(60)
+        header.set_fill_color(39, 40, 34)
+
+def home(app):
+    header(app)
+    with app.rectangle('home') as home:
+        home.set_text('home')
+
+def about(app):
+    header(app)
+    with app.rectangle('about') as about:
+        about.set_text('about')
+
+def test_site_pages_share_css(tmp_path):
+    pw.build_site([('index.html', home), ('about/index.html', about)], tmp_path, max_workers=1, minify=True)
+    for path in ['site.css', 'index.html', 'about/index.html']:
+        assert os.path.exists(os.path.join(tmp_path, path))
+    with open(os.path.join(tmp_path, 'site.css')) as f:
+        assert '#header' in f.read()
+
+@pytest.mark.parametrize('option', ['cache', 'fingerprint', 'inline_threshold', 'split_depth'])
+def test_unsupported_render_options_are_rejected(tmp_path, option):
+    with pytest.raises(ValueError, match=option):
+        pw.build_site([('index.html', home)], tmp_path, max_workers=1, **{option: 1})
+    # Nothing is built.
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,64 @@
+import pytest
+
+import py2web as pw
+from py2web import ParentExtent, ViewportWidth
+
+def gallery(columns, rows=(), gap=None, num_tiles=6):
+    app = pw.Application()
+    tiles = []
+    with app.rectangle('gallery') as gallery:
+        gallery.set_width(400)
+        gallery.set_grid(columns, rows, gap)
+        for i in range(num_tiles):
+            with app.rectangle() as tile:
+                tile.set_text(f'tile {i}')
+                tiles.append(tile)
+    return app, tiles
+
+def gallery_css(css):
+    return css.split('#gallery {')[1].split('}')[0]
+
+def test_tracks_are_rendered_as_grid_templates():
+    app, tiles = gallery([100, 100, 100], [50, '1fr'], 10)
+    html, css, js = app.render()
+    declarations = gallery_css(css)
+    assert 'display: grid;' in declarations
+    assert 'grid-template-columns: repeat(3, 100px);' in declarations
+    assert 'grid-template-rows: 50px 1fr;' in declarations
+    assert 'gap: 10px;' in declarations
+    assert js == ''
+    # The tiles are all children of the grid.
+    assert html.count('<div') == 7
+
+def test_expression_tracks_are_rendered_with_calc():
+    app, tiles = gallery([ViewportWidth / 4, '2fr'])
+    html, css, js = app.render()
+    assert 'grid-template-columns: calc(' in gallery_css(css)
+    assert '2fr;' in gallery_css(css)
+
+def test_tracks_cant_depend_on_measured_sizes():
+    app, tiles = gallery(['1fr'])
+    with pytest.raises(ValueError):
+        tiles[0].set_grid([tiles[1].get_size()[0]])
+
+def test_percentages_of_grid_items_are_measured():
+    # The containing block of a grid item is its cell, not the grid, so the
+    # width of the tile isn't half that of the grid.
+    app, tiles = gallery([100, 100])
+    tiles[0].set_width(ParentExtent * 0.5)
+    with app.rectangle('copy') as copy:
+        copy.set_width(tiles[0].get_size()[0])
+    html, css, js = app.render()
+    assert 'getBoundingClientRect' in js
+    assert '#copy' not in css
+
+def test_reduce_dom_leaves_grids_alone():
+    app = pw.Application()
+    with app.rectangle('gallery') as gallery:
+        gallery.set_grid([100, 100])
+        with app.rectangle('tile') as tile:
+            tile.set_text('tile')
+        app.spacer(10)
+    html, css, js = app.render(reduce_dom=True)
+    assert app.render_stats['dom_nodes_removed'] == 0
+    assert html.count('<div') == 3
@@ -0,0 +1,56 @@
+import os
+import re
+import shutil
+import subprocess
+
+import pytest
+
+import py2web as pw
+from py2web import Layout
+
+# A column of texts, each followed by a rectangle as wide as the text, which
+# is measured in js, and some rectangles named by the user.
+def page():
+    app = pw.Application()
+    with app.rectangle('main') as main:
+        main.set_layout(Layout.COLUMN)
+        for i in range(40):
+            with app.rectangle() as text:
+                text.set_text(f'text {i}')
+            with app.rectangle() as bar:
+                bar.set_width(text.get_size()[0] + 10)
+                bar.set_height(20)
+                bar.set_fill_color(i % 3, 0, 0)
+        with app.rectangle('_user_name') as named:
+            named.set_text('named')
+    return app
+
+def test_names_are_valid_and_unique():
+    html, css, js = page().render(minify=True)
+    ids = re.findall(r'id="([^"]*)"', html)
+    assert len(ids) == len(set(ids))
+    for name in ids:
+        assert re.fullmatch(r'-?[_a-zA-Z][_a-zA-Z0-9-]*', name), name
+    assert 'main' in ids and '_user_name' in ids
+    # Generated names don't collide with the names given by the user.
+    assert not any(name.startswith('_user') for name in ids if name != '_user_name')
+    for selector in re.findall(r'#([_a-zA-Z0-9-]+)', css + js):
+        assert selector in ids
+
+def test_minified_output_is_smaller_and_lays_out_the_same():
+    html, css, js = page().render()
+    minified_html, minified_css, minified_js = page().render(minify=True)
+    assert len(minified_html) < len(html)
+    assert len(minified_css) < len(css)
+    assert len(minified_js) < len(js)
+    assert '\n' not in minified_css and '\n' not in minified_js
+    assert minified_js.count('getBoundingClientRect') == js.count('getBoundingClientRect')
+
+@pytest.mark.skipif(shutil.which('node') is None, reason='requires node')
+def test_minified_js_parses(tmp_path):
+    for options in [{}, {'update_on_resize': True}]:
+        html, css, js = page().render(minify=True, **options)
+        path = os.path.join(tmp_path, 'code.js')
+        with open(path, 'w') as f:
+            f.write(js)
+        subprocess.run(['node', '--check', path], check=True)
@@ -0,0 +1,45 @@
+import re
+
+import pytest
+
+import py2web as pw
+
+def ids(html):
+    return re.findall(r'id="([^"]*)"', html)
+
+def test_path_names_follow_the_tree():
+    app = pw.Application()
+    with app.rectangle('header'):
+        with app.rectangle():
+            pass
+        with app.rectangle():
+            with app.rectangle():
+                pass
+    html, css, js = app.render(naming='path')
+    assert ids(html) == ['body', 'header', 'header-0', 'header-1', 'header-1-0']
+
+def test_deep_path_names_are_bounded():
+    app = pw.Application()
+    app.push_rectangle('main')
+    for _ in range(20000):
+        app.push_rectangle()
+    with app.rectangle():
+        pass
+    for minify in (False, True):
+        html, css, js = app.render(naming='path', minify=minify)
+        names = ids(html)
+        assert len(set(names)) == len(names)
+        assert max(len(name) for name in names) <= 20
+    # Shallow rectangles keep their readable path.
+    html, css, js = app.render(naming='path')
+    assert ids(html)[:6] == ['body', 'main', 'main-0', 'main-0-0', 'main-0-0-0', 'main-0-0-0-0']
+
+def test_the_body_name_is_reserved():
+    app = pw.Application()
+    with pytest.raises(ValueError):
+        app.push_rectangle('body')
+    with app.rectangle('main'):
+        with pytest.raises(ValueError):
+            app.push_rectangle('body')
+    html, css, js = app.render(naming='path')
+    assert ids(html) == ['body', 'main']
@@ -0,0 +1,57 @@
+import pickle
+
+import py2web as pw
+from py2web import Layout, ViewportWidth
+
+# A page of sections, each with a header component and rows of texts, some of
+# which are sized after measured texts in other sections.
+def page():
+    app = pw.Application()
+    texts = []
+    with app.rectangle('main') as main:
+        main.set_layout(Layout.COLUMN)
+        for i in range(6):
+            with app.rectangle() as section:
+                section.set_layout(Layout.COLUMN)
+                with app.component() as header:
+                    header.set_text('header')
+                    header.set_fill_color(39, 40, 34)
+                for j in range(5):
+                    with app.rectangle() as row:
+                        row.set_layout(Layout.ROW)
+                        with app.rectangle() as text:
+                            text.set_text(f'{i} {j}')
+                            text.style['color'] = 'red' if j % 2 else 'blue'
+                            texts.append(text)
+                        with app.rectangle() as bar:
+                            bar.set_width(texts[(i * 7 + j) % len(texts)].get_size()[0] + 5)
+                            bar.set_height(ViewportWidth * 0.01)
+    return app
+
+def test_parallel_output_is_the_same_as_serial():
+    app = page()
+    for options in [{}, {'minify': True}, {'share_css': False, 'update_on_resize': True}]:
+        expected = app.render(**options)
+        for split_depth in (1, 2, 3):
+            assert app.render(max_workers=2, split_depth=split_depth, **options) == expected
+
+def test_parallel_output_with_cache_is_the_same_as_serial():
+    app = page()
+    expected = app.render(cache=pw.RenderCache())
+    cache = pw.RenderCache()
+    assert app.render(cache=cache, max_workers=2) == expected
+    # Components found in the cache are reused by the workers as well.
+    assert app.render(cache=cache, max_workers=2) == expected
+
+def test_deep_expressions_are_pickled():
+    # Worker processes which aren't forked get the application pickled.
+    app = pw.Application()
+    width = ViewportWidth
+    for _ in range(20000):
+        width = width * 0.5 + 1
+    with app.rectangle('a') as a:
+        a.set_width(width)
+    with app.rectangle('b') as b:
+        b.set_width(a.get_size()[0] * 2)
+    expected = app.render()
+    assert pickle.loads(pickle.dumps(app)).render() == expected
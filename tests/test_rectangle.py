@@ -0,0 +1,26 @@
+import py2web as pw
+
+def test_writes_to_position_and_size_are_kept():
+    app = pw.Application()
+    with app.rectangle('box') as box:
+        box.set_position([0, 0])
+        box.set_size([100, 50])
+    box.position[0] = 10
+    box.size[1] = 20
+    assert box.position == [10, 0]
+    assert box.size == [100, 20]
+    assert list(box.size) == [100, 20]
+    html, css, js = app.render()
+    declarations = css.split('#box {')[1].split('}')[0]
+    assert 'left: 10px;' in declarations
+    assert 'height: 20px;' in declarations
+
+def test_writes_to_position_and_size_are_rendered_incrementally():
+    app = pw.Application()
+    with app.rectangle('box') as box:
+        box.set_size([100, 50])
+    app.render_incremental()
+    box.size[0] = 200
+    html, css, js, ranges = app.render_incremental()
+    assert 'width: 200px;' in css
+    assert ranges['css']
@@ -0,0 +1,111 @@
+import re
+
+import py2web as pw
+from py2web import Layout
+
+# Returns the css declarations of each id selector.
+def declarations_by_id(css):
+    declarations = {}
+    for selectors, body in re.findall(r'([^{}]+)\{([^}]*)\}', css):
+        for selector in selectors.split(','):
+            selector = selector.strip()
+            if selector.startswith('#'):
+                declarations[selector[1:]] = body
+    return declarations
+
+def ids(html):
+    return re.findall(r'id="([^"]*)"', html)
+
+# A row whose children are centered by growing spacers and separated by
+# fixed ones, and a column with a wrapper centering a text.
+def centered():
+    app = pw.Application()
+    with app.rectangle('row') as row:
+        row.set_layout(Layout.ROW)
+        row.set_width(300)
+        app.spacer()
+        for i, name in enumerate(['a', 'b', 'c']):
+            if i:
+                app.spacer(10)
+            with app.rectangle(name) as item:
+                item.set_width(50)
+        app.spacer()
+    with app.rectangle('column') as column:
+        column.set_layout(Layout.COLUMN)
+        with app.rectangle() as wrapper:
+            wrapper.set_layout(Layout.ROW)
+            app.spacer()
+            with app.rectangle('text') as text:
+                text.set_text('text')
+            app.spacer()
+    return app
+
+def test_spacers_become_flex_properties():
+    app = centered()
+    html, css, js = app.render()
+    assert len(ids(html)) == 14
+
+    html, css, js = app.render(reduce_dom=True)
+    assert ids(html) == ['body', 'row', 'a', 'b', 'c', 'column', 'text']
+    assert app.render_stats['dom_nodes_removed'] == 7
+    declarations = declarations_by_id(css)
+    assert 'justify-content: center;' in declarations['row']
+    assert 'gap: 10px;' in declarations['row']
+    assert 'align-self: center;' in declarations['text']
+    assert not any('margin' in body for body in declarations.values())
+
+def test_uneven_spacers_become_margins():
+    app = pw.Application()
+    with app.rectangle('row') as row:
+        row.set_layout(Layout.ROW)
+        row.set_width(300)
+        for name, space in [('a', 10), ('b', 20), ('c', 5)]:
+            with app.rectangle(name) as item:
+                item.set_width(50)
+            app.spacer(space)
+    html, css, js = app.render(reduce_dom=True)
+    assert ids(html) == ['body', 'row', 'a', 'b', 'c']
+    declarations = declarations_by_id(css)
+    assert 'margin-left: 10px;' in declarations['b']
+    assert 'margin-left: 20px;' in declarations['c']
+    assert 'margin-right: 5px;' in declarations['c']
+
+def test_measured_spacers_are_kept():
+    app = pw.Application()
+    with app.rectangle('row') as row:
+        row.set_layout(Layout.ROW)
+        with app.rectangle('a') as a:
+            a.set_text('a')
+        app.spacer()
+        spacer = app.rectangles.rectangle(len(app.rectangles) - 1)
+        with app.rectangle('b') as b:
+            b.set_width(spacer.get_size()[0] + 1)
+    html, css, js = app.render(reduce_dom=True)
+    assert app.render_stats['dom_nodes_removed'] == 0
+    assert html == app.render()[0]
+    for name in re.findall(r"querySelector\('#([^']*)'\)", js):
+        assert name in ids(html)
+
+def test_cached_components_keep_spacers_referenced_by_the_page():
+    # The same component is rendered on two pages, and on the second one, the
+    # size of its spacer is referred to by a rectangle outside of it.
+    def page(refer):
+        app = pw.Application()
+        with app.component() as header:
+            header.set_layout(Layout.ROW)
+            header.set_width(300)
+            app.spacer()
+            spacer = app.rectangles.rectangle(len(app.rectangles) - 1)
+            with app.rectangle() as title:
+                title.set_text('title')
+        with app.rectangle('bar') as bar:
+            bar.set_width(spacer.get_size()[0] + 1 if refer else 10)
+        return app
+
+    cache = pw.RenderCache()
+    page(False).render(reduce_dom=True, cache=cache)
+    app = page(True)
+    html, css, js = app.render(reduce_dom=True, cache=cache)
+    assert (html, css, js) == app.render(reduce_dom=True, cache=pw.RenderCache())
+    for name in re.findall(r"querySelector\('#([^']*)'\)", js):
+        assert name in ids(html)
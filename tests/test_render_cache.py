@@ -0,0 +1,48 @@
+import re
+import py2web as pw
+from py2web import Layout
+
+def header(app):
+    with app.component() as header:
+        header.set_layout(Layout.ROW)
+        app.spacer(10)
+        with app.rectangle() as home:
+            home.set_text('HOME')
+            home.set_text_color(248, 248, 242)
+        with app.component('menu') as menu:
+            menu.set_layout(Layout.ROW)
+            with app.rectangle() as item:
+                item.set_text('Blog')
+        app.spacer()
+
+# A page with the header after num_before other rectangles, so that the
+# rect_ids of the header differ between pages.
+def page(num_before, cache, minify=False):
+    app = pw.Application()
+    for i in range(num_before):
+        with app.rectangle() as rect:
+            rect.set_text(f'Paragraph {i}')
+    header(app)
+    return app, app.render(cache=cache, minify=minify)
+
+def test_components_are_reused_across_pages():
+    for minify in [False, True]:
+        cache = pw.RenderCache()
+        first, _ = page(0, cache, minify)
+        assert first.render_stats['components_cached'] == 0
+        second, output = page(5, cache, minify)
+        assert second.render_stats['components_cached'] == 1
+
+        # The cached header is the same as the one rendered anew.
+        _, expected = page(5, pw.RenderCache(), minify)
+        assert output == expected
+
+def test_identical_components_on_a_page_get_distinct_names():
+    app = pw.Application()
+    with app.component() as first:
+        first.set_text('Same')
+    with app.component() as second:
+        second.set_text('Same')
+    html, _, _ = app.render(cache=pw.RenderCache())
+    ids = re.findall(r'id="([^"]*)"', html)
+    assert len(ids) == len(set(ids))
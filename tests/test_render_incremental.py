@@ -0,0 +1,41 @@
+import py2web as pw
+from py2web import Layout
+
+# A column of rows of items, all of which have the same style.
+def rows(num_rows):
+    app = pw.Application()
+    items = []
+    with app.rectangle('main') as main:
+        main.set_layout(Layout.COLUMN)
+        for i in range(num_rows):
+            with app.rectangle() as row:
+                row.set_layout(Layout.ROW)
+                for j in range(3):
+                    with app.rectangle() as item:
+                        item.set_text(f'{i} {j}')
+                        item.style['color'] = 'blue'
+                        items.append(item)
+    return app, items
+
+def test_text_changes_only_render_the_changed_rectangle():
+    app, items = rows(100)
+    app.render_incremental()
+    items[50].set_text('changed')
+    html, css, js, ranges = app.render_incremental()
+    assert app.render_stats['rectangles_rendered'] == 1
+    assert (html, css, js) == app.render()
+
+def test_style_changes_move_rectangles_between_shared_rules():
+    app, items = rows(100)
+    app.render_incremental()
+    # The first item leaves the shared rule, so the next one owns it, and
+    # two items share a new one.
+    for item in (items[0], items[10]):
+        item.style['color'] = 'red'
+        html, css, js, ranges = app.render_incremental()
+        assert app.render_stats['rectangles_rendered'] <= 3
+        assert (html, css, js) == app.render()
+    for item in (items[0], items[10]):
+        del item.style['color']
+        html, css, js, ranges = app.render_incremental()
+        assert (html, css, js) == app.render()
@@ -0,0 +1,38 @@
+import py2web as pw
+
+# A page with a text and a rectangle as wide as the text, which is measured
+# in js.
+def page():
+    app = pw.Application()
+    with app.rectangle('text') as text:
+        text.set_text('text')
+    with app.rectangle('bar') as bar:
+        bar.set_width(text.get_size()[0])
+    return app
+
+def test_js_is_rendered_after_the_html_and_css():
+    app = page()
+    events = []
+    render_js = app._render_js
+    def recording_render_js(*args, **kwargs):
+        for chunk in render_js(*args, **kwargs):
+            events.append('render js')
+            yield chunk
+    app._render_js = recording_render_js
+
+    chunks = []
+    for stream, chunk in app.render_iter():
+        events.append(stream)
+        chunks.append((stream, chunk))
+    assert events[0] == 'html'
+    assert events.index('render js') > len(events) - events[::-1].index('css') - 1
+    assert [stream for stream, _ in chunks][-1] == 'js'
+    assert '<script src="code.js"></script>' in ''.join(c for s, c in chunks if s == 'html')
+
+def test_pages_without_js_dont_refer_to_it():
+    app = pw.Application()
+    with app.rectangle('text') as text:
+        text.set_text('text')
+    streams = [stream for stream, _ in app.render_iter()]
+    assert 'js' not in streams
+    assert '<script' not in app.render()[0]
@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+import py2web as pw
+from py2web import Layout, Pivot, ViewportWidth
+
+# A page with texts, links, images, inputs, styles and expression-valued
+# geometry, with the parent stack left open at 'main', so that rectangles
+# added later go into it.
+def page():
+    app = pw.Application()
+    app.set_metadata('<meta name="description" content="saved">')
+    app.push_rectangle('main')
+    main = app.rectangles.rectangle(app.parent_stack[-1])
+    main.set_layout(Layout.COLUMN)
+    with app.rectangle('header', 'top') as header:
+        header.set_size([ViewportWidth, 60])
+        header.set_fill_color(39, 40, 34)
+        header.style['text-decoration'] = 'none'
+        with app.rectangle() as link:
+            link.set_link('about/')
+            link.set_text('About')
+            link.set_position([10, 0.5 * header.get_size()[1] - 0.5 * link.get_size()[1]], Pivot.TOP_RIGHT)
+    for i in range(20):
+        with app.rectangle() as row:
+            row.set_layout(Layout.ROW)
+            row.set_grow(1)
+            with app.rectangle() as text:
+                text.set_text(f'row {i}')
+            with app.rectangle() as image:
+                image.set_image('icon.png')
+                image.set_size([text.get_size()[1], text.get_size()[1]])
+    with app.form('form') as form:
+        textbox, label = app.textbox_input()
+        textbox.set_input_value('value')
+        label.set_text('Value')
+        checkbox, label = app.checkbox_input()
+        checkbox.set_input_checked()
+    return app
+
+def save_and_load(app, tmp_path):
+    path = os.path.join(tmp_path, 'page.py2web')
+    app.save(path)
+    return pw.load(path)
+
+def test_loaded_app_renders_the_same(tmp_path):
+    app = page()
+    loaded = save_and_load(app, tmp_path)
+    assert len(loaded.rectangles) == len(app.rectangles)
+    for options in [{}, {'minify': True, 'update_on_resize': True}]:
+        assert loaded.render(**options) == app.render(**options)
+
+def test_loaded_app_can_be_changed(tmp_path):
+    app = page()
+    loaded = save_and_load(app, tmp_path)
+    for a in (app, loaded):
+        rects = a.rectangles
+        header = rects.rectangle(list(rects.names).index('header'))
+        header.set_text('changed')
+        header.style['color'] = 'red'
+        with a.rectangle('footer') as footer:
+            footer.set_height(40)
+    assert loaded.render() == app.render()
+
+def test_other_files_are_rejected(tmp_path):
+    path = os.path.join(tmp_path, 'page.html')
+    with open(path, 'w') as f:
+        f.write('<html></html>')
+    with pytest.raises(ValueError):
+        pw.load(path)
@@ -0,0 +1,41 @@
+import re
+
+import py2web as pw
+
+# Three rectangles with the same style, one with another style and one
+# without any.
+def page():
+    app = pw.Application()
+    for name in ['a', 'b', 'c']:
+        with app.rectangle(name) as rect:
+            rect.set_fill_color(255, 0, 0)
+            rect.set_height(10)
+    with app.rectangle('d') as rect:
+        rect.set_fill_color(0, 0, 255)
+    with app.rectangle('e'):
+        pass
+    return app
+
+def test_shared_rules_select_ids():
+    app = page()
+    html, css, js = app.render()
+    # The rule keeps the specificity of an id selector, so no classes are
+    # added to the elements.
+    assert 'class=' not in html
+    assert re.search(r'#a,\s*#b,\s*#c \{', css)
+    assert len(re.findall(r'height: 10px;', css)) == 1
+    assert '#d {' in css
+    assert '#e' not in css
+    assert app.render_stats['css_rules_shared'] == 1
+
+def test_bytes_saved_are_counted():
+    app = page()
+    for minify in (False, True):
+        unshared_css = app.render(share_css=False, minify=minify)[1]
+        css = app.render(minify=minify)[1]
+        assert app.render_stats['css_bytes_saved'] == len(unshared_css) - len(css)
+
+def test_rules_are_not_shared_if_disabled():
+    html, css, js = page().render(share_css=False)
+    for name in ['a', 'b', 'c', 'd']:
+        assert f'#{name} {{' in css
@@ -0,0 +1,66 @@
+import random
+
+import py2web as pw
+from py2web import Expression, simplify_expression
+
+VARIABLES = ['vw', 'vh', 'a', 'b']
+
+# Evaluates the expression with the given values of its variables.
+def evaluate(expression, values):
+    if not isinstance(expression, Expression):
+        return expression
+    op = expression.op_or_varname
+    if not expression.children:
+        return values[op]
+    args = [evaluate(c, values) for c in expression.children]
+    if op == 'add':
+        return args[0] + args[1]
+    if op == 'sub':
+        return args[0] - args[1]
+    if op == 'mul':
+        return args[0] * args[1]
+    if op == 'fdiv':
+        return args[0] / args[1]
+    if op == 'min':
+        return min(args)
+    if op == 'max':
+        return max(args)
+    raise ValueError(op)
+
+# A random expression of the variables, where divisions are by constants
+# other than 0.
+def random_expression(rng, depth):
+    if depth == 0 or rng.random() < 0.2:
+        if rng.random() < 0.5:
+            return rng.choice([0, 1, -1, 2, 0.5, 10])
+        return Expression(rng.choice(VARIABLES))
+    kind = rng.choice(['add', 'sub', 'mul', 'fdiv', 'min', 'max'])
+    a = random_expression(rng, depth - 1)
+    if kind == 'add':
+        return a + random_expression(rng, depth - 1)
+    if kind == 'sub':
+        return a - random_expression(rng, depth - 1)
+    if kind == 'mul':
+        return a * rng.choice([0, 1, -1, 2, 3])
+    if kind == 'fdiv':
+        return a / rng.choice([1, 2, 4])
+    args = [random_expression(rng, depth - 1) for _ in range(rng.randint(1, 3))]
+    return (pw.min if kind == 'min' else pw.max)(a, *args)
+
+def test_simplified_expressions_have_the_same_value():
+    rng = random.Random(0)
+    for _ in range(500):
+        expression = random_expression(rng, 5)
+        simplified = simplify_expression(expression)
+        for _ in range(3):
+            values = {v: rng.uniform(-100, 100) for v in VARIABLES}
+            expected = evaluate(expression, values)
+            assert abs(evaluate(simplified, values) - expected) <= 1e-9 * max(1, abs(expected))
+
+def test_identities_and_constants_are_removed():
+    vw = Expression('vw')
+    assert simplify_expression(vw + 0) is vw
+    assert simplify_expression(vw * 1) is vw
+    assert simplify_expression(Expression('add', (2, 3))) == 5
+    assert simplify_expression(vw + vw - vw * 2) == 0
+    assert simplify_expression(pw.min(pw.min(vw, 10), 20)) is pw.min(vw, 10)
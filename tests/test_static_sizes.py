@@ -0,0 +1,74 @@
+import py2web as pw
+from py2web import Layout, ParentExtent, ViewportWidth
+
+# A row of the given width with two items of 200px, the first of which has a
+# child half its width, and a rectangle whose width is set to that of the
+# child, which is solved at build time if the width of the first item is
+# known.
+def row_with_items(row_width, **item_style):
+    app = pw.Application()
+    with app.rectangle('row') as row:
+        row.set_layout(Layout.ROW)
+        row.set_width(row_width)
+        with app.rectangle('first') as first:
+            first.set_width(200)
+            first.style.update(item_style)
+            with app.rectangle('half') as half:
+                half.set_width(ParentExtent * 0.5)
+        with app.rectangle('second') as second:
+            second.set_width(200)
+    with app.rectangle('copy') as copy:
+        copy.set_width(half.get_size()[0])
+    return app
+
+def test_items_that_fit_are_solved():
+    html, css, js = row_with_items(400).render()
+    assert js == ''
+    assert 'width: 100.0px;' in css.split('#copy')[1]
+
+def test_items_that_overflow_are_measured():
+    # The items shrink to fit the row, so the width of the first one is only
+    # known once laid out.
+    html, css, js = row_with_items(300).render()
+    assert 'getBoundingClientRect' in js
+
+def test_items_that_cant_shrink_are_solved():
+    html, css, js = row_with_items(300, **{'flex-shrink': '0'}).render()
+    assert js == ''
+
+# A link a quarter of the viewport wide in a parent of the given layout, and a
+# rectangle whose width is set to that of the link.
+def sized_link(layout, position=None):
+    app = pw.Application()
+    with app.rectangle('parent') as parent:
+        parent.set_layout(layout)
+        with app.rectangle('link') as link:
+            link.set_link('about/')
+            link.set_text('About')
+            link.set_width(ViewportWidth * 0.25)
+            if position is not None:
+                link.set_position(position)
+    with app.rectangle('copy') as copy:
+        copy.set_width(link.get_size()[0])
+    return app
+
+def test_inline_elements_are_measured():
+    # The width of an inline <a> is that of its text, not the one set.
+    html, css, js = sized_link(Layout.NONE).render()
+    assert 'getBoundingClientRect' in js
+
+def test_inline_elements_laid_out_or_positioned_are_solved():
+    for app in [sized_link(Layout.COLUMN), sized_link(Layout.GRID), sized_link(Layout.NONE, [0, 0])]:
+        html, css, js = app.render()
+        assert js == ''
+
+def test_labels_are_measured():
+    app = pw.Application()
+    with app.form('form'):
+        textbox, label = app.textbox_input('textbox')
+        label.set_text('Name')
+        label.set_width(ViewportWidth * 0.25)
+    with app.rectangle('copy') as copy:
+        copy.set_width(label.get_size()[0])
+    html, css, js = app.render()
+    assert 'getBoundingClientRect' in js
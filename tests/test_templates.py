@@ -0,0 +1,65 @@
+import pytest
+
+import py2web as pw
+from py2web import Layout
+
+# A card with a title, a link, an image and an input, whose values are set
+# by fill.
+def card():
+    app = pw.Application()
+    with app.rectangle('card') as card:
+        card.set_layout(Layout.COLUMN)
+        with app.rectangle('title') as title:
+            title.set_font_size(20)
+        with app.rectangle('link') as link:
+            link.set_text('More')
+        with app.rectangle('image') as image:
+            image.set_size([64, 64])
+        with app.form('form'):
+            textbox, label = app.textbox_input('textbox')
+    return app, (title, link, image, textbox)
+
+def fill(rects, title, link, image, value, description=None):
+    title_rect, link_rect, image_rect, textbox_rect = rects
+    title_rect.set_text(title)
+    if description is not None:
+        link_rect.set_text(description)
+    link_rect.set_link(link)
+    image_rect.set_image(image)
+    textbox_rect.set_input_value(value)
+
+def test_template_renders_like_the_document():
+    app, rects = card()
+    fill(rects, pw.slot('title'), pw.slot('link'), pw.slot('image'), pw.slot('value'))
+    template = app.compile_template()
+    records = [
+        {'title': 'First', 'link': 'first/', 'image': 'first.png', 'value': 1},
+        {'title': 'Second', 'link': 'second/', 'image': 'second.png', 'value': 'two'},
+    ]
+    for record in records:
+        fill(rects, record['title'], record['link'], record['image'], str(record['value']))
+        assert template.render(record) == app.render()
+
+def test_slot_values_are_escaped():
+    app, rects = card()
+    fill(rects, pw.slot('title'), pw.slot('link'), pw.slot('image'), pw.slot('value'))
+    template = app.compile_template()
+    html, css, js = template.render({
+        'title': 'A <b>&</b>', 'link': 'a?b=1&c=2', 'image': 'b.png', 'value': '"quoted"'
+    })
+    assert 'A &lt;b&gt;&amp;&lt;/b&gt;' in html
+    assert 'href="a?b=1&amp;c=2"' in html
+    assert 'value="&quot;quoted&quot;"' in html
+
+def test_unescaped_slots_are_inserted_as_is():
+    app, rects = card()
+    fill(rects, 'Title', 'link/', 'image.png', '', description=pw.slot('description', escape=False))
+    template = app.compile_template()
+    html, css, js = template.render({'description': '<em>More</em>'})
+    assert '<em>More</em>' in html
+
+def test_slots_outside_of_the_html_are_rejected():
+    app, rects = card()
+    rects[0].style['font-family'] = pw.slot('font')
+    with pytest.raises(ValueError):
+        app.compile_template()